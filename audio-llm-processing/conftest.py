@@ -0,0 +1,8 @@
+import os
+import sys
+
+# The service modules read their configuration when imported and import each other by bare name
+os.environ.setdefault("SECONDS_PER_PROMPT", "10")
+os.environ.setdefault("PROMPT_TEMPLATE", "{prompt}")
+os.environ.setdefault("OTEL_SDK_DISABLED", "true")
+sys.path.insert(0, os.path.dirname(__file__))
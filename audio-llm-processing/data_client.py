@@ -2,8 +2,10 @@ import requests
 import json
 import os
 from pydantic import BaseModel
-from typing import Optional, Dict
+from typing import Iterator, Optional, Dict
 from dotenv import load_dotenv
+from processing_metrics import time_stage
+from processing_tracing import inject_trace_headers
 
 load_dotenv()
 
@@ -12,22 +14,37 @@ host = os.getenv("DATA_STORE_API_URL")
 
 def update_transcription(recording_id: str, transcription: str):
     request_payload = {"transcription": transcription}
-    response = requests.put(
-        url=f"{host}/recordings/{recording_id}/transcription",
-        data=json.dumps(request_payload),
-    )
+    with time_stage("data_api"):
+        response = requests.put(
+            url=f"{host}/recordings/{recording_id}/transcription",
+            data=json.dumps(request_payload),
+            headers=inject_trace_headers({"Content-Type": "application/json"}),
+        )
     print(response.json())
 
 
 def update_prompts(recording_id: str, prompts: list[str]):
     request_payload = {"prompts": prompts}
-    response = requests.put(
-        url=f"{host}/recordings/{recording_id}/prompts",
-        data=json.dumps(request_payload),
-    )
+    with time_stage("data_api"):
+        response = requests.put(
+            url=f"{host}/recordings/{recording_id}/prompts",
+            data=json.dumps(request_payload),
+            headers=inject_trace_headers({"Content-Type": "application/json"}),
+        )
     print(json.dumps(response.json(), indent=4))
 
 
+def update_voice_activity(recording_id: str, status: str, duration: float, speech_duration: float):
+    request_payload = {"status": status, "duration": duration, "speech_duration": speech_duration}
+    with time_stage("data_api"):
+        response = requests.put(
+            url=f"{host}/recordings/{recording_id}/voice-activity",
+            json=request_payload,
+            headers=inject_trace_headers(),
+        )
+    response.raise_for_status()
+
+
 class ImageGenerationCreate(BaseModel):
     audio_recording_id: int
     prompt: str
@@ -36,13 +53,17 @@ class ImageGenerationCreate(BaseModel):
     request_payload: Optional[Dict] = None
     status: str = "pending"
     duration: Optional[float] = None
+    speculative: bool = False
+    variant: Optional[str] = None
 
 
 def create_image_generation(recording_id: str, image_generation: ImageGenerationCreate):
-    response = requests.post(
-        url=f"{host}/recordings/{recording_id}/image-generations/",
-        data=image_generation.model_dump_json(),
-    )
+    with time_stage("data_api"):
+        response = requests.post(
+            url=f"{host}/recordings/{recording_id}/image-generations/",
+            data=image_generation.model_dump_json(),
+            headers=inject_trace_headers({"Content-Type": "application/json"}),
+        )
     print(response.json())
     return response.json()["id"]
 
@@ -51,10 +72,12 @@ def create_image_generations_batch(
     recording_id: str, image_generations: list[ImageGenerationCreate]
 ):
     request_payload = {"generations": [gen.model_dump() for gen in image_generations]}
-    response = requests.post(
-        url=f"{host}/recordings/{recording_id}/image-generations/batch",
-        json=request_payload,
-    )
+    with time_stage("data_api"):
+        response = requests.post(
+            url=f"{host}/recordings/{recording_id}/image-generations/batch",
+            json=request_payload,
+            headers=inject_trace_headers(),
+        )
     print("Created image generations response:")
     print(response.json())
     return [gen["id"] for gen in response.json()]
@@ -71,9 +94,120 @@ class ImageGenerationUpdate(BaseModel):
 
 def update_image_generation(
     recording_id: str, generation_id: str, image_generation: ImageGenerationUpdate
-):
-    response = requests.put(
-        url=f"{host}/recordings/{recording_id}/image-generations/{generation_id}",
-        data=image_generation.model_dump_json(),
+) -> bool:
+    """Update an image generation, False if it was cancelled and keeps that status"""
+    with time_stage("data_api"):
+        response = requests.put(
+            url=f"{host}/recordings/{recording_id}/image-generations/{generation_id}",
+            data=image_generation.model_dump_json(),
+            headers=inject_trace_headers({"Content-Type": "application/json"}),
+        )
+    if response.status_code == 409:
+        return False
+    response.raise_for_status()
+    return True
+
+
+def get_speculation_candidates(limit: int) -> list[dict]:
+    with time_stage("data_api"):
+        response = requests.get(
+            url=f"{host}/speculation/candidates",
+            params={"limit": limit},
+            headers=inject_trace_headers(),
+        )
+    response.raise_for_status()
+    return response.json()
+
+
+def get_recording_tree(recording_id: str) -> list[dict]:
+    with time_stage("data_api"):
+        response = requests.get(url=f"{host}/recordings/{recording_id}/tree", headers=inject_trace_headers())
+    response.raise_for_status()
+    return response.json()
+
+
+def list_recordings(
+    created_after: Optional[str] = None,
+    created_before: Optional[str] = None,
+    page_size: int = 500,
+) -> Iterator[dict]:
+    """Every recording created within the date range, fetched a page at a time"""
+    after_id = 0
+    while True:
+        with time_stage("data_api"):
+            response = requests.get(
+                url=f"{host}/recordings/",
+                params={
+                    "created_after": created_after,
+                    "created_before": created_before,
+                    "after_id": after_id,
+                    "limit": page_size,
+                },
+                headers=inject_trace_headers(),
+            )
+        response.raise_for_status()
+        recordings = response.json()
+        yield from recordings
+        if len(recordings) < page_size:
+            return
+        after_id = recordings[-1]["id"]
+
+
+def claim_job(worker_id: str, capabilities: list[str], lease_seconds: float) -> Optional[dict]:
+    """Lease the next job this worker can run, None if there is nothing to do"""
+    response = requests.post(
+        url=f"{host}/jobs/claim",
+        json={"worker_id": worker_id, "capabilities": capabilities, "lease_seconds": lease_seconds},
     )
-    print(response.json())
+    response.raise_for_status()
+    if response.status_code == 204:
+        return None
+    return response.json()
+
+
+def heartbeat_job(job_id: int, worker_id: str, lease_seconds: float) -> bool:
+    """Extend a job's lease, False if the lease was lost and the job should be abandoned"""
+    response = requests.post(
+        url=f"{host}/jobs/{job_id}/heartbeat",
+        json={"worker_id": worker_id, "lease_seconds": lease_seconds},
+        headers=inject_trace_headers(),
+    )
+    if response.status_code in (404, 409):
+        return False
+    response.raise_for_status()
+    return True
+
+
+def complete_job(job_id: int, worker_id: str, result: dict):
+    with time_stage("data_api"):
+        response = requests.post(
+            url=f"{host}/jobs/{job_id}/complete",
+            json={"worker_id": worker_id, "result": result},
+            headers=inject_trace_headers(),
+        )
+    response.raise_for_status()
+
+
+def fail_job(job_id: int, worker_id: str, error: str, retry: bool = True):
+    with time_stage("data_api"):
+        response = requests.post(
+            url=f"{host}/jobs/{job_id}/fail",
+            json={"worker_id": worker_id, "error": error, "retry": retry},
+            headers=inject_trace_headers(),
+        )
+    response.raise_for_status()
+
+
+def download_recording_audio(recording_id: str, path: str, chunk_size: int = 2**20) -> str:
+    """Stream a recording's stored audio from the data API into path"""
+    with time_stage("data_api"):
+        with requests.get(
+            url=f"{host}/recordings/{recording_id}/audio",
+            headers=inject_trace_headers(),
+            stream=True,
+        ) as response:
+            response.raise_for_status()
+            with open(path, "wb") as f:
+                for chunk in response.iter_content(chunk_size):
+                    f.write(chunk)
+    return path
@@ -2,16 +2,24 @@ import requests
 import json
 import os
 from dataclasses import dataclass
+from collections import deque
+from typing import Callable, Iterator, Optional, Tuple, Union
 import time
 import logging
 from dotenv import load_dotenv
 import base64
+from processing_tracing import inject_trace_headers
 
 load_dotenv()
 
 logger = logging.getLogger(__name__)
 
 host = os.getenv("IMAGE_GENERATION_API_URL")
+HEALTH_CHECK_TIMEOUT = 2  # Seconds to wait for Fooocus when checking readiness
+STOP_TIMEOUT = 5  # Seconds to wait for Fooocus to take a stop, callers cancelling work wait for it
+# Async jobs of a batch queued in Fooocus at once, enough to start the next without a gap while
+# few enough that a stopped batch leaves little behind
+BATCH_MAX_SUBMITTED = 2
 
 
 @dataclass
@@ -23,6 +31,10 @@ class ImageGenerationResult:
     image_data: bytes
 
 
+class BatchJobAbandoned(TimeoutError):
+    """A batch stopped waiting for a job Fooocus may still render, retrying it would render it twice"""
+
+
 def text2img(params: dict) -> dict:
     """
     text to image
@@ -30,15 +42,27 @@ def text2img(params: dict) -> dict:
     result = requests.post(
         url=f"{host}/v1/generation/text-to-image",
         data=json.dumps(params),
-        headers={"Content-Type": "application/json"},
+        headers=inject_trace_headers({"Content-Type": "application/json"}),
     )
     return result.json()
 
 
-def generate_image(prompt: str, styles: list[str], negative_prompt: str = None):
-    print(f"Generating image for prompt: {prompt}")
-    time_start = time.time()
-    params = {
+def stop_generation():
+    """Abort the generation Fooocus is currently running"""
+    requests.post(url=f"{host}/v1/generation/stop", headers=inject_trace_headers(), timeout=STOP_TIMEOUT)
+
+
+def check_fooocus() -> bool:
+    """Whether the Fooocus API answers"""
+    try:
+        requests.get(url=f"{host}/ping", timeout=HEALTH_CHECK_TIMEOUT).raise_for_status()
+        return True
+    except requests.RequestException:
+        return False
+
+
+def get_generation_params(prompt: str, styles: list[str], negative_prompt: str = None) -> dict:
+    return {
         "prompt": prompt,
         "negative_prompt": negative_prompt,
         "aspect_ratios_selection": "1024*1024",
@@ -49,16 +73,25 @@ def generate_image(prompt: str, styles: list[str], negative_prompt: str = None):
             "overwrite_switch": 1,
         }
     }
-    result = text2img(params)
-    logger.info(json.dumps(result, indent=4))
-    image_url = result[0]["url"]
+
+
+def read_image_data(image_url: str) -> bytes:
     if image_url.startswith('data:'):
         # Handle data URL
         # Remove the data URL prefix and get the base64 data
-        image_data = base64.b64decode(image_url.split(',')[1])
-    else:
-        # Handle regular URL
-        image_data = requests.get(image_url).content
+        return base64.b64decode(image_url.split(',')[1])
+    # Handle regular URL
+    return requests.get(image_url, headers=inject_trace_headers()).content
+
+
+def generate_image(prompt: str, styles: list[str], negative_prompt: str = None):
+    print(f"Generating image for prompt: {prompt}")
+    time_start = time.time()
+    params = get_generation_params(prompt, styles, negative_prompt)
+    result = text2img(params)
+    logger.info(json.dumps(result, indent=4))
+    image_url = result[0]["url"]
+    image_data = read_image_data(image_url)
     duration = time.time() - time_start
     logger.info(f"Time taken: {duration} seconds")
 
@@ -69,3 +102,83 @@ def generate_image(prompt: str, styles: list[str], negative_prompt: str = None):
         duration=duration,
         image_data=image_data,
     )
+
+
+def query_job(job_id: str) -> dict:
+    result = requests.get(
+        url=f"{host}/v1/generation/query-job",
+        params={"job_id": job_id, "require_step_preview": "false"},
+        headers=inject_trace_headers(),
+    )
+    return result.json()
+
+
+def generate_images_batch(
+    prompts: list[str],
+    styles: list[str],
+    negative_prompt: str = None,
+    poll_interval: float = 0.5,
+    timeout: float = 300,
+    should_stop: Optional[Callable[[], bool]] = None,
+    max_submitted: int = BATCH_MAX_SUBMITTED,
+    allow_stop: bool = True,
+) -> Iterator[Tuple[int, Union[ImageGenerationResult, Exception]]]:
+    """
+    Render the prompts as async Fooocus jobs, keeping max_submitted of them queued so Fooocus
+    runs them back to back without an HTTP round trip and queueing gap in between, and yield
+    (index, result) in completion order. Failed jobs yield their exception instead of a result.
+    Once should_stop answers True, the timeout passes or the caller stops iterating, the rest
+    of the prompts are not submitted and the job Fooocus is running is stopped, unless allow_stop
+    is False because stopping Fooocus would also abort the renders of other workers sharing it.
+    """
+    time_start = time.time()
+    unsubmitted = deque(enumerate(prompts))
+    jobs = {}
+    try:
+        while unsubmitted or jobs:
+            if should_stop is not None and should_stop():
+                return
+            while unsubmitted and len(jobs) < max_submitted:
+                index, prompt = unsubmitted.popleft()
+                params = get_generation_params(prompt, styles, negative_prompt)
+                try:
+                    result = text2img({**params, "async_process": True})
+                    jobs[result["job_id"]] = (index, params)
+                except Exception as e:
+                    yield index, e
+            if not jobs:
+                continue
+            if time.time() - time_start > timeout:
+                for index, _ in jobs.values():
+                    yield index, BatchJobAbandoned(f"Image job did not finish within {timeout} seconds")
+                for index, _ in unsubmitted:
+                    yield index, TimeoutError(f"Batch timed out before image {index} was submitted")
+                return
+            time.sleep(poll_interval)
+            for job_id, (index, params) in list(jobs.items()):
+                try:
+                    job = query_job(job_id)
+                    if job["job_stage"] not in ("SUCCESS", "ERROR"):
+                        continue
+                    del jobs[job_id]
+                    if job["job_stage"] == "ERROR" or not job.get("job_result"):
+                        raise RuntimeError(f"Image job {job_id} failed: {job.get('job_status')}")
+                    image_url = job["job_result"][0]["url"]
+                    yield index, ImageGenerationResult(
+                        url=image_url,
+                        seed=job["job_result"][0]["seed"],
+                        request_payload=params,
+                        duration=time.time() - time_start,
+                        image_data=read_image_data(image_url),
+                    )
+                except Exception as e:
+                    jobs.pop(job_id, None)
+                    yield index, e
+    finally:
+        if jobs:
+            logger.info(f"Dropping unfinished async image jobs {', '.join(jobs)}")
+        if jobs and allow_stop:
+            try:
+                stop_generation()
+            except Exception as e:
+                logger.warning(f"Could not stop the running image job: {str(e)}")
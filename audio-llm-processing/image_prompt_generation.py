@@ -1,14 +1,29 @@
-import ollama
 import json
 from typing import List
+from processing_metrics import RETRIES
+from processing_tracing import inject_trace_headers
 
 PROMPT_COUNT = 6
+HEALTH_CHECK_TIMEOUT = 2  # Seconds to wait for Ollama when checking readiness
+
+def check_ollama() -> bool:
+    """Whether the Ollama server answers"""
+    import ollama
+
+    try:
+        ollama.Client(timeout=HEALTH_CHECK_TIMEOUT).list()
+        return True
+    except Exception:
+        return False
 
 def get_image_prompts(text: str, ollama_model: str = "llama3.1:8b", prompt_count: int = PROMPT_COUNT, max_retries: int = 4) -> List[str]:
+    # Imported on first use so the processor API starts without waiting for the client library
+    import ollama
+
     retries = 0
     while retries < max_retries:
         try:
-            model = ollama.generate(
+            model = ollama.Client(headers=inject_trace_headers()).generate(
                 model=ollama_model,
                 prompt=f"Generate {prompt_count} image prompts for the following text: {text}. Respond in a JSON string array format only `[\"prompt1\", \"prompt2\", ...]`, no other text.",
                 stream=False
@@ -25,4 +40,5 @@ def get_image_prompts(text: str, ollama_model: str = "llama3.1:8b", prompt_count
             retries += 1
             if retries == max_retries:
                 raise Exception(f"Failed to parse JSON response after {max_retries} attempts. Last error: {str(e)}")
+            RETRIES.labels(stage="ollama").inc()
             print(f"Failed to parse JSON (attempt {retries}/{max_retries}). Retrying...")
\ No newline at end of file
@@ -1,7 +1,11 @@
 from contextlib import asynccontextmanager
-from fastapi import FastAPI
+from fastapi import FastAPI, HTTPException, Request, Response
+from fastapi.responses import JSONResponse
+from opentelemetry import trace
+from prometheus_client import generate_latest, CONTENT_TYPE_LATEST
 from pydantic import BaseModel
-from processing_service import AudioProcessingService
+from processing_service import AudioProcessingService, WORKER_MODE
+from processing_tracing import tracer, configure_tracing, extract_trace_context
 from dotenv import load_dotenv
 import logging
 
@@ -13,28 +17,86 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 
 load_dotenv()
+configure_tracing("branches-audio-processing")
 
 processing_service = AudioProcessingService()
 
 class ProcessingRequest(BaseModel):
     recording_id: str
     source_file: str
+    # Jump ahead of all queued work, for a recording superseding the ones before it
+    urgent: bool = False
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    """Handle startup/shutdown events"""
+    """Handle startup/shutdown events, the Whisper model keeps loading in the background after startup"""
     processing_service.start()
     yield
     processing_service.stop()
 
 app = FastAPI(lifespan=lifespan)
 
+@app.middleware("http")
+async def trace_requests(request: Request, call_next):
+    """Continue the data API's trace so queued work stays correlated with its recording"""
+    with tracer.start_as_current_span(
+        f"{request.method} {request.url.path}",
+        context=extract_trace_context(dict(request.headers)),
+        kind=trace.SpanKind.SERVER,
+    ) as span:
+        response = await call_next(request)
+        span.set_attribute("http.status_code", response.status_code)
+        return response
+
 @app.post("/process-audio/")
-async def process_audio(request: ProcessingRequest):
+def process_audio(request: ProcessingRequest):
+    # A plain def runs in the thread pool, preempting may wait on Fooocus to stop a render
+    if WORKER_MODE == "pull":
+        raise HTTPException(status_code=409, detail="This worker pulls its jobs from the data API")
     logger.info(f"Received processing request for recording_id: {request.recording_id}")
-    processing_service.add_processing_request(
-        request.recording_id,
-        request.source_file
-    )
+    try:
+        processing_service.add_processing_request(
+            request.recording_id,
+            request.source_file,
+            request.urgent,
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=409, detail=str(e))
     logger.info(f"Added recording {request.recording_id} to processing queue")
-    return {"status": "processing", "recording_id": request.recording_id}
\ No newline at end of file
+    trace.get_current_span().set_attribute("recording.id", request.recording_id)
+    return {"status": "processing", "recording_id": request.recording_id}
+
+@app.post("/recordings/{recording_id}/cancel")
+def cancel_recording(recording_id: str):
+    """Drop the recording's queued work, abort its render in flight where possible and mark its images cancelled"""
+    if WORKER_MODE == "pull":
+        raise HTTPException(status_code=409, detail="This worker pulls its jobs, cancel them in the data API")
+    trace.get_current_span().set_attribute("recording.id", recording_id)
+    return processing_service.cancel_recording(recording_id)
+
+@app.post("/recordings/{recording_id}/preempt")
+def preempt_recording(recording_id: str):
+    """Move the recording's queued work ahead of everything else, including images waiting to be retried"""
+    if WORKER_MODE == "pull":
+        raise HTTPException(status_code=409, detail="This worker pulls its jobs, preempt them in the data API")
+    trace.get_current_span().set_attribute("recording.id", recording_id)
+    try:
+        return processing_service.preempt_recording(recording_id)
+    except ValueError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+
+@app.get("/health")
+async def health():
+    """Liveness, answers as soon as the API is up even while the models are still loading"""
+    return {"status": "ok"}
+
+@app.get("/ready")
+def ready():
+    """Readiness, whether the Whisper model is loaded and Ollama and Fooocus are reachable"""
+    readiness = processing_service.get_readiness()
+    return JSONResponse(content=readiness, status_code=200 if readiness["ready"] else 503)
+
+@app.get("/metrics")
+async def metrics():
+    """Prometheus metrics for the processing stages and queues"""
+    return Response(content=generate_latest(), media_type=CONTENT_TYPE_LATEST)
@@ -0,0 +1,124 @@
+import time
+from contextlib import contextmanager
+from prometheus_client import Counter, Gauge, Histogram
+from processing_tracing import tracer
+
+# Stage latencies range from a few milliseconds (file writes) to minutes (Fooocus under load)
+STAGE_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120, 300)
+
+STAGE_LATENCY = Histogram(
+    "branches_processing_stage_seconds",
+    "Latency of a single processing stage",
+    ["stage"],
+    buckets=STAGE_BUCKETS,
+)
+QUEUE_DEPTH = Gauge(
+    "branches_processing_queue_depth",
+    "Number of items waiting in a processing queue",
+    ["queue"],
+)
+STAGE_QUEUE_WAIT = Histogram(
+    "branches_processing_stage_queue_wait_seconds",
+    "Time a recording waited in a pipeline stage's queue before a worker picked it up",
+    ["stage"],
+    buckets=STAGE_BUCKETS,
+)
+STAGE_IN_FLIGHT = Gauge(
+    "branches_processing_stage_in_flight",
+    "Number of recordings a pipeline stage's workers are currently handling",
+    ["stage"],
+)
+RETRIES = Counter(
+    "branches_processing_retries_total",
+    "Number of retried attempts per stage",
+    ["stage"],
+)
+FAILURES = Counter(
+    "branches_processing_failures_total",
+    "Number of failed attempts per stage",
+    ["stage"],
+)
+SPECULATIVE_GENERATIONS = Counter(
+    "branches_processing_speculative_generations_total",
+    "Speculative image generations rendered while idle, by outcome",
+    ["outcome"],
+)
+VOICE_ACTIVITY = Counter(
+    "branches_processing_voice_activity_total",
+    "Recordings by voice activity detection outcome, speech, empty or uncertain",
+    ["status"],
+)
+CANCELLATIONS = Counter(
+    "branches_processing_cancellations_total",
+    "Queued or in flight work dropped because its recording was cancelled, by where it was",
+    ["stage"],
+)
+PREEMPTIONS = Counter(
+    "branches_processing_preemptions_total",
+    "Recordings whose queued work was moved ahead of everything else",
+)
+IMAGE_BATCH_SIZE = Histogram(
+    "branches_processing_image_batch_size",
+    "Number of images submitted to Fooocus together",
+    buckets=(1, 2, 3, 4, 6, 8, 12, 16),
+)
+TIME_TO_FIRST_IMAGE = Histogram(
+    "branches_processing_time_to_first_image_seconds",
+    "Time from a recording entering the processor to its first completed image",
+    buckets=STAGE_BUCKETS,
+)
+
+
+@contextmanager
+def time_stage(stage: str):
+    """Observe the duration of the wrapped block as a histogram sample and a trace span,
+    counting a failure if it raises"""
+    start_time = time.perf_counter()
+    with tracer.start_as_current_span(stage) as span:
+        try:
+            yield span
+        except Exception:
+            FAILURES.labels(stage=stage).inc()
+            raise
+        finally:
+            STAGE_LATENCY.labels(stage=stage).observe(time.perf_counter() - start_time)
+
+
+def histogram_summary(histogram: Histogram, quantiles=(0.5, 0.95, 0.99), **labels) -> dict:
+    """Summarize a histogram as count, average and bucket-interpolated quantiles"""
+    buckets = []
+    count = 0.0
+    total = 0.0
+    for metric in histogram.collect():
+        for sample in metric.samples:
+            if any(sample.labels.get(k) != v for k, v in labels.items()):
+                continue
+            if sample.name.endswith("_bucket"):
+                buckets.append((float(sample.labels["le"]), sample.value))
+            elif sample.name.endswith("_count"):
+                count = sample.value
+            elif sample.name.endswith("_sum"):
+                total = sample.value
+
+    summary = {"count": int(count), "avg_time": total / max(1, count)}
+    for q in quantiles:
+        summary[f"p{round(q * 100)}"] = _bucket_quantile(q, buckets, count)
+    return summary
+
+
+def _bucket_quantile(q: float, buckets: list[tuple[float, float]], count: float) -> float:
+    """Linear interpolation within the bucket holding the quantile, like PromQL histogram_quantile"""
+    if count == 0:
+        return 0.0
+    rank = q * count
+    lower_bound, lower_count = 0.0, 0.0
+    for upper_bound, cumulative in sorted(buckets):
+        if cumulative >= rank:
+            if upper_bound == float("inf"):
+                return lower_bound
+            in_bucket = cumulative - lower_count
+            if in_bucket == 0:
+                return upper_bound
+            return lower_bound + (upper_bound - lower_bound) * (rank - lower_count) / in_bucket
+        lower_bound, lower_count = upper_bound, cumulative
+    return lower_bound
@@ -0,0 +1,173 @@
+import heapq
+import logging
+import threading
+import time
+from dataclasses import dataclass, field
+from queue import Full, Queue
+from typing import Callable, Optional
+import numpy as np
+from processing_metrics import CANCELLATIONS, QUEUE_DEPTH, STAGE_IN_FLIGHT, STAGE_QUEUE_WAIT, time_stage
+from processing_tracing import attach_trace_context
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class RecordingJob:
+    """A recording moving through the pipeline, each stage filling in its result"""
+
+    recording_id: str
+    source_file: str
+    trace_carrier: dict
+    received_time: float = field(default_factory=time.time)
+    enqueued_time: float = 0.0
+    source_file_path: Optional[str] = None
+    audio: Optional[np.ndarray] = None
+    duration: Optional[float] = None
+    # Seconds of speech voice activity detection found, prompts are counted from it
+    speech_duration: Optional[float] = None
+    transcription: Optional[str] = None
+    prompts: Optional[list[str]] = None
+    # Preempted, queued in every stage ahead of the jobs that are not
+    urgent: bool = False
+
+
+def remove_queued(queue: Queue, predicate: Callable[[object], bool]) -> list:
+    """Take the items matching predicate out of a Queue or PriorityQueue, the others keep their order"""
+    with queue.mutex:
+        removed = [item for item in queue.queue if predicate(item)]
+        if not removed:
+            return []
+        kept = [item for item in queue.queue if not predicate(item)]
+        if isinstance(queue.queue, list):
+            heapq.heapify(kept)
+        queue.queue.clear()
+        queue.queue.extend(kept)
+        # As if every removed item was taken and finished, so join() and put() do not wait for them
+        queue.unfinished_tasks -= len(removed)
+        if not queue.unfinished_tasks:
+            queue.all_tasks_done.notify_all()
+        queue.not_full.notify(len(removed))
+    return removed
+
+
+class PipelineStage:
+    """
+    A bounded queue drained by its own worker threads. Each job the handler returns is put on
+    the next stage, blocking while that stage is full so a slow stage backs up its producers.
+    Returning None drops the job from the pipeline, as does is_cancelled answering True for its
+    recording before or after the handler runs. Jobs of recordings is_urgent answers True for are
+    queued ahead of the others, and on_leave is called for every job that does not go on to the
+    next stage.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        handler: Callable[[RecordingJob], Optional[RecordingJob]],
+        workers: int,
+        maxsize: int,
+        next_stage: Optional["PipelineStage"] = None,
+        is_cancelled: Optional[Callable[[str], bool]] = None,
+        is_urgent: Optional[Callable[[str], bool]] = None,
+        on_leave: Optional[Callable[[str], None]] = None,
+    ):
+        self.name = name
+        self.handler = handler
+        self.workers = workers
+        self.queue = Queue(maxsize=maxsize)
+        self.next_stage = next_stage
+        self.is_cancelled = is_cancelled or (lambda recording_id: False)
+        self.is_urgent = is_urgent or (lambda recording_id: False)
+        self.on_leave = on_leave or (lambda recording_id: None)
+        self.threads: list[threading.Thread] = []
+        QUEUE_DEPTH.labels(queue=name).set_function(self.queue.qsize)
+
+    def start(self):
+        for index in range(self.workers):
+            thread = threading.Thread(target=self._work, name=f"{self.name}-{index}")
+            thread.daemon = True
+            thread.start()
+            self.threads.append(thread)
+
+    def stop(self):
+        for _ in self.threads:
+            self.queue.put(None)  # Sentinel to stop one worker
+        for thread in self.threads:
+            thread.join()
+        self.threads = []
+
+    def put(self, job: RecordingJob, block: bool = True):
+        job.enqueued_time = time.time()
+        job.urgent = job.urgent or self.is_urgent(job.recording_id)
+        if not job.urgent:
+            self.queue.put(job, block=block)
+            return
+        # As Queue.put, but inserted behind the urgent jobs at the front instead of at the back
+        with self.queue.not_full:
+            while 0 < self.queue.maxsize <= len(self.queue.queue):
+                if not block:
+                    raise Full
+                self.queue.not_full.wait()
+            position = 0
+            while position < len(self.queue.queue) and getattr(self.queue.queue[position], "urgent", False):
+                position += 1
+            self.queue.queue.insert(position, job)
+            self.queue.unfinished_tasks += 1
+            self.queue.not_empty.notify()
+
+    def remove(self, recording_id: str) -> int:
+        """Drop the recording's jobs waiting in this stage, returning how many there were"""
+        removed = remove_queued(self.queue, lambda job: job is not None and job.recording_id == recording_id)
+        CANCELLATIONS.labels(stage=self.name).inc(len(removed))
+        for job in removed:
+            self.on_leave(job.recording_id)
+        return len(removed)
+
+    def prioritize(self, recording_id: str) -> int:
+        """Move the recording's waiting jobs to the front of this stage, returning how many there were"""
+        with self.queue.mutex:
+            matching = [job for job in self.queue.queue if job is not None and job.recording_id == recording_id]
+            for job in matching:
+                job.urgent = True
+            if matching:
+                others = [job for job in self.queue.queue if job is None or job.recording_id != recording_id]
+                self.queue.queue.clear()
+                self.queue.queue.extend(matching + others)
+        return len(matching)
+
+    def _work(self):
+        while True:
+            job = self.queue.get()
+            if job is None:  # Sentinel value to stop the thread
+                logger.info(f"Received stop signal, stopping {threading.current_thread().name}")
+                break
+
+            STAGE_QUEUE_WAIT.labels(stage=self.name).observe(time.time() - job.enqueued_time)
+            if self.is_cancelled(job.recording_id):
+                logger.info(f"Dropping cancelled recording {job.recording_id} from the {self.name} stage")
+                CANCELLATIONS.labels(stage=self.name).inc()
+                self.on_leave(job.recording_id)
+                self.queue.task_done()
+                continue
+            STAGE_IN_FLIGHT.labels(stage=self.name).inc()
+            moved_on = False
+            try:
+                with attach_trace_context(job.trace_carrier), time_stage(self.name) as span:
+                    span.set_attribute("recording.id", job.recording_id)
+                    result = self.handler(job)
+                if result is not None and self.is_cancelled(job.recording_id):
+                    logger.info(f"Recording {job.recording_id} was cancelled during the {self.name} stage")
+                    CANCELLATIONS.labels(stage=self.name).inc()
+                elif result is not None and self.next_stage is not None:
+                    self.next_stage.put(result)
+                    moved_on = True
+            except Exception as e:
+                logger.error(
+                    f"Error in {self.name} stage for {job.recording_id}: {str(e)}", exc_info=True
+                )
+            finally:
+                if not moved_on:
+                    self.on_leave(job.recording_id)
+                STAGE_IN_FLIGHT.labels(stage=self.name).dec()
+                self.queue.task_done()
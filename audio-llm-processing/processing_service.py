@@ -1,25 +1,56 @@
-from queue import Queue, PriorityQueue
+from queue import Queue, PriorityQueue, Empty, Full
 import threading
 import math
-from typing import Optional, Tuple
-import whisper
-import librosa
+import socket
+import tempfile
+from contextlib import contextmanager
+from typing import TYPE_CHECKING, Optional, Tuple
 from data_client import (
     update_transcription,
     update_prompts,
+    create_image_generation,
     create_image_generations_batch,
     update_image_generation,
+    get_speculation_candidates,
+    download_recording_audio,
+    update_voice_activity,
     ImageGenerationUpdate,
     ImageGenerationCreate,
 )
-from image_prompt_generation import get_image_prompts
-from image_generation import generate_image, ImageGenerationResult
+from image_prompt_generation import get_image_prompts, check_ollama
+from image_generation import (
+    check_fooocus,
+    generate_image,
+    generate_images_batch,
+    stop_generation,
+    ImageGenerationResult,
+    BatchJobAbandoned,
+)
 from datetime import datetime
 import logging
 import os
 from dotenv import load_dotenv
 import time
-from collections import defaultdict
+from processing_metrics import (
+    STAGE_LATENCY,
+    QUEUE_DEPTH,
+    RETRIES,
+    TIME_TO_FIRST_IMAGE,
+    SPECULATIVE_GENERATIONS,
+    IMAGE_BATCH_SIZE,
+    VOICE_ACTIVITY,
+    CANCELLATIONS,
+    PREEMPTIONS,
+    time_stage,
+    histogram_summary,
+)
+from processing_tracing import tracer, inject_trace_headers, extract_trace_context
+from processing_pipeline import PipelineStage, RecordingJob, remove_queued
+from processing_worker import PullWorker
+from voice_activity import VAD_ENABLED, detect_voice_activity
+
+if TYPE_CHECKING:
+    import whisper
 
 load_dotenv()
 
@@ -33,13 +64,41 @@ prompt_template = os.getenv("PROMPT_TEMPLATE")
 negative_prompt = os.getenv("NEGATIVE_PROMPT")
 image_generations_path = os.getenv("IMAGE_GENERATIONS_PATH")
 audio_recordings_path = os.getenv("AUDIO_RECORDINGS_PATH")
+# "file" reads recordings from AUDIO_RECORDINGS_PATH, "http" downloads them from the data API
+audio_source = os.getenv("AUDIO_SOURCE", "file")
 ollama_model = os.getenv("OLLAMA_MODEL")
+whisper_model_name = os.getenv("WHISPER_MODEL", "medium")
 
 # Configuration
-MAX_QUEUE_SIZE = 1000  # Maximum number of items in each queue
+MAX_QUEUE_SIZE = 1000  # Maximum number of items in the incoming recording and image generation queues
+STAGE_QUEUE_SIZE = int(os.getenv("STAGE_QUEUE_SIZE", "8"))  # Maximum recordings waiting between pipeline stages
+# Worker threads per pipeline stage. Every transcribe worker gets its own Whisper model.
+STAGE_WORKERS = {
+    "decode": int(os.getenv("DECODE_WORKERS", "1")),
+    "transcribe": int(os.getenv("TRANSCRIBE_WORKERS", "1")),
+    "prompt": int(os.getenv("PROMPT_WORKERS", "2")),
+    "register": int(os.getenv("REGISTER_WORKERS", "1")),
+    "image": int(os.getenv("IMAGE_WORKERS", "1")),
+}
+# "push" processes recordings the data API posts to /process-audio/, "pull" claims jobs from the data API
+WORKER_MODE = os.getenv("WORKER_MODE", "push")
+WORKER_ID = os.getenv("WORKER_ID", f"{socket.gethostname()}-{os.getpid()}")
+# Work this worker takes on in pull mode: whisper transcribes, llm writes prompts, image renders
+WORKER_CAPABILITIES = os.getenv("WORKER_CAPABILITIES", "whisper,llm,image").split(",")
+JOB_LEASE_SECONDS = float(os.getenv("JOB_LEASE_SECONDS", "60"))  # Lease length, renewed while a job runs
+JOB_POLL_SECONDS = float(os.getenv("JOB_POLL_SECONDS", "1"))  # Wait between claims while there is no work
+MODEL_WAIT_POLL_SECONDS = 1  # How often workers waiting for the model check for shutdown
 MAX_RETRIES = 3  # Maximum number of retries for failed image generations
-RETRY_DELAY = 5  # Delay in seconds between retries
+RETRY_DELAY = 5  # Delay in seconds before a failed image is queued again, other images render meanwhile
+URGENT_PRIORITY = -1_000_000  # Added to the image queue priority of preempted recordings so they render first
 SECONDS_PER_PROMPT = int(os.getenv("SECONDS_PER_PROMPT")) # Number of seconds in audio to generate one prompt
+IMAGE_BATCHING = os.getenv("IMAGE_BATCHING", "false").lower() == "true"  # Submit a recording's prompts to Fooocus together
+IMAGE_BATCH_MAX_SIZE = int(os.getenv("IMAGE_BATCH_MAX_SIZE", "8"))  # Maximum prompts per batch
+IMAGE_BATCH_TARGET_SECONDS = float(os.getenv("IMAGE_BATCH_TARGET_SECONDS", "20"))  # Batch duration to size batches for
+SPECULATIVE_GENERATION = os.getenv("SPECULATIVE_GENERATION", "false").lower() == "true"  # Render extra variants while idle
+SPECULATIVE_IDLE_SECONDS = float(os.getenv("SPECULATIVE_IDLE_SECONDS", "10"))  # Idle time before speculating
+SPECULATIVE_CANDIDATES = 5  # Number of popular recordings considered for each speculative generation
+SPECULATIVE_SEED_VARIANTS = int(os.getenv("SPECULATIVE_SEED_VARIANTS", "1"))  # Alternate seeds per prompt
 
 def get_image_file_name(file_base_name: str, image_generation_id: str, index: int, style: str):
     iso_date = datetime.now().isoformat()
@@ -48,16 +107,111 @@ def get_image_file_name(file_base_name: str, image_generation_id: str, index: in
     return file_name
 
 
+def get_image_file_style(styles: list[str]) -> str:
+    return "+".join(styles)
+
+
+class AdaptiveBatchSize:
+    """Batch size expected to finish within a target time, from a moving average of seconds per image"""
+
+    def __init__(self, target_seconds: float, max_size: int, smoothing: float = 0.3):
+        self.target_seconds = target_seconds
+        self.max_size = max_size
+        self.smoothing = smoothing
+        self.seconds_per_image: Optional[float] = None
+        self.lock = threading.Lock()
+
+    def observe(self, batch_seconds: float, image_count: int):
+        per_image = batch_seconds / image_count
+        with self.lock:
+            if self.seconds_per_image is None:
+                self.seconds_per_image = per_image
+            else:
+                self.seconds_per_image += self.smoothing * (per_image - self.seconds_per_image)
+
+    @property
+    def size(self) -> int:
+        with self.lock:
+            if self.seconds_per_image is None:
+                return min(2, self.max_size)  # Measure with a small batch first
+            return max(1, min(self.max_size, int(self.target_seconds / self.seconds_per_image)))
+
+
+def get_speculative_variants() -> list[Tuple[str, list[str]]]:
+    """Variant name and style selection of every extra rendering of a prompt, each style on its own then alternate seeds"""
+    variants = [(f"style:{style}", [style]) for style in STYLES]
+    variants += [(f"seed:{seed_index}", STYLES) for seed_index in range(1, SPECULATIVE_SEED_VARIANTS + 1)]
+    return variants
+
+
 class AudioProcessingService:
     def __init__(self):
         logger.info("Initializing AudioProcessingService")
-        self.new_recording_queue = Queue(maxsize=MAX_QUEUE_SIZE)  # Queue for new recording requests
         self.image_generation_queue = PriorityQueue(maxsize=MAX_QUEUE_SIZE)  # Queue for image generation tasks
-        self.whisper_model: Optional[whisper.Whisper] = None
+        # Recordings flow decode -> transcribe -> prompt -> register, which queues their images,
+        # so Whisper on one recording overlaps with Ollama on the previous one and Fooocus on earlier ones
+        self.register_stage = PipelineStage(
+            "register", self._register_prompts, STAGE_WORKERS["register"], STAGE_QUEUE_SIZE,
+            is_cancelled=self._is_cancelled, is_urgent=self._is_urgent, on_leave=self._finish_work,
+        )
+        self.prompt_stage = PipelineStage(
+            "prompt", self._generate_prompts, STAGE_WORKERS["prompt"], STAGE_QUEUE_SIZE, self.register_stage,
+            is_cancelled=self._is_cancelled, is_urgent=self._is_urgent, on_leave=self._finish_work,
+        )
+        self.transcribe_stage = PipelineStage(
+            "transcribe", self._transcribe, STAGE_WORKERS["transcribe"], STAGE_QUEUE_SIZE, self.prompt_stage,
+            is_cancelled=self._is_cancelled, is_urgent=self._is_urgent, on_leave=self._finish_work,
+        )
+        self.decode_stage = PipelineStage(
+            "decode", self._decode_audio, STAGE_WORKERS["decode"], MAX_QUEUE_SIZE, self.transcribe_stage,
+            is_cancelled=self._is_cancelled, is_urgent=self._is_urgent, on_leave=self._finish_work,
+        )
+        self.stages = [self.decode_stage, self.transcribe_stage, self.prompt_stage, self.register_stage]
+        # In pull mode the service keeps no queues of its own, workers lease jobs from the data API
+        self.pull_workers = [
+            PullWorker(
+                WORKER_ID, capability, handler, STAGE_WORKERS[stage], JOB_LEASE_SECONDS, JOB_POLL_SECONDS, on_lease_lost
+            )
+            for capability, handler, stage, on_lease_lost in [
+                ("whisper", self._run_transcribe_job, "transcribe", None),
+                ("llm", self._run_prompts_job, "prompt", None),
+                ("image", self._run_image_job, "image", self._abort_image_job),
+            ]
+            if capability in WORKER_CAPABILITIES
+        ]
+        # Whisper hooks its kv-cache into the model while decoding, so concurrent transcriptions
+        # each take a model of their own from this pool, one per transcribe worker
+        self.whisper_models: Queue["whisper.Whisper"] = Queue()
+        # Whisper and torch load in the background so requests are queued while the model warms up
+        self.models_ready = threading.Event()
+        self.model_load_error: Optional[Exception] = None
+        self.model_thread: Optional[threading.Thread] = None
         self.is_running = False
-        self.recording_thread: Optional[threading.Thread] = None
-        self.image_thread: Optional[threading.Thread] = None
-        self.metrics = defaultdict(lambda: {"count": 0, "total_time": 0})  # Track processing metrics
+        self.image_threads: list[threading.Thread] = []
+        # Stopping Fooocus would also abort real work if several image workers share it
+        self.speculation_enabled = SPECULATIVE_GENERATION and STAGE_WORKERS["image"] == 1
+        self.image_batch_size = AdaptiveBatchSize(IMAGE_BATCH_TARGET_SECONDS, IMAGE_BATCH_MAX_SIZE)
+        # Processor receive time per recording, until its first image completes or its work ends
+        self.recording_received_times: dict[str, float] = {}
+        self.recording_received_lock = threading.Lock()
+        # The speculative generation currently rendering, cancelled as soon as real work arrives.
+        # speculating is claimed before its row exists so work arriving meanwhile still cancels it.
+        self.speculating = False
+        self.speculative_generation_id: Optional[str] = None
+        self.speculation_cancelled = threading.Event()
+        self.speculation_lock = threading.Lock()
+        # Recordings whose work was cancelled, and those preempted ahead of all other work
+        self.cancelled_recordings: set[str] = set()
+        self.urgent_recordings: set[str] = set()
+        # Work each recording has left: its job in a stage, its queued and rendering images and its
+        # retries waiting. Its cancelled and urgent marks are forgotten once none is left.
+        self.recording_work: dict[str, int] = {}
+        # Recording each image thread is rendering, by thread name, so cancelling it can abort the render
+        self.rendering_recordings: dict[str, str] = {}
+        # Failed images waiting out RETRY_DELAY before they are queued again
+        self.retry_timers: set[threading.Timer] = set()
+        self.cancel_lock = threading.Lock()
+        QUEUE_DEPTH.labels(queue="image_generation").set_function(self.image_generation_queue.qsize)
 
     def start(self):
         if self.is_running:
@@ -66,96 +220,401 @@ class AudioProcessingService:
         logger.info("Starting AudioProcessingService")
 
         self.is_running = True
-        self.whisper_model = whisper.load_model("medium")
-        
-        # Start separate threads for recording processing and image generation
-        self.recording_thread = threading.Thread(target=self._process_recordings)
-        self.recording_thread.daemon = True
-        self.recording_thread.start()
-        
-        self.image_thread = threading.Thread(target=self._process_image_generations)
-        self.image_thread.daemon = True
-        self.image_thread.start()
+        if self.needs_whisper:
+            self.model_thread = threading.Thread(target=self._load_models, name="model-loader")
+            self.model_thread.daemon = True
+            self.model_thread.start()
+
+        if WORKER_MODE == "pull":
+            logger.info(f"Pulling jobs as {WORKER_ID} with capabilities {', '.join(WORKER_CAPABILITIES)}")
+            for pull_worker in self.pull_workers:
+                pull_worker.start()
+            return
+
+        if SPECULATIVE_GENERATION and not self.speculation_enabled:
+            logger.warning("Speculative generation needs a single image worker, disabling it")
+
+        for stage in self.stages:
+            stage.start()
+
+        for index in range(STAGE_WORKERS["image"]):
+            image_thread = threading.Thread(target=self._process_image_generations, name=f"image-{index}")
+            image_thread.daemon = True
+            image_thread.start()
+            self.image_threads.append(image_thread)
 
     def stop(self):
         logger.info("Stopping AudioProcessingService")
         self.is_running = False
-        if self.recording_thread:
-            self.new_recording_queue.put(None)  # Sentinel to stop the thread
-            self.recording_thread.join()
-        if self.image_thread:
-            self.image_generation_queue.put((float('inf'), None))  # Sentinel to stop the thread
-            self.image_thread.join()
-        self.whisper_model = None
-
-    def add_processing_request(self, recording_id: str, source_file: str):
+        for pull_worker in self.pull_workers:
+            pull_worker.stop()
+        for stage in self.stages:
+            stage.stop()
+        with self.cancel_lock:
+            retry_timers, self.retry_timers = self.retry_timers, set()
+        for timer in retry_timers:
+            timer.cancel()
+        for _ in self.image_threads:
+            self.image_generation_queue.put((float('inf'), None))  # Sentinel to stop one thread
+        for image_thread in self.image_threads:
+            image_thread.join()
+        self.image_threads = []
+        with self.cancel_lock:
+            self.recording_work.clear()
+            self.cancelled_recordings.clear()
+            self.urgent_recordings.clear()
+        with self.recording_received_lock:
+            self.recording_received_times.clear()
+        self.whisper_models = Queue()
+        self.models_ready.clear()
+
+    def _load_models(self):
+        try:
+            with time_stage("model_load"):
+                import whisper
+
+                for _ in range(STAGE_WORKERS["transcribe"]):
+                    self.whisper_models.put(whisper.load_model(whisper_model_name))
+            logger.info(f"Loaded {STAGE_WORKERS['transcribe']} Whisper {whisper_model_name} models")
+        except Exception as e:
+            logger.error(f"Failed to load Whisper model {whisper_model_name}: {str(e)}", exc_info=True)
+            self.model_load_error = e
+        finally:
+            self.models_ready.set()
+
+    def _wait_for_models(self):
+        """Block a worker until the models are loaded, queued recordings wait in their stage meanwhile"""
+        while not self.models_ready.wait(MODEL_WAIT_POLL_SECONDS):
+            if not self.is_running:
+                raise RuntimeError("Service stopped before the models finished loading")
+        if self.model_load_error is not None:
+            raise RuntimeError(f"Whisper model failed to load: {str(self.model_load_error)}")
+
+    def get_readiness(self) -> dict:
+        """Whether the model is loaded and the Ollama and Fooocus backends answer"""
+        checks = {}
+        capabilities = WORKER_CAPABILITIES if WORKER_MODE == "pull" else ["whisper", "llm", "image"]
+        if "whisper" in capabilities:
+            checks["whisper_model"] = self.models_ready.is_set() and self.model_load_error is None
+        if "llm" in capabilities:
+            checks["ollama"] = check_ollama()
+        if "image" in capabilities:
+            checks["fooocus"] = check_fooocus()
+        return {"ready": all(checks.values()), "checks": checks}
+
+    @property
+    def needs_whisper(self) -> bool:
+        return WORKER_MODE != "pull" or "whisper" in WORKER_CAPABILITIES
+
+    def add_processing_request(self, recording_id: str, source_file: str, urgent: bool = False):
+        with self.cancel_lock:
+            if recording_id in self.cancelled_recordings:
+                raise ValueError(f"Recording {recording_id} was cancelled and its work is still stopping")
+        self._add_work(recording_id)
+        # Before the job is queued, a worker may be done with it before this returns
+        with self.recording_received_lock:
+            self.recording_received_times[recording_id] = time.time()
         try:
-            # Add to new recording queue for immediate processing
-            self.new_recording_queue.put((recording_id, source_file), block=False)
-            logger.info(f"Added recording {recording_id} to processing queue")
-        except Queue.Full:
+            # Add to the first pipeline stage for immediate processing
+            # Carry the caller's trace context across the thread hand-over
+            self.decode_stage.put(
+                RecordingJob(recording_id, source_file, inject_trace_headers(), urgent=urgent), block=False
+            )
+        except Full:
+            self._finish_work(recording_id)
             logger.error(f"Recording queue is full, could not add recording {recording_id}")
             raise
+        if urgent:
+            self.preempt_recording(recording_id)
+        else:
+            self._preempt_speculation()
+        logger.info(f"Added recording {recording_id} to processing queue")
 
-    def _process_recordings(self):
-        while self.is_running:
-            try:
-                item = self.new_recording_queue.get()
-                if item is None:  # Sentinel value to stop the thread
-                    logger.info("Received stop signal, stopping recording processing thread")
-                    break
+    def cancel_recording(self, recording_id: str) -> dict:
+        """
+        Stop all work on a recording: drop its jobs waiting in the pipeline stages and its prompts
+        waiting for an image, marking their image generations cancelled, and abort its render in
+        flight where Fooocus allows. Work a stage is already running is dropped once it finishes.
+        """
+        with self.cancel_lock:
+            # Without work left there is nothing to stop, and nothing would ever forget the mark
+            if recording_id in self.recording_work:
+                self.cancelled_recordings.add(recording_id)
+            self.urgent_recordings.discard(recording_id)
+        removed_jobs = sum(stage.remove(recording_id) for stage in self.stages)
+        removed_images = remove_queued(
+            self.image_generation_queue, lambda entry: entry[1] is not None and entry[1][0] == recording_id
+        )
+        for _, (_, _, image_generation_id, _, _, _) in removed_images:
+            self._cancel_image(recording_id, image_generation_id)
+            self._finish_work(recording_id)
+        aborted_render = self._abort_rendering(recording_id)
+        with self.recording_received_lock:
+            self.recording_received_times.pop(recording_id, None)
+        logger.info(
+            f"Cancelled recording {recording_id}, dropped {removed_jobs} queued jobs and {len(removed_images)} queued images"
+        )
+        return {
+            "recording_id": recording_id,
+            "removed_jobs": removed_jobs,
+            "removed_images": len(removed_images),
+            "aborted_render": aborted_render,
+        }
 
-                recording_id, source_file = item
-                start_time = time.time()
-                logger.info(
-                    f"Processing new recording {recording_id} from {source_file}"
-                )
-                try:
-                    self._process_audio(recording_id, source_file)
-                    logger.info(f"Successfully processed recording {recording_id}")
-                except Exception as e:
-                    logger.error(
-                        f"Error processing {recording_id}: {str(e)}", exc_info=True
-                    )
-                finally:
-                    self.new_recording_queue.task_done()
-                    # Update metrics
-                    duration = time.time() - start_time
-                    self.metrics["recording_processing"]["count"] += 1
-                    self.metrics["recording_processing"]["total_time"] += duration
-            except Exception as e:
-                logger.error(f"Recording queue processing error: {str(e)}", exc_info=True)
+    def preempt_recording(self, recording_id: str) -> dict:
+        """
+        Move a recording's waiting work ahead of everything else, in every stage and the image queue.
+        Its prompts queued later and its retries keep the urgent priority, and a speculative render
+        holding Fooocus is aborted.
+        """
+        with self.cancel_lock:
+            if recording_id in self.cancelled_recordings:
+                raise ValueError(f"Recording {recording_id} was cancelled")
+            if recording_id in self.recording_work:
+                self.urgent_recordings.add(recording_id)
+        moved_jobs = sum(stage.prioritize(recording_id) for stage in self.stages)
+        moved_images = remove_queued(
+            self.image_generation_queue, lambda entry: entry[1] is not None and entry[1][0] == recording_id
+        )
+        for _, item in moved_images:
+            self.image_generation_queue.put((self._image_priority(recording_id, item[4]), item))
+        self._preempt_speculation()
+        PREEMPTIONS.inc()
+        logger.info(f"Preempted recording {recording_id}, moved {moved_jobs} queued jobs and {len(moved_images)} queued images")
+        return {"recording_id": recording_id, "moved_jobs": moved_jobs, "moved_images": len(moved_images)}
+
+    def _is_cancelled(self, recording_id: str) -> bool:
+        with self.cancel_lock:
+            return recording_id in self.cancelled_recordings
+
+    def _is_urgent(self, recording_id: str) -> bool:
+        with self.cancel_lock:
+            return recording_id in self.urgent_recordings
+
+    def _add_work(self, recording_id: str, count: int = 1):
+        with self.cancel_lock:
+            self.recording_work[recording_id] = self.recording_work.get(recording_id, 0) + count
+
+    def _finish_work(self, recording_id: str, count: int = 1):
+        """
+        Count work of a recording as done, forgetting the recording once it has none left. Its
+        receive time goes too, when it ended without prompts or with every image failed.
+        """
+        with self.cancel_lock:
+            remaining = self.recording_work.get(recording_id, 0) - count
+            if remaining > 0:
+                self.recording_work[recording_id] = remaining
+                return
+            self.recording_work.pop(recording_id, None)
+            self.cancelled_recordings.discard(recording_id)
+            self.urgent_recordings.discard(recording_id)
+        with self.recording_received_lock:
+            self.recording_received_times.pop(recording_id, None)
+
+    def _image_priority(self, recording_id: str, index: int) -> int:
+        """Image queue priority of a prompt, earlier prompts first and preempted recordings before all others"""
+        return index + URGENT_PRIORITY if self._is_urgent(recording_id) else index
+
+    def _cancel_image(self, recording_id: str, image_generation_id: str):
+        CANCELLATIONS.labels(stage="image_generation").inc()
+        try:
+            update_image_generation(
+                recording_id,
+                image_generation_id,
+                ImageGenerationUpdate(status="cancelled", reason="Recording cancelled"),
+            )
+        except Exception as e:
+            # The row may be gone with its recording, the rest of the cancellation goes on
+            logger.warning(f"Could not mark image generation {image_generation_id} cancelled: {str(e)}")
+
+    @contextmanager
+    def _rendering(self, recording_id: str):
+        """Track the recording this image thread renders while the block runs"""
+        thread_name = threading.current_thread().name
+        with self.cancel_lock:
+            self.rendering_recordings[thread_name] = recording_id
+        try:
+            yield
+        finally:
+            with self.cancel_lock:
+                self.rendering_recordings.pop(thread_name, None)
+
+    def _abort_rendering(self, recording_id: str) -> bool:
+        """Stop Fooocus if it is rendering the recording, unless several image workers share it"""
+        with self.cancel_lock:
+            rendering = recording_id in self.rendering_recordings.values()
+        if not rendering:
+            return False
+        if STAGE_WORKERS["image"] > 1:
+            logger.info(f"Letting the render of {recording_id} finish, stopping Fooocus would abort other images")
+            return False
+        try:
+            stop_generation()
+        except Exception as e:
+            logger.warning(f"Could not stop the render of {recording_id}: {str(e)}")
+            return False
+        return True
+
+    def _abort_image_job(self, job: dict):
+        """Stop the Fooocus render of an image job that was cancelled or handed to another worker"""
+        if STAGE_WORKERS["image"] > 1:
+            return
+        CANCELLATIONS.labels(stage="image_job").inc()
+        stop_generation()
 
     def _process_image_generations(self):
         while self.is_running:
             try:
-                priority, item = self.image_generation_queue.get()
+                try:
+                    priority, item = self.image_generation_queue.get(
+                        timeout=SPECULATIVE_IDLE_SECONDS if self.speculation_enabled else None
+                    )
+                except Empty:
+                    self._generate_speculative_image()
+                    continue
                 if item is None:  # Sentinel value to stop the thread
                     logger.info("Received stop signal, stopping image generation thread")
                     break
 
-                recording_id, prompt, image_generation_id = item
+                if IMAGE_BATCHING:
+                    self._process_image_batch(priority, item)
+                    continue
+
+                recording_id, _, image_generation_id, trace_carrier, index, _ = item
                 start_time = time.time()
                 logger.info(
-                    f"Generating image for recording {recording_id}, prompt index {priority}"
+                    f"Generating image for recording {recording_id}, prompt index {index}"
                 )
                 try:
-                    self._generate_and_store_image(recording_id, prompt, image_generation_id, priority)
-                    logger.info(f"Successfully generated image for {recording_id}, prompt index {priority}")
+                    with tracer.start_as_current_span(
+                        "process_image_generation",
+                        context=extract_trace_context(trace_carrier),
+                        attributes={
+                            "recording.id": recording_id,
+                            "image_generation.id": image_generation_id,
+                            "image_generation.index": index,
+                        },
+                    ):
+                        self._generate_and_store_image(item)
                 except Exception as e:
                     logger.error(
-                        f"Error generating image for {recording_id}, prompt index {priority}: {str(e)}",
+                        f"Error generating image for {recording_id}, prompt index {index}: {str(e)}",
                         exc_info=True,
                     )
                 finally:
+                    self._finish_work(recording_id)
                     self.image_generation_queue.task_done()
-                    # Update metrics
-                    duration = time.time() - start_time
-                    self.metrics["image_generation"]["count"] += 1
-                    self.metrics["image_generation"]["total_time"] += duration
+                    STAGE_LATENCY.labels(stage="image_generation").observe(time.time() - start_time)
             except Exception as e:
                 logger.error(f"Image generation queue processing error: {str(e)}", exc_info=True)
 
+    def _take_recording_image_items(self, recording_id: str, limit: int) -> list[Tuple[int, tuple]]:
+        """Take up to limit more queued images of the same recording, leaving everything else queued"""
+        taken, others = [], []
+        while len(taken) < limit:
+            try:
+                priority, item = self.image_generation_queue.get_nowait()
+            except Empty:
+                break
+            self.image_generation_queue.task_done()
+            if item is not None and item[0] == recording_id:
+                taken.append((priority, item))
+            else:
+                others.append((priority, item))
+        for other in others:
+            self.image_generation_queue.put(other)
+        return taken
+
+    def _process_image_batch(self, priority: int, item: tuple):
+        recording_id, _, _, trace_carrier, _, _ = item
+        batch = [(priority, item)] + self._take_recording_image_items(recording_id, self.image_batch_size.size - 1)
+        start_time = time.time()
+        logger.info(f"Generating batch of {len(batch)} images for recording {recording_id}")
+        try:
+            with tracer.start_as_current_span(
+                "process_image_batch",
+                context=extract_trace_context(trace_carrier),
+                attributes={"recording.id": recording_id, "image_generation.batch_size": len(batch)},
+            ):
+                self._generate_and_store_batch(recording_id, batch)
+        except Exception as e:
+            logger.error(f"Error generating image batch for {recording_id}: {str(e)}", exc_info=True)
+        finally:
+            self._finish_work(recording_id, len(batch))
+            self.image_generation_queue.task_done()
+            STAGE_LATENCY.labels(stage="image_generation").observe(time.time() - start_time)
+
+    def _generate_and_store_batch(self, recording_id: str, batch: list[Tuple[int, tuple]]):
+        """Generate a recording's images as one Fooocus batch, queueing failed ones again individually"""
+        if self._is_cancelled(recording_id):
+            for _, item in batch:
+                self._cancel_image(recording_id, item[2])
+            return
+        IMAGE_BATCH_SIZE.observe(len(batch))
+        start_time = time.time()
+        prompts = [prompt_template.format(prompt=item[1]) for _, item in batch]
+        completed = 0
+        unfinished = set(range(len(batch)))
+        try:
+            with self._rendering(recording_id), time_stage("fooocus_batch"):
+                for position, result in generate_images_batch(
+                    prompts,
+                    STYLES,
+                    negative_prompt,
+                    should_stop=lambda: self._is_cancelled(recording_id),
+                    # Stopping Fooocus would also abort the renders of the other image workers
+                    allow_stop=STAGE_WORKERS["image"] == 1,
+                ):
+                    if self._is_cancelled(recording_id):
+                        break
+                    item = batch[position][1]
+                    _, _, image_generation_id, _, index, _ = item
+                    if isinstance(result, BatchJobAbandoned):
+                        # Fooocus may still render it, queueing it again would render it twice
+                        logger.warning(f"Batched image {index} for {recording_id} abandoned: {str(result)}")
+                        unfinished.discard(position)
+                        update_image_generation(
+                            recording_id, image_generation_id, ImageGenerationUpdate(status="failed", reason=str(result))
+                        )
+                        continue
+                    if isinstance(result, Exception):
+                        logger.warning(f"Batched image {index} for {recording_id} failed: {str(result)}")
+                        unfinished.discard(position)
+                        self._retry_later(item, result)
+                        continue
+                    file_name = self._store_image(recording_id, image_generation_id, index, result)
+                    update_image_generation(
+                        recording_id,
+                        image_generation_id,
+                        ImageGenerationUpdate(
+                            image_file_path=file_name,
+                            seed=result.seed,
+                            request_payload=result.request_payload,
+                            status="completed",
+                            duration=result.duration,
+                        ),
+                    )
+                    unfinished.discard(position)
+                    self._observe_first_image(recording_id)
+                    completed += 1
+        finally:
+            if completed:
+                self.image_batch_size.observe(time.time() - start_time, completed)
+            # Left over when the recording was cancelled or storing a result raised, so none stays pending
+            for position in sorted(unfinished):
+                image_generation_id = batch[position][1][2]
+                try:
+                    if self._is_cancelled(recording_id):
+                        self._cancel_image(recording_id, image_generation_id)
+                    else:
+                        update_image_generation(
+                            recording_id,
+                            image_generation_id,
+                            ImageGenerationUpdate(status="failed", reason="Batch stopped before the image was stored"),
+                        )
+                except Exception as e:
+                    logger.error(f"Could not update image generation {image_generation_id}: {str(e)}")
+
     def _create_pending_image_generations(self, recording_id: str, prompts: list[str]) -> list[Tuple[str, str]]:
         image_generations = [
             ImageGenerationCreate(
@@ -174,109 +633,339 @@ class AudioProcessingService:
         index: int,
         image_result: ImageGenerationResult,
     ):
-        style = image_result.request_payload["style_selections"][0]
+        style = get_image_file_style(image_result.request_payload["style_selections"])
         file_name = get_image_file_name(str(recording_id), image_generation_id, index, style)
 
         file_path = os.path.join(image_generations_path, file_name)
-        with open(file_path, "wb") as f:
+        with time_stage("file_write"), open(file_path, "wb") as f:
             f.write(image_result.image_data)
 
         return file_name
 
-    def _generate_and_store_image(self, recording_id: str, prompt: str, image_generation_id: str, index: int):
-        retries = 0
-        while retries < MAX_RETRIES:
+    def _generate_and_store_image(self, item: tuple):
+        recording_id, prompt, image_generation_id, _, index, _ = item
+        if self._is_cancelled(recording_id):
+            self._cancel_image(recording_id, image_generation_id)
+            return
+        try:
+            with self._rendering(recording_id), time_stage("fooocus"):
+                image_result = generate_image(prompt_template.format(prompt=prompt), STYLES, negative_prompt)
+            if self._is_cancelled(recording_id):
+                self._cancel_image(recording_id, image_generation_id)
+                return
+            file_name = self._store_image(recording_id, image_generation_id, index, image_result)
+
+            update_image_generation(
+                recording_id,
+                image_generation_id,
+                ImageGenerationUpdate(
+                    image_file_path=file_name,
+                    seed=image_result.seed,
+                    request_payload=image_result.request_payload,
+                    status="completed",
+                    duration=image_result.duration,
+                ),
+            )
+            self._observe_first_image(recording_id)
+            logger.info(f"Successfully generated image for {recording_id}, prompt index {index}")
+        except Exception as e:
+            # An aborted render fails too, but a cancelled recording is not retried
+            if self._is_cancelled(recording_id):
+                self._cancel_image(recording_id, image_generation_id)
+            else:
+                self._retry_later(item, e)
+
+    def _retry_later(self, item: tuple, error: Exception):
+        """
+        Queue a failed image again once RETRY_DELAY has passed, or fail it when out of retries.
+        The image thread renders other prompts meanwhile instead of sleeping through the delay.
+        """
+        recording_id, _, image_generation_id, _, index, attempt = item
+        attempt += 1
+        if attempt >= MAX_RETRIES:
+            logger.error(
+                f"Error generating image for {recording_id}, prompt index {index} after {MAX_RETRIES} retries: {str(error)}",
+                exc_info=error,
+            )
+            update_image_generation(
+                recording_id,
+                image_generation_id,
+                ImageGenerationUpdate(
+                    status="failed",
+                    reason=str(error),
+                ),
+            )
+            return
+        logger.warning(
+            f"Retry {attempt}/{MAX_RETRIES} for image {index} for {recording_id} in {RETRY_DELAY} seconds: {str(error)}"
+        )
+        RETRIES.labels(stage="image_generation").inc()
+        timer = threading.Timer(RETRY_DELAY, self._requeue_image, args=(item[:5] + (attempt,),))
+        timer.daemon = True
+        self._add_work(recording_id)  # Until the timer queues the image again or drops it
+        with self.cancel_lock:
+            self.retry_timers.add(timer)
+        timer.start()
+
+    def _requeue_image(self, item: tuple):
+        with self.cancel_lock:
+            self.retry_timers.discard(threading.current_thread())
+        recording_id, _, image_generation_id, _, index, _ = item
+        if not self.is_running:
+            return
+        if self._is_cancelled(recording_id):
+            self._cancel_image(recording_id, image_generation_id)
+            self._finish_work(recording_id)
+            return
+        # The retry's work goes on as the queued image's
+        self.image_generation_queue.put((self._image_priority(recording_id, index), item))
+        self._preempt_speculation()
+
+    def _preempt_speculation(self):
+        """Abort the speculative generation in flight, if any, to free the GPU for real work"""
+        with self.speculation_lock:
+            if not self.speculating or self.speculation_cancelled.is_set():
+                return
+            logger.info(f"Cancelling speculative image generation {self.speculative_generation_id}")
+            self.speculation_cancelled.set()
             try:
-                prompt = prompt_template.format(prompt=prompt)
-                image_result = generate_image(prompt, STYLES, negative_prompt)
-                file_name = self._store_image(recording_id, image_generation_id, index, image_result)
-
-                update_image_generation(
-                    recording_id,
-                    image_generation_id,
-                    ImageGenerationUpdate(
-                        image_file_path=file_name,
-                        seed=image_result.seed,
-                        request_payload=image_result.request_payload,
-                        status="completed",
-                        duration=image_result.duration,
-                    ),
-                )
-                break  # Success, exit retry loop
-                
+                stop_generation()
             except Exception as e:
-                retries += 1
-                if retries == MAX_RETRIES:
-                    logger.error(
-                        f"Error generating image for {recording_id}, prompt index {index} after {MAX_RETRIES} retries: {str(e)}",
-                        exc_info=True,
-                    )
-                    update_image_generation(
-                        recording_id,
-                        image_generation_id,
-                        ImageGenerationUpdate(
-                            status="failed",
-                            reason=str(e),
-                        ),
-                    )
-                else:
-                    logger.warning(
-                        f"Retry {retries}/{MAX_RETRIES} for image {index} for {recording_id}: {str(e)}"
-                    )
-                    time.sleep(RETRY_DELAY)
+                logger.warning(f"Could not stop speculative image generation: {str(e)}")
+
+    def _next_speculative_job(self) -> Optional[Tuple[str, int, str, str, list[str]]]:
+        """First variant not yet rendered among the prompts of the most popular recent recordings"""
+        for candidate in get_speculation_candidates(SPECULATIVE_CANDIDATES):
+            rendered_variants = {tuple(variant) for variant in candidate["rendered_variants"]}
+            for index, prompt in enumerate(candidate["prompts"] or []):
+                for variant, styles in get_speculative_variants():
+                    if (prompt, variant) not in rendered_variants:
+                        return str(candidate["recording_id"]), index, prompt, variant, styles
+        return None
+
+    def _generate_speculative_image(self):
+        """Render one extra variant for a popular recording while there is no real work"""
+        if any(stage.queue.qsize() for stage in self.stages):
+            return
+        try:
+            job = self._next_speculative_job()
+        except Exception as e:
+            logger.warning(f"Could not get speculation candidates: {str(e)}")
+            return
+        if job is None:
+            return
+
+        recording_id, index, prompt, variant, styles = job
+        with self.speculation_lock:
+            self.speculating = True
+            self.speculation_cancelled.clear()
+        try:
+            image_generation_id = create_image_generation(
+                recording_id,
+                ImageGenerationCreate(
+                    audio_recording_id=recording_id,
+                    prompt=prompt,
+                    status="generating",
+                    speculative=True,
+                    variant=variant,
+                ),
+            )
+        except Exception:
+            with self.speculation_lock:
+                self.speculating = False
+            raise
+        with self.speculation_lock:
+            self.speculative_generation_id = image_generation_id
 
-    def _get_audio_duration(self, file_path: str) -> float:
-        """Get the duration of an audio file in seconds."""
+        logger.info(f"Speculatively generating {variant} for recording {recording_id}, prompt index {index}")
+        image_result = None
+        error = None
         try:
-            duration = librosa.get_duration(path=file_path)
-            return duration
+            with tracer.start_as_current_span(
+                "speculative_image_generation",
+                attributes={
+                    "recording.id": recording_id,
+                    "image_generation.id": image_generation_id,
+                    "image_generation.variant": variant,
+                },
+            ):
+                if not self.speculation_cancelled.is_set():
+                    with time_stage("fooocus"):
+                        image_result = generate_image(prompt_template.format(prompt=prompt), styles, negative_prompt)
         except Exception as e:
-            logger.error(f"Error getting audio duration for {file_path}: {str(e)}", exc_info=True)
-            return 0.0
-
-    def _process_audio(self, recording_id: str, source_file: str):
-        logger.info(f"Starting transcription for {recording_id} from {source_file}")
-        source_file_path = os.path.join(audio_recordings_path, source_file)
-        
-        # Get audio duration before processing
-        duration = self._get_audio_duration(source_file_path)
-        logger.info(f"Audio duration for {recording_id}: {duration:.2f} seconds")
-        
-        transcription = self._transcribe_audio(source_file_path)
-        logger.info(f"Transcription complete for {recording_id}, updating database. Transcription: {transcription}")
-        update_transcription(recording_id, transcription)
-
-        # Generate image prompts
-        prompt_count = math.ceil(duration / SECONDS_PER_PROMPT)
-        logger.info(f"Generating {prompt_count} image prompts for {recording_id}")
-        prompts = get_image_prompts(transcription, ollama_model, prompt_count)
-        logger.info(f"Updating prompts for {recording_id}")
-        update_prompts(recording_id, prompts)
-        logger.info(f"Processing complete for {recording_id}")
+            error = e
+        finally:
+            with self.speculation_lock:
+                self.speculating = False
+                self.speculative_generation_id = None
+                cancelled = self.speculation_cancelled.is_set()
+
+        if cancelled:
+            SPECULATIVE_GENERATIONS.labels(outcome="cancelled").inc()
+            update_image_generation(
+                recording_id,
+                image_generation_id,
+                ImageGenerationUpdate(status="cancelled", reason="Preempted by new recording"),
+            )
+        elif error is not None:
+            SPECULATIVE_GENERATIONS.labels(outcome="failed").inc()
+            logger.warning(f"Speculative generation {image_generation_id} failed: {str(error)}")
+            update_image_generation(
+                recording_id,
+                image_generation_id,
+                ImageGenerationUpdate(status="failed", reason=str(error)),
+            )
+        else:
+            SPECULATIVE_GENERATIONS.labels(outcome="completed").inc()
+            file_name = self._store_image(recording_id, image_generation_id, index, image_result)
+            update_image_generation(
+                recording_id,
+                image_generation_id,
+                ImageGenerationUpdate(
+                    image_file_path=file_name,
+                    seed=image_result.seed,
+                    request_payload=image_result.request_payload,
+                    status="completed",
+                    duration=image_result.duration,
+                ),
+            )
+
+    def _observe_first_image(self, recording_id: str):
+        with self.recording_received_lock:
+            received_time = self.recording_received_times.pop(recording_id, None)
+        if received_time is not None:
+            TIME_TO_FIRST_IMAGE.observe(time.time() - received_time)
+
+    def _load_audio(self, job: RecordingJob) -> bool:
+        """Decode the recording and trim the silence around its speech, False if it has no speech"""
+        self._wait_for_models()
+        import whisper
+
+        if audio_source == "http":
+            with tempfile.TemporaryDirectory() as directory:
+                job.source_file_path = download_recording_audio(
+                    job.recording_id, os.path.join(directory, os.path.basename(job.source_file))
+                )
+                logger.info(f"Decoding downloaded {job.source_file} for {job.recording_id}")
+                with time_stage("audio_load"):
+                    job.audio = whisper.load_audio(job.source_file_path)
+        else:
+            job.source_file_path = os.path.join(audio_recordings_path, job.source_file)
+            logger.info(f"Decoding {job.source_file_path} for {job.recording_id}")
+            with time_stage("audio_load"):
+                job.audio = whisper.load_audio(job.source_file_path)
+        job.duration = len(job.audio) / whisper.audio.SAMPLE_RATE
+        logger.info(f"Audio duration for {job.recording_id}: {job.duration:.2f} seconds")
+
+        if not VAD_ENABLED:
+            job.speech_duration = job.duration
+            return True
+        with time_stage("vad"):
+            voice_activity = detect_voice_activity(job.audio, whisper.audio.SAMPLE_RATE)
+        VOICE_ACTIVITY.labels(status="uncertain" if voice_activity.uncertain else voice_activity.status).inc()
+        job.speech_duration = voice_activity.speech_duration
+        if voice_activity.uncertain:
+            logger.info(f"Speech in {job.recording_id} could not be told from noise, processing all of it")
+        logger.info(f"Speech in {job.recording_id}: {job.speech_duration:.2f} seconds")
+        if voice_activity.is_empty:
+            job.audio = None
+            return False
+        job.audio = job.audio[voice_activity.start:voice_activity.end]
+        return True
+
+    def _decode_audio(self, job: RecordingJob) -> Optional[RecordingJob]:
+        has_speech = self._load_audio(job)
+        update_voice_activity(
+            job.recording_id, "speech" if has_speech else "empty", job.duration, job.speech_duration
+        )
+        if not has_speech:
+            # Whisper makes text up for silence, which would then cost prompts and images
+            logger.info(f"No speech in {job.recording_id}, skipping transcription and prompts")
+            return None
+        return job
+
+    def _transcribe(self, job: RecordingJob) -> RecordingJob:
+        logger.info(f"Starting transcription for {job.recording_id}")
+        self._wait_for_models()
+        job.transcription = self._transcribe_audio(job.audio)
+        job.audio = None  # The samples are not needed past this stage
+        logger.info(f"Transcription complete for {job.recording_id}, updating database. Transcription: {job.transcription}")
+        update_transcription(job.recording_id, job.transcription)
+        return job
+
+    def _generate_prompts(self, job: RecordingJob) -> RecordingJob:
+        prompt_count = math.ceil(job.speech_duration / SECONDS_PER_PROMPT)
+        logger.info(f"Generating {prompt_count} image prompts for {job.recording_id}")
+        with time_stage("ollama"):
+            job.prompts = get_image_prompts(job.transcription, ollama_model, prompt_count)
+        return job
+
+    def _register_prompts(self, job: RecordingJob) -> None:
+        logger.info(f"Updating prompts for {job.recording_id}")
+        update_prompts(job.recording_id, job.prompts)
 
         # Create pending image generations and queue each prompt individually
-        image_generation_id_prompt_pairs = self._create_pending_image_generations(recording_id, prompts)
+        image_generation_id_prompt_pairs = self._create_pending_image_generations(job.recording_id, job.prompts)
+        trace_carrier = inject_trace_headers()
+        # Counted before this job leaves the register stage, so the recording is not forgotten in between
+        self._add_work(job.recording_id, len(image_generation_id_prompt_pairs))
         for index, (image_generation_id, prompt) in enumerate(image_generation_id_prompt_pairs):
-            # Queue each prompt with its index as priority
-            self.image_generation_queue.put((index, (recording_id, prompt, image_generation_id)))
+            # Queue each prompt with its index as priority, none of its attempts made yet
+            self.image_generation_queue.put((
+                self._image_priority(job.recording_id, index),
+                (job.recording_id, prompt, image_generation_id, trace_carrier, index, 0),
+            ))
+        self._preempt_speculation()
+        STAGE_LATENCY.labels(stage="recording_processing").observe(time.time() - job.received_time)
+        logger.info(f"Processing complete for {job.recording_id}")
 
-    def _transcribe_audio(self, source_file: str) -> str:
-        result = self.whisper_model.transcribe(
-            source_file, language="en", task="translate"
-        )
+    def _transcribe_audio(self, audio) -> str:
+        whisper_model = self.whisper_models.get()
+        try:
+            with time_stage("whisper"):
+                result = whisper_model.transcribe(
+                    audio, language="en", task="translate"
+                )
+        finally:
+            self.whisper_models.put(whisper_model)
         return result["text"]
 
+    def _run_transcribe_job(self, job: dict) -> dict:
+        recording_job = RecordingJob(str(job["recording_id"]), job["audio_file_path"], job["trace_context"])
+        has_speech = self._load_audio(recording_job)
+        return {
+            "transcription": self._transcribe_audio(recording_job.audio) if has_speech else "",
+            "duration": recording_job.duration,
+            "speech_duration": recording_job.speech_duration,
+            "status": "speech" if has_speech else "empty",
+        }
+
+    def _run_prompts_job(self, job: dict) -> dict:
+        prompt_count = math.ceil((job["speech_duration"] or job["duration"]) / SECONDS_PER_PROMPT)
+        logger.info(f"Generating {prompt_count} image prompts for {job['recording_id']}")
+        with time_stage("ollama"):
+            prompts = get_image_prompts(job["transcription"], ollama_model, prompt_count)
+        return {"prompts": prompts}
+
+    def _run_image_job(self, job: dict) -> dict:
+        prompt = prompt_template.format(prompt=job["prompt"])
+        with time_stage("fooocus"):
+            image_result = generate_image(prompt, STYLES, negative_prompt)
+        file_name = self._store_image(job["recording_id"], job["image_generation_id"], job["priority"], image_result)
+        return {
+            "image_file_path": file_name,
+            "seed": image_result.seed,
+            "request_payload": image_result.request_payload,
+            "duration": image_result.duration,
+        }
+
     def get_metrics(self):
         """Get current processing metrics"""
         return {
-            "recording_queue_size": self.new_recording_queue.qsize(),
+            "recording_queue_size": self.decode_stage.queue.qsize(),
+            "stage_queue_sizes": {stage.name: stage.queue.qsize() for stage in self.stages},
             "image_queue_size": self.image_generation_queue.qsize(),
-            "recording_processing": {
-                "count": self.metrics["recording_processing"]["count"],
-                "avg_time": self.metrics["recording_processing"]["total_time"] / max(1, self.metrics["recording_processing"]["count"])
-            },
-            "image_generation": {
-                "count": self.metrics["image_generation"]["count"],
-                "avg_time": self.metrics["image_generation"]["total_time"] / max(1, self.metrics["image_generation"]["count"])
-            }
+            "recording_processing": histogram_summary(STAGE_LATENCY, stage="recording_processing"),
+            "image_generation": histogram_summary(STAGE_LATENCY, stage="image_generation"),
+            "time_to_first_image": histogram_summary(TIME_TO_FIRST_IMAGE),
         }
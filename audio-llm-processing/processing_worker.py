@@ -0,0 +1,117 @@
+import logging
+import threading
+from typing import Callable, Optional
+from data_client import claim_job, heartbeat_job, complete_job, fail_job
+from processing_metrics import STAGE_IN_FLIGHT, time_stage
+from processing_tracing import attach_trace_context
+
+logger = logging.getLogger(__name__)
+
+
+class LeaseLost(Exception):
+    """The data API handed the job to another worker, its result would be discarded"""
+
+
+class PullWorker:
+    """
+    Worker threads claiming jobs for one capability from the data API. The lease is renewed
+    while the handler runs, and its result completes the job. A handler that raises gives the
+    job back for another attempt, unless the lease was already lost. Losing the lease, because the
+    job was cancelled or handed to another worker, calls on_lease_lost so the handler's work can
+    be aborted instead of finished for nothing.
+    """
+
+    def __init__(
+        self,
+        worker_id: str,
+        capability: str,
+        handler: Callable[[dict], dict],
+        workers: int,
+        lease_seconds: float,
+        poll_interval: float,
+        on_lease_lost: Optional[Callable[[dict], None]] = None,
+    ):
+        self.worker_id = worker_id
+        self.capability = capability
+        self.handler = handler
+        self.workers = workers
+        self.lease_seconds = lease_seconds
+        self.poll_interval = poll_interval
+        self.on_lease_lost = on_lease_lost
+        self.stopping = threading.Event()
+        self.threads: list[threading.Thread] = []
+
+    def start(self):
+        self.stopping.clear()
+        for index in range(self.workers):
+            thread = threading.Thread(target=self._work, name=f"{self.capability}-worker-{index}")
+            thread.daemon = True
+            thread.start()
+            self.threads.append(thread)
+
+    def stop(self):
+        self.stopping.set()
+        for thread in self.threads:
+            thread.join()
+        self.threads = []
+
+    def _work(self):
+        while not self.stopping.is_set():
+            try:
+                job = claim_job(self.worker_id, [self.capability], self.lease_seconds)
+            except Exception as e:
+                logger.error(f"Could not claim a {self.capability} job: {str(e)}")
+                job = None
+            if job is None:
+                self.stopping.wait(self.poll_interval)
+                continue
+            self._run(job)
+        logger.info(f"Stopping {threading.current_thread().name}")
+
+    def _run(self, job: dict):
+        lease_lost = threading.Event()
+        finished = threading.Event()
+        heartbeat_thread = threading.Thread(
+            target=self._heartbeat, args=(job, finished, lease_lost), daemon=True
+        )
+        heartbeat_thread.start()
+        STAGE_IN_FLIGHT.labels(stage=f"{job['kind']}_job").inc()
+        try:
+            with attach_trace_context(job["trace_context"]), time_stage(f"{job['kind']}_job") as span:
+                span.set_attribute("recording.id", job["recording_id"])
+                span.set_attribute("job.id", job["id"])
+                result = self.handler(job)
+                if lease_lost.is_set():
+                    raise LeaseLost(f"Lease of job {job['id']} was lost while it ran")
+                complete_job(job["id"], self.worker_id, result)
+        except LeaseLost as e:
+            logger.warning(str(e))
+        except Exception as e:
+            if lease_lost.is_set():
+                # Most likely aborted by on_lease_lost, the job is no longer this worker's to fail
+                logger.warning(f"Job {job['id']} stopped after its lease was lost: {str(e)}")
+                return
+            logger.error(f"Error running {job['kind']} job {job['id']}: {str(e)}", exc_info=True)
+            try:
+                fail_job(job["id"], self.worker_id, str(e))
+            except Exception as fail_error:
+                logger.error(f"Could not fail job {job['id']}, its lease will expire: {str(fail_error)}")
+        finally:
+            finished.set()
+            STAGE_IN_FLIGHT.labels(stage=f"{job['kind']}_job").dec()
+
+    def _heartbeat(self, job: dict, finished: threading.Event, lease_lost: threading.Event):
+        # Renew well before expiry so one slow or failed heartbeat does not lose the lease
+        while not finished.wait(self.lease_seconds / 3):
+            try:
+                if not heartbeat_job(job["id"], self.worker_id, self.lease_seconds):
+                    lease_lost.set()
+                    break
+            except Exception as e:
+                logger.warning(f"Heartbeat for job {job['id']} failed: {str(e)}")
+        if lease_lost.is_set() and not finished.is_set() and self.on_lease_lost is not None:
+            logger.info(f"Lease of job {job['id']} lost, aborting it")
+            try:
+                self.on_lease_lost(job)
+            except Exception as e:
+                logger.warning(f"Could not abort job {job['id']}: {str(e)}")
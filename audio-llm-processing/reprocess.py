@@ -0,0 +1,434 @@
+"""
+Offline re-processing of whole trees after changing PROMPT_TEMPLATE, STYLES or OLLAMA_MODEL.
+
+Selects the recordings of a tree or created within a date range, reuses their stored
+transcriptions (only recordings without one, or without a known speech duration, are
+decoded, in a process pool) and skips those without speech, then generates prompts and
+images on their own worker pools and throttles. Images are written as new image generation
+rows tagged with the run's variant, the existing ones are left as they are. Progress is checkpointed to a JSON file, running
+the same command again resumes where it stopped. Prompt and image workers wait while the
+live processor has queued work, so visitors are never stuck behind a re-run.
+
+    python reprocess.py --root-id 42 --styles "Mk Gyotaku,Mk Luminogram"
+    python reprocess.py --since 2024-11-01 --until 2024-12-01 --image-workers 2 --images-per-minute 6
+    python reprocess.py --checkpoint reprocess-20241201-120000.json
+"""
+
+import argparse
+import datetime
+import json
+import logging
+import math
+import multiprocessing
+import os
+import tempfile
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, ProcessPoolExecutor, ThreadPoolExecutor, wait
+from typing import Optional
+import requests
+from prometheus_client.parser import text_string_to_metric_families
+from data_client import (
+    get_recording_tree,
+    list_recordings,
+    update_transcription,
+    update_voice_activity,
+    create_image_generation,
+    update_image_generation,
+    download_recording_audio,
+    ImageGenerationCreate,
+    ImageGenerationUpdate,
+)
+from image_generation import generate_image
+from image_prompt_generation import get_image_prompts
+from voice_activity import VAD_ENABLED, VoiceActivity, detect_voice_activity
+from processing_service import (
+    STYLES,
+    SECONDS_PER_PROMPT,
+    get_image_file_name,
+    get_image_file_style,
+    prompt_template,
+    negative_prompt,
+    ollama_model,
+    whisper_model_name,
+    image_generations_path,
+    audio_recordings_path,
+    audio_source,
+)
+
+logger = logging.getLogger(__name__)
+
+CHECKPOINT_INTERVAL = 2  # Minimum seconds between checkpoint writes, the last state is always written
+LIVE_QUEUE_METRIC = "branches_processing_queue_depth"
+
+# Whisper model of a transcription process, loaded on its first recording
+_whisper_model = None
+
+
+def _read_recording(recording_id: int, audio_file_path: str, transcribe: bool) -> dict:
+    """Decode a recording for its speech duration and transcribe the speech if asked, run in the process pool"""
+    global _whisper_model
+    import whisper
+
+    with tempfile.TemporaryDirectory() as directory:
+        if audio_source == "http":
+            path = download_recording_audio(
+                str(recording_id), os.path.join(directory, os.path.basename(audio_file_path))
+            )
+        else:
+            path = os.path.join(audio_recordings_path, audio_file_path)
+        audio = whisper.load_audio(path)
+    duration = len(audio) / whisper.audio.SAMPLE_RATE
+    if VAD_ENABLED:
+        voice_activity = detect_voice_activity(audio, whisper.audio.SAMPLE_RATE)
+    else:
+        voice_activity = VoiceActivity(0, len(audio), duration)
+    result = {
+        "duration": duration,
+        "speech_duration": voice_activity.speech_duration,
+        "status": voice_activity.status,
+    }
+    if transcribe and not voice_activity.is_empty:
+        if _whisper_model is None:
+            _whisper_model = whisper.load_model(whisper_model_name)
+        speech = audio[voice_activity.start:voice_activity.end]
+        result["transcription"] = _whisper_model.transcribe(speech, language="en", task="translate")["text"]
+    return result
+
+
+class Throttle:
+    """Spaces calls shared by several worker threads to at most rate_per_minute, 0 for no limit"""
+
+    def __init__(self, rate_per_minute: float):
+        self.interval = 60 / rate_per_minute if rate_per_minute > 0 else 0
+        self.next_time = 0.0
+        self.lock = threading.Lock()
+
+    def wait(self):
+        if not self.interval:
+            return
+        with self.lock:
+            now = time.monotonic()
+            start_time = max(now, self.next_time)
+            self.next_time = start_time + self.interval
+        time.sleep(start_time - now)
+
+
+class LiveTraffic:
+    """Holds re-processing back while the live processor has recordings or images queued"""
+
+    def __init__(self, processor_url: Optional[str], poll_seconds: float):
+        self.processor_url = processor_url
+        self.poll_seconds = poll_seconds
+
+    def queued(self) -> float:
+        try:
+            response = requests.get(f"{self.processor_url}/metrics", timeout=2)
+            response.raise_for_status()
+        except requests.RequestException:
+            return 0  # Nothing live is running through a processor that does not answer
+        return sum(
+            sample.value
+            for family in text_string_to_metric_families(response.text)
+            if family.name == LIVE_QUEUE_METRIC
+            for sample in family.samples
+        )
+
+    def wait_until_idle(self):
+        if not self.processor_url:
+            return
+        while (queued := self.queued()) > 0:
+            logger.info(f"Live processor has {queued:.0f} items queued, waiting")
+            time.sleep(self.poll_seconds)
+
+
+class Checkpoint:
+    """Run options and per recording progress, written atomically so a crash leaves the last good state"""
+
+    def __init__(self, path: str, state: dict):
+        self.path = path
+        self.state = state
+        self.lock = threading.Lock()
+        self.last_save_time = 0.0
+
+    @classmethod
+    def open(cls, path: str, options: dict) -> "Checkpoint":
+        if os.path.exists(path):
+            with open(path) as f:
+                state = json.load(f)
+            logger.info(f"Resuming {state['options']['run_name']} from {path}, its options take precedence")
+            return cls(path, state)
+        checkpoint = cls(path, {"options": options, "recordings": {}})
+        checkpoint.save(force=True)
+        return checkpoint
+
+    @property
+    def options(self) -> dict:
+        return self.state["options"]
+
+    def recording(self, recording_id: int) -> dict:
+        with self.lock:
+            return self.state["recordings"].setdefault(str(recording_id), {"images": {}})
+
+    def update(self, recording_id: int, **fields):
+        with self.lock:
+            self.state["recordings"].setdefault(str(recording_id), {"images": {}}).update(fields)
+        self.save()
+
+    def update_image(self, recording_id: int, index: int, **fields):
+        with self.lock:
+            images = self.state["recordings"].setdefault(str(recording_id), {"images": {}})["images"]
+            images.setdefault(str(index), {}).update(fields)
+        self.save()
+
+    def save(self, force: bool = False):
+        with self.lock:
+            if not force and time.monotonic() - self.last_save_time < CHECKPOINT_INTERVAL:
+                return
+            with open(self.path + ".tmp", "w") as f:
+                json.dump(self.state, f, indent=1)
+            os.replace(self.path + ".tmp", self.path)
+            self.last_save_time = time.monotonic()
+
+
+class Reprocessor:
+    """
+    Runs the selected recordings through decode/transcribe, prompt and image stages, each on
+    its own pool. A recording moves on to the next stage as soon as its previous one finishes.
+    """
+
+    def __init__(self, checkpoint: Checkpoint, live_traffic: LiveTraffic):
+        self.checkpoint = checkpoint
+        self.options = checkpoint.options
+        self.live_traffic = live_traffic
+        self.prompt_throttle = Throttle(self.options["prompts_per_minute"])
+        self.image_throttle = Throttle(self.options["images_per_minute"])
+        self.variant = f"reprocess:{self.options['run_name']}"
+        self.pending: dict[Future, tuple] = {}
+        self.counts = {"recordings": 0, "transcribed": 0, "prompted": 0, "images": 0, "empty": 0, "failed": 0}
+
+    def run(self, recordings: list[dict]) -> dict:
+        # Spawned rather than forked, CUDA cannot be used in a forked child
+        with ProcessPoolExecutor(
+            self.options["transcribe_processes"], mp_context=multiprocessing.get_context("spawn")
+        ) as self.transcribe_pool, ThreadPoolExecutor(
+            self.options["prompt_workers"], thread_name_prefix="reprocess-prompt"
+        ) as self.prompt_pool, ThreadPoolExecutor(
+            self.options["image_workers"], thread_name_prefix="reprocess-image"
+        ) as self.image_pool:
+            for recording in recordings:
+                self.counts["recordings"] += 1
+                self._schedule_read(recording)
+            while self.pending:
+                done, _ = wait(self.pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    stage, recording, *rest = self.pending.pop(future)
+                    try:
+                        getattr(self, f"_on_{stage}")(recording, future.result(), *rest)
+                    except Exception as e:
+                        self.counts["failed"] += 1
+                        logger.error(f"Re-processing {stage} of recording {recording['id']} failed: {str(e)}")
+        self.checkpoint.save(force=True)
+        return self.counts
+
+    def _schedule_read(self, recording: dict):
+        progress = self.checkpoint.recording(recording["id"])
+        if recording.get("status") == "empty" and not self.options["retranscribe"]:
+            self.counts["empty"] += 1
+            return  # Nothing was said, there is nothing to prompt
+        transcription = progress.get("transcription") or (
+            None if self.options["retranscribe"] else recording.get("transcription")
+        )
+        speech_duration = progress.get("speech_duration") or recording.get("speech_duration")
+        if transcription and speech_duration:
+            self._schedule_prompts(recording, transcription, speech_duration)
+            return
+        future = self.transcribe_pool.submit(
+            _read_recording, recording["id"], recording["audio_file_path"], not transcription
+        )
+        self.pending[future] = ("read", recording, transcription)
+
+    def _on_read(self, recording: dict, result: dict, transcription: Optional[str]):
+        update_voice_activity(str(recording["id"]), result["status"], result["duration"], result["speech_duration"])
+        if result["status"] == "empty":
+            self.counts["empty"] += 1
+            return
+        if "transcription" in result:
+            transcription = result["transcription"]
+            update_transcription(str(recording["id"]), transcription)
+            self.counts["transcribed"] += 1
+        self.checkpoint.update(recording["id"], transcription=transcription, speech_duration=result["speech_duration"])
+        self._schedule_prompts(recording, transcription, result["speech_duration"])
+
+    def _schedule_prompts(self, recording: dict, transcription: str, speech_duration: float):
+        prompts = self.checkpoint.recording(recording["id"]).get("prompts")
+        if prompts:
+            self._schedule_images(recording, prompts)
+            return
+        future = self.prompt_pool.submit(self._generate_prompts, transcription, speech_duration)
+        self.pending[future] = ("prompts", recording)
+
+    def _generate_prompts(self, transcription: str, speech_duration: float) -> list[str]:
+        self.live_traffic.wait_until_idle()
+        self.prompt_throttle.wait()
+        prompt_count = math.ceil(speech_duration / SECONDS_PER_PROMPT)
+        return get_image_prompts(transcription, self.options["ollama_model"], prompt_count)
+
+    def _on_prompts(self, recording: dict, prompts: list[str]):
+        self.checkpoint.update(recording["id"], prompts=prompts)
+        self.counts["prompted"] += 1
+        self._schedule_images(recording, prompts)
+
+    def _schedule_images(self, recording: dict, prompts: list[str]):
+        images = self.checkpoint.recording(recording["id"])["images"]
+        for index, prompt in enumerate(prompts):
+            image = images.get(str(index), {})
+            if image.get("status") in ("completed", "cancelled"):
+                continue
+            future = self.image_pool.submit(
+                self._render_image, recording["id"], index, prompt, image.get("image_generation_id")
+            )
+            self.pending[future] = ("image", recording)
+
+    def _prepare_image_generation(
+        self, recording_id: int, index: int, prompt: str, image_generation_id: Optional[int]
+    ) -> Optional[int]:
+        """The pending row to render the image into, None if it was cancelled meanwhile"""
+        if image_generation_id is not None:
+            # Resets the row of an interrupted run, and finds out whether compaction deleted it
+            try:
+                if update_image_generation(
+                    str(recording_id), str(image_generation_id), ImageGenerationUpdate(status="pending")
+                ):
+                    return image_generation_id
+                return None
+            except requests.HTTPError as e:
+                if e.response.status_code != 404:
+                    raise
+                logger.info(f"Image generation {image_generation_id} of recording {recording_id} is gone, creating it again")
+        image_generation_id = create_image_generation(
+            str(recording_id),
+            ImageGenerationCreate(audio_recording_id=recording_id, prompt=prompt, variant=self.variant),
+        )
+        # Recorded before rendering so a resumed run fills this row instead of adding another
+        self.checkpoint.update_image(recording_id, index, image_generation_id=image_generation_id)
+        return image_generation_id
+
+    def _render_image(
+        self, recording_id: int, index: int, prompt: str, image_generation_id: Optional[int]
+    ) -> Optional[int]:
+        self.live_traffic.wait_until_idle()
+        self.image_throttle.wait()
+        image_generation_id = self._prepare_image_generation(recording_id, index, prompt, image_generation_id)
+        if image_generation_id is None:
+            self.checkpoint.update_image(recording_id, index, status="cancelled")
+            return None
+        try:
+            image_result = generate_image(
+                self.options["prompt_template"].format(prompt=prompt),
+                self.options["styles"],
+                self.options["negative_prompt"],
+            )
+            file_name = get_image_file_name(
+                str(recording_id), str(image_generation_id), index, get_image_file_style(self.options["styles"])
+            )
+            with open(os.path.join(image_generations_path, file_name), "wb") as f:
+                f.write(image_result.image_data)
+            stored = update_image_generation(
+                str(recording_id),
+                str(image_generation_id),
+                ImageGenerationUpdate(
+                    image_file_path=file_name,
+                    seed=image_result.seed,
+                    request_payload=image_result.request_payload,
+                    status="completed",
+                    duration=image_result.duration,
+                ),
+            )
+        except Exception as e:
+            try:
+                update_image_generation(
+                    str(recording_id), str(image_generation_id), ImageGenerationUpdate(status="failed", reason=str(e))
+                )
+            except Exception as update_error:
+                logger.warning(f"Could not mark image generation {image_generation_id} failed: {str(update_error)}")
+            self.checkpoint.update_image(recording_id, index, status="failed")
+            raise
+        if not stored:
+            self.checkpoint.update_image(recording_id, index, status="cancelled")
+            return None
+        self.checkpoint.update_image(recording_id, index, status="completed")
+        return image_generation_id
+
+    def _on_image(self, recording: dict, image_generation_id: Optional[int]):
+        if image_generation_id is None:
+            logger.info(f"Skipped a cancelled image generation of recording {recording['id']}")
+            return
+        self.counts["images"] += 1
+        logger.info(f"Stored image generation {image_generation_id} of recording {recording['id']}")
+
+
+def select_recordings(options: dict) -> list[dict]:
+    if options["root_id"] is not None:
+        recordings = get_recording_tree(str(options["root_id"]))
+    else:
+        recordings = list(list_recordings(options["since"], options["until"]))
+    # Parents first, so a tree fills in from its trunk
+    return sorted(recordings, key=lambda recording: recording["id"])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    selection = parser.add_mutually_exclusive_group()
+    selection.add_argument("--root-id", type=int, help="Re-process this recording and every branch below it")
+    selection.add_argument("--since", help="Re-process recordings created at or after this ISO date")
+    parser.add_argument("--until", help="With --since, only recordings created before this ISO date")
+    parser.add_argument("--styles", type=lambda v: v.split(","), default=STYLES, help="Comma separated Fooocus styles")
+    parser.add_argument("--ollama-model", default=ollama_model)
+    parser.add_argument("--prompt-template", default=prompt_template, help="Template of the image prompt, with a {prompt} field")
+    parser.add_argument("--negative-prompt", default=negative_prompt)
+    parser.add_argument("--retranscribe", action="store_true", help="Transcribe again instead of reusing stored transcriptions")
+    parser.add_argument("--transcribe-processes", type=int, default=1, help="Processes decoding and transcribing audio")
+    parser.add_argument("--prompt-workers", type=int, default=2)
+    parser.add_argument("--image-workers", type=int, default=1)
+    parser.add_argument("--prompts-per-minute", type=float, default=0, help="Throttle of Ollama requests, 0 for none")
+    parser.add_argument("--images-per-minute", type=float, default=0, help="Throttle of Fooocus requests, 0 for none")
+    parser.add_argument(
+        "--live-processor-url",
+        default=os.getenv("AUDIO_PROCESSOR_URL"),
+        help="Live processor whose queues are left to drain first, empty to not wait",
+    )
+    parser.add_argument("--live-poll-seconds", type=float, default=5)
+    parser.add_argument("--run-name", default=f"reprocess-{datetime.datetime.now():%Y%m%d-%H%M%S}")
+    parser.add_argument("--checkpoint", help="Checkpoint file, resumed when it exists, RUN_NAME.json by default")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+    checkpoint_path = args.checkpoint or f"{args.run_name}.json"
+    if not os.path.exists(checkpoint_path) and args.root_id is None and args.since is None:
+        parser.error("one of --root-id or --since is required for a new run")
+    options = {
+        "run_name": args.run_name,
+        "root_id": args.root_id,
+        "since": args.since,
+        "until": args.until,
+        "styles": args.styles,
+        "ollama_model": args.ollama_model,
+        "prompt_template": args.prompt_template,
+        "negative_prompt": args.negative_prompt,
+        "retranscribe": args.retranscribe,
+        "transcribe_processes": args.transcribe_processes,
+        "prompt_workers": args.prompt_workers,
+        "image_workers": args.image_workers,
+        "prompts_per_minute": args.prompts_per_minute,
+        "images_per_minute": args.images_per_minute,
+    }
+    checkpoint = Checkpoint.open(checkpoint_path, options)
+    recordings = select_recordings(checkpoint.options)
+    logger.info(f"Re-processing {len(recordings)} recordings as {checkpoint.options['run_name']}")
+    reprocessor = Reprocessor(checkpoint, LiveTraffic(args.live_processor_url, args.live_poll_seconds))
+    print(json.dumps(reprocessor.run(recordings), indent=4))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+import image_generation
+from image_generation import BatchJobAbandoned, ImageGenerationResult, generate_images_batch
+
+
+class FakeFooocus:
+    """Async jobs that finish on the given poll, None never finishes"""
+
+    def __init__(self, monkeypatch, finish_after: list):
+        self.finish_after = finish_after
+        self.submitted: list[str] = []
+        self.polls: dict[str, int] = {}
+        self.stops = 0
+        monkeypatch.setattr(image_generation, "text2img", self.text2img)
+        monkeypatch.setattr(image_generation, "query_job", self.query_job)
+        monkeypatch.setattr(image_generation, "read_image_data", lambda url: b"png")
+        monkeypatch.setattr(image_generation, "stop_generation", self.stop_generation)
+
+    def text2img(self, params: dict) -> dict:
+        job_id = f"job-{len(self.submitted)}"
+        self.submitted.append(job_id)
+        return {"job_id": job_id}
+
+    def query_job(self, job_id: str) -> dict:
+        self.polls[job_id] = self.polls.get(job_id, 0) + 1
+        finish_after = self.finish_after[int(job_id.split("-")[1])]
+        if finish_after is None or self.polls[job_id] < finish_after:
+            return {"job_stage": "RUNNING"}
+        return {"job_stage": "SUCCESS", "job_result": [{"url": "data:image/png;base64,", "seed": 1}]}
+
+    def stop_generation(self):
+        self.stops += 1
+
+
+def test_batch_keeps_only_a_few_jobs_submitted(monkeypatch):
+    fooocus = FakeFooocus(monkeypatch, [1, 2, 1, 1])
+    submitted_while_running = []
+    results = []
+    for index, result in generate_images_batch(["a", "b", "c", "d"], [], poll_interval=0, max_submitted=2):
+        submitted_while_running.append(len(fooocus.submitted))
+        results.append((index, result))
+
+    assert sorted(index for index, _ in results) == [0, 1, 2, 3]
+    assert all(isinstance(result, ImageGenerationResult) for _, result in results)
+    # The first result arrives with only two of the four prompts submitted
+    assert submitted_while_running[0] == 2
+    assert fooocus.stops == 0
+
+
+def test_batch_stops_running_job_and_submits_no_more(monkeypatch):
+    fooocus = FakeFooocus(monkeypatch, [1, None, None, None])
+    stop = False
+    results = []
+    for index, result in generate_images_batch(
+        ["a", "b", "c", "d"], [], poll_interval=0, max_submitted=2, should_stop=lambda: stop
+    ):
+        results.append(index)
+        stop = True
+
+    assert results == [0]
+    assert len(fooocus.submitted) == 2
+    assert fooocus.stops == 1
+
+
+def test_batch_timeout_abandons_submitted_jobs(monkeypatch):
+    fooocus = FakeFooocus(monkeypatch, [None, None, None])
+    results = dict(generate_images_batch(["a", "b", "c"], [], poll_interval=0, timeout=0, max_submitted=2))
+
+    assert isinstance(results[0], BatchJobAbandoned)
+    assert isinstance(results[1], BatchJobAbandoned)
+    # Never submitted, so it is safe to queue again
+    assert type(results[2]) is TimeoutError
+    assert fooocus.stops == 1
+
+
+def test_breaking_out_of_batch_stops_running_job(monkeypatch):
+    fooocus = FakeFooocus(monkeypatch, [1, None])
+    batch = generate_images_batch(["a", "b"], [], poll_interval=0)
+    next(batch)
+    batch.close()
+
+    assert fooocus.stops == 1
+
+
+def test_batch_leaves_fooocus_running_when_not_allowed_to_stop(monkeypatch):
+    fooocus = FakeFooocus(monkeypatch, [None, None])
+    results = dict(generate_images_batch(["a", "b"], [], poll_interval=0, timeout=0, allow_stop=False))
+
+    assert all(isinstance(result, BatchJobAbandoned) for result in results.values())
+    assert fooocus.stops == 0
+
+
+def test_stop_generation_gives_up_on_unresponsive_fooocus(monkeypatch):
+    calls = []
+    monkeypatch.setattr(image_generation.requests, "post", lambda url, **kwargs: calls.append(kwargs))
+
+    image_generation.stop_generation()
+
+    assert calls[0]["timeout"] == image_generation.STOP_TIMEOUT
@@ -0,0 +1,194 @@
+from queue import Full
+import pytest
+import processing_service
+from image_generation import BatchJobAbandoned, ImageGenerationResult
+from processing_pipeline import PipelineStage, RecordingJob
+from processing_service import AudioProcessingService
+
+
+def image_result() -> ImageGenerationResult:
+    return ImageGenerationResult(
+        url="data:", seed=1, request_payload={"style_selections": []}, duration=1.0, image_data=b"png"
+    )
+
+
+def image_item(recording_id: str, index: int) -> tuple:
+    return recording_id, f"prompt {index}", f"{recording_id}-{index}", {}, index, 0
+
+
+@pytest.fixture
+def service(monkeypatch, tmp_path):
+    """A service that is not started, its data API updates recorded as (generation id, status)"""
+    updates = []
+    monkeypatch.setattr(
+        processing_service,
+        "update_image_generation",
+        lambda recording_id, image_generation_id, update: updates.append((image_generation_id, update.status)),
+    )
+    monkeypatch.setattr(processing_service, "image_generations_path", str(tmp_path))
+    monkeypatch.setattr(processing_service, "RETRY_DELAY", 0)
+    service = AudioProcessingService()
+    service.is_running = True
+    service.updates = updates
+    yield service
+    service.stop()
+
+
+def test_batch_stores_results_and_fails_abandoned_jobs(service, monkeypatch):
+    results = [(0, image_result()), (1, BatchJobAbandoned("timed out")), (2, RuntimeError("failed"))]
+    monkeypatch.setattr(processing_service, "generate_images_batch", lambda *args, **kwargs: iter(results))
+    retried = []
+    monkeypatch.setattr(service, "_retry_later", lambda item, error: retried.append(item[2]))
+
+    service._generate_and_store_batch("1", [(index, image_item("1", index)) for index in range(3)])
+
+    # The abandoned job may still render in Fooocus, so it is failed rather than queued again
+    assert service.updates == [("1-0", "completed"), ("1-1", "failed")]
+    assert retried == ["1-2"]
+
+
+def test_batch_fails_remaining_rows_when_storing_raises(service, monkeypatch):
+    results = [(0, image_result()), (1, image_result()), (2, image_result())]
+    monkeypatch.setattr(processing_service, "generate_images_batch", lambda *args, **kwargs: iter(results))
+    stored = []
+
+    def store_image(recording_id, image_generation_id, index, result):
+        if index == 1:
+            raise OSError("disk full")
+        stored.append(index)
+        return "image.png"
+
+    monkeypatch.setattr(service, "_store_image", store_image)
+
+    with pytest.raises(OSError):
+        service._generate_and_store_batch("1", [(index, image_item("1", index)) for index in range(3)])
+
+    assert stored == [0]
+    assert service.updates == [("1-0", "completed"), ("1-1", "failed"), ("1-2", "failed")]
+
+
+def test_batch_of_cancelled_recording_is_not_submitted(service, monkeypatch):
+    def generate_images_batch(*args, **kwargs):
+        raise AssertionError("A cancelled recording's batch was submitted")
+
+    monkeypatch.setattr(processing_service, "generate_images_batch", generate_images_batch)
+    service.cancelled_recordings.add("1")
+
+    service._generate_and_store_batch("1", [(index, image_item("1", index)) for index in range(2)])
+
+    assert service.updates == [("1-0", "cancelled"), ("1-1", "cancelled")]
+
+
+def queued_ids(stage: PipelineStage) -> list[str]:
+    return [job.recording_id for job in stage.queue.queue]
+
+
+def test_urgent_jobs_are_put_ahead_of_waiting_jobs():
+    urgent = {"8", "9"}
+    stage = PipelineStage("test", lambda job: job, 1, 4, is_urgent=lambda recording_id: recording_id in urgent)
+
+    for recording_id in ["1", "2", "8", "9"]:
+        stage.put(RecordingJob(recording_id, "audio.wav", {}))
+
+    assert queued_ids(stage) == ["8", "9", "1", "2"]
+    with pytest.raises(Full):
+        stage.put(RecordingJob("9", "audio.wav", {}), block=False)
+
+
+def test_preempted_recording_stays_ahead_in_later_stages(service):
+    for recording_id in ["100", "101", "102"]:
+        service.prompt_stage.put(RecordingJob(recording_id, "audio.wav", {}))
+
+    service.add_processing_request("999", "audio.wav", urgent=True)
+    # As the transcribe stage hands the job on once it is done with it
+    service.prompt_stage.put(service.decode_stage.queue.get_nowait())
+
+    assert queued_ids(service.prompt_stage) == ["999", "100", "101", "102"]
+
+
+def test_cancelled_recording_is_forgotten_once_its_work_is_done(service, monkeypatch):
+    monkeypatch.setattr(processing_service, "update_prompts", lambda recording_id, prompts: None)
+    monkeypatch.setattr(
+        service, "_create_pending_image_generations", lambda recording_id, prompts: [("1-0", "a"), ("1-1", "b")]
+    )
+    service.add_processing_request("1", "audio.wav")
+    job = service.decode_stage.queue.get_nowait()
+    job.prompts = ["a", "b"]
+    service._register_prompts(job)
+    service._finish_work("1")  # The job leaves the register stage
+    _, rendering = service.image_generation_queue.get_nowait()
+
+    service.cancel_recording("1")
+
+    # The queued image is cancelled, the rendering one still has to see the mark
+    assert service.updates == [("1-1", "cancelled")]
+    assert service._is_cancelled("1")
+    with pytest.raises(ValueError):
+        service.add_processing_request("1", "audio.wav")
+    service._generate_and_store_image(rendering)
+    service._finish_work("1")  # The image thread is done with it
+    assert service.updates[-1] == ("1-0", "cancelled")
+    assert not service._is_cancelled("1")
+    assert service.recording_work == {}
+
+
+def test_cancelling_recording_without_work_leaves_no_mark(service):
+    service.cancel_recording("1")
+
+    assert service.cancelled_recordings == set()
+
+
+def test_preempted_recording_is_forgotten_once_dropped(service):
+    service.add_processing_request("1", "audio.wav", urgent=True)
+
+    service.cancel_recording("1")
+
+    assert (service.urgent_recordings, service.cancelled_recordings, service.recording_work) == (set(), set(), {})
+
+
+def test_processing_a_cancelled_recording_is_a_conflict(monkeypatch):
+    from fastapi.testclient import TestClient
+    import process_audio_file
+
+    def add_processing_request(recording_id, source_file, urgent):
+        raise ValueError(f"Recording {recording_id} was cancelled")
+
+    monkeypatch.setattr(process_audio_file, "WORKER_MODE", "push")
+    monkeypatch.setattr(process_audio_file.processing_service, "add_processing_request", add_processing_request)
+
+    response = TestClient(process_audio_file.app).post(
+        "/process-audio/", json={"recording_id": "1", "source_file": "audio.wav", "urgent": True}
+    )
+
+    assert response.status_code == 409
+
+
+def test_receive_time_is_dropped_when_recording_ends_without_prompts(service, monkeypatch):
+    monkeypatch.setattr(processing_service, "update_prompts", lambda recording_id, prompts: None)
+    monkeypatch.setattr(service, "_create_pending_image_generations", lambda recording_id, prompts: [])
+    service.add_processing_request("1", "audio.wav")
+    job = service.decode_stage.queue.get_nowait()
+    job.prompts = []
+    service._register_prompts(job)
+
+    service._finish_work("1")  # The job leaves the register stage
+
+    assert service.recording_received_times == {}
+
+
+def test_receive_time_is_dropped_when_every_image_failed(service, monkeypatch):
+    def generate_image(*args):
+        raise RuntimeError("Fooocus is down")
+
+    monkeypatch.setattr(processing_service, "MAX_RETRIES", 1)
+    monkeypatch.setattr(processing_service, "generate_image", generate_image)
+    service.add_processing_request("1", "audio.wav")
+    service.decode_stage.queue.get_nowait()
+    service._add_work("1")  # Its only image, queued by the register stage
+    service._finish_work("1")  # The job leaves the register stage
+
+    service._generate_and_store_image(image_item("1", 0))
+    service._finish_work("1")  # The image thread is done with it
+
+    assert service.updates == [("1-0", "failed")]
+    assert service.recording_received_times == {}
@@ -0,0 +1,97 @@
+import pytest
+import requests
+import reprocess
+from image_generation import ImageGenerationResult
+from reprocess import Checkpoint, LiveTraffic, Reprocessor
+
+
+def http_error(status_code: int) -> requests.HTTPError:
+    response = requests.Response()
+    response.status_code = status_code
+    return requests.HTTPError(response=response)
+
+
+@pytest.fixture
+def reprocessor(monkeypatch, tmp_path):
+    """A reprocessor rendering fake images, its created rows and updates recorded"""
+    options = {
+        "run_name": "test",
+        "prompts_per_minute": 0,
+        "images_per_minute": 0,
+        "prompt_template": "{prompt}",
+        "styles": [],
+        "negative_prompt": "",
+    }
+    reprocessor = Reprocessor(
+        Checkpoint(str(tmp_path / "checkpoint.json"), {"options": options, "recordings": {}}), LiveTraffic(None, 0)
+    )
+    reprocessor.created = []
+    reprocessor.updates = []
+    reprocessor.update_responses = {}
+
+    def create_image_generation(recording_id, image_generation):
+        reprocessor.created.append(image_generation.status)
+        return 100 + len(reprocessor.created)
+
+    def update_image_generation(recording_id, image_generation_id, update):
+        reprocessor.updates.append((image_generation_id, update.status))
+        response = reprocessor.update_responses.get((image_generation_id, update.status), True)
+        if isinstance(response, Exception):
+            raise response
+        return response
+
+    monkeypatch.setattr(reprocess, "create_image_generation", create_image_generation)
+    monkeypatch.setattr(reprocess, "update_image_generation", update_image_generation)
+    monkeypatch.setattr(
+        reprocess,
+        "generate_image",
+        lambda *args: ImageGenerationResult(url="data:", seed=1, request_payload={}, duration=1.0, image_data=b"png"),
+    )
+    monkeypatch.setattr(reprocess, "image_generations_path", str(tmp_path))
+    return reprocessor
+
+
+def image_progress(reprocessor: Reprocessor, index: int = 0) -> dict:
+    return reprocessor.checkpoint.recording(1)["images"][str(index)]
+
+
+def test_new_rows_are_created_pending(reprocessor):
+    assert reprocessor._render_image(1, 0, "prompt", None) == 101
+
+    assert reprocessor.created == ["pending"]
+    assert reprocessor.updates == [("101", "completed")]
+    assert image_progress(reprocessor) == {"image_generation_id": 101, "status": "completed"}
+
+
+def test_resumed_row_is_reset_to_pending(reprocessor):
+    assert reprocessor._render_image(1, 0, "prompt", 7) == 7
+
+    assert reprocessor.created == []
+    assert reprocessor.updates == [("7", "pending"), ("7", "completed")]
+
+
+def test_deleted_row_is_created_again(reprocessor):
+    reprocessor.update_responses[("7", "pending")] = http_error(404)
+
+    assert reprocessor._render_image(1, 0, "prompt", 7) == 101
+
+    assert reprocessor.updates == [("7", "pending"), ("101", "completed")]
+    assert image_progress(reprocessor) == {"image_generation_id": 101, "status": "completed"}
+
+
+def test_cancelled_row_is_not_checkpointed_completed(reprocessor):
+    reprocessor.update_responses[("101", "completed")] = False
+
+    assert reprocessor._render_image(1, 0, "prompt", None) is None
+
+    assert image_progress(reprocessor)["status"] == "cancelled"
+
+
+def test_failed_update_is_not_checkpointed_completed(reprocessor):
+    reprocessor.update_responses[("101", "completed")] = http_error(500)
+
+    with pytest.raises(requests.HTTPError):
+        reprocessor._render_image(1, 0, "prompt", None)
+
+    assert reprocessor.updates[-1] == ("101", "failed")
+    assert image_progress(reprocessor)["status"] == "failed"
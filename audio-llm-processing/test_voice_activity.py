@@ -0,0 +1,53 @@
+import numpy as np
+from voice_activity import MIN_SPEECH_SECONDS, detect_voice_activity
+
+SAMPLE_RATE = 16000
+
+
+def noise(seconds: float, level_db: float, seed: int = 0) -> np.ndarray:
+    """White noise with an energy of level_db per frame"""
+    rng = np.random.default_rng(seed)
+    return (rng.standard_normal(int(seconds * SAMPLE_RATE)) * 10 ** (level_db / 20)).astype(np.float32)
+
+
+def test_silence_is_empty():
+    voice_activity = detect_voice_activity(noise(5, -70), SAMPLE_RATE)
+
+    assert voice_activity.is_empty
+    assert not voice_activity.uncertain
+
+
+def test_click_in_silence_is_empty():
+    audio = noise(5, -70)
+    audio[SAMPLE_RATE:SAMPLE_RATE + 480] = noise(0.03, -10, seed=1)
+
+    assert detect_voice_activity(audio, SAMPLE_RATE).status == "empty"
+
+
+def test_speech_is_trimmed_to_its_range():
+    audio = np.concatenate((noise(2, -60), noise(3, -25, seed=1), noise(2, -60, seed=2)))
+
+    voice_activity = detect_voice_activity(audio, SAMPLE_RATE)
+
+    assert voice_activity.status == "speech"
+    assert abs(voice_activity.speech_duration - 3) < 0.1
+    assert 1.7 * SAMPLE_RATE < voice_activity.start < 2 * SAMPLE_RATE
+    assert 5 * SAMPLE_RATE < voice_activity.end < 5.3 * SAMPLE_RATE
+
+
+def test_continuous_loud_speech_is_kept():
+    voice_activity = detect_voice_activity(noise(6, -20), SAMPLE_RATE)
+
+    assert voice_activity.status == "speech"
+    assert voice_activity.speech_duration > 5.9
+
+
+def test_speech_close_to_noise_is_uncertain_and_kept_whole():
+    audio = np.concatenate((noise(2, -45), noise(3, -37, seed=1), noise(2, -45, seed=2)))
+
+    voice_activity = detect_voice_activity(audio, SAMPLE_RATE)
+
+    assert voice_activity.uncertain
+    assert voice_activity.status == "speech"
+    assert (voice_activity.start, voice_activity.end) == (0, len(audio))
+    assert voice_activity.speech_duration >= MIN_SPEECH_SECONDS
@@ -0,0 +1,83 @@
+import os
+from dataclasses import dataclass
+import numpy as np
+
+VAD_ENABLED = os.getenv("VAD_ENABLED", "true").lower() == "true"  # Trim silence and skip recordings without speech
+VAD_FRAME_SECONDS = 0.03  # Length of the frames energy is measured over
+VAD_MARGIN_DB = float(os.getenv("VAD_MARGIN_DB", "12"))  # How far above the noise floor a frame counts as speech
+VAD_MIN_ENERGY_DB = float(os.getenv("VAD_MIN_ENERGY_DB", "-50"))  # Frames quieter than this are never speech
+VAD_SPEECH_ENERGY_DB = float(os.getenv("VAD_SPEECH_ENERGY_DB", "-30"))  # Frames louder than this are always speech
+VAD_MIN_BURST_SECONDS = 0.09  # Shorter bursts, clicks and bumps of the microphone, are ignored
+VAD_HANGOVER_SECONDS = 0.3  # Pauses between words up to twice this long still count as speech
+VAD_PADDING_SECONDS = 0.2  # Kept before the first and after the last speech frame when trimming
+MIN_SPEECH_SECONDS = float(os.getenv("MIN_SPEECH_SECONDS", "0.5"))  # Less speech than this makes a recording empty
+
+
+@dataclass
+class VoiceActivity:
+    # Sample range from the first to the last speech, padded
+    start: int
+    end: int
+    speech_duration: float
+    # Speech could not be told from the noise, the whole recording is kept
+    uncertain: bool = False
+
+    @property
+    def is_empty(self) -> bool:
+        return self.speech_duration < MIN_SPEECH_SECONDS
+
+    @property
+    def status(self) -> str:
+        return "empty" if self.is_empty else "speech"
+
+
+def _window_counts(mask: np.ndarray, width: int) -> np.ndarray:
+    # Set frames within width of every frame, the edges repeated so runs touching them are kept whole
+    padded = np.pad(mask.astype(np.int32), width, mode="edge")
+    return np.convolve(padded, np.ones(2 * width + 1, dtype=np.int32), "valid")
+
+
+def _erode(mask: np.ndarray, width: int) -> np.ndarray:
+    return _window_counts(mask, width) == 2 * width + 1
+
+
+def _dilate(mask: np.ndarray, width: int) -> np.ndarray:
+    return _window_counts(mask, width) > 0
+
+
+def detect_voice_activity(audio: np.ndarray, sample_rate: int) -> VoiceActivity:
+    """
+    Energy based voice activity over 30 ms frames, in one vectorized pass. The threshold follows
+    the recording's own noise floor so a noisy room does not count as speech, while frames above
+    VAD_SPEECH_ENERGY_DB count whatever the floor, so speech from start to end is not taken for
+    noise. Short bursts are dropped and short pauses bridged before measuring how long the visitor
+    spoke. A steady recording without speech found is uncertain and kept whole rather than dropped.
+    """
+    frame_length = int(sample_rate * VAD_FRAME_SECONDS)
+    frame_count = len(audio) // frame_length
+    if frame_count == 0:
+        return VoiceActivity(0, 0, 0.0)
+    frames = audio[: frame_count * frame_length].reshape(frame_count, frame_length)
+    energy_db = 10 * np.log10(np.mean(np.square(frames, dtype=np.float64), axis=1) + 1e-10)
+    noise_floor_db, loud_db = np.percentile(energy_db, [10, 90])
+    speech = (energy_db > max(noise_floor_db + VAD_MARGIN_DB, VAD_MIN_ENERGY_DB)) | (energy_db > VAD_SPEECH_ENERGY_DB)
+
+    burst_width = int(VAD_MIN_BURST_SECONDS / VAD_FRAME_SECONDS) // 2
+    speech = _dilate(_erode(speech, burst_width), burst_width)
+    hangover_width = int(VAD_HANGOVER_SECONDS / VAD_FRAME_SECONDS)
+    speech = _erode(_dilate(speech, hangover_width), hangover_width)
+
+    speech_frames = np.flatnonzero(speech)
+    if len(speech_frames) == 0:
+        voice_activity = VoiceActivity(0, 0, 0.0)
+    else:
+        padding = int(VAD_PADDING_SECONDS * sample_rate)
+        voice_activity = VoiceActivity(
+            start=max(0, int(speech_frames[0]) * frame_length - padding),
+            end=min(len(audio), (int(speech_frames[-1]) + 1) * frame_length + padding),
+            speech_duration=len(speech_frames) * VAD_FRAME_SECONDS,
+        )
+    # Audible but hardly louder than its quietest stretches: speech close to the noise, or noise alone
+    if voice_activity.is_empty and loud_db > VAD_MIN_ENERGY_DB and loud_db - noise_floor_db < VAD_MARGIN_DB:
+        return VoiceActivity(0, len(audio), len(audio) / sample_rate, uncertain=True)
+    return voice_activity
@@ -0,0 +1,77 @@
+import json
+import math
+import platform
+import subprocess
+from datetime import datetime
+
+
+def percentiles(values: list[float], quantiles=(50, 95, 99)) -> dict:
+    """Nearest-rank percentiles plus count, mean and max of a list of samples"""
+    if not values:
+        return {"count": 0}
+    ordered = sorted(values)
+    summary = {
+        "count": len(ordered),
+        "mean": sum(ordered) / len(ordered),
+        "max": ordered[-1],
+    }
+    for q in quantiles:
+        rank = max(1, math.ceil(q / 100 * len(ordered)))
+        summary[f"p{q}"] = ordered[rank - 1]
+    return summary
+
+
+def _git_revision() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def write_results(path: str, benchmark: str, config: dict, results: dict):
+    """Write results with enough context to compare runs between versions"""
+    document = {
+        "benchmark": benchmark,
+        "timestamp": datetime.now().isoformat(),
+        "git_revision": _git_revision(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "config": config,
+        "results": results,
+    }
+    with open(path, "w") as f:
+        json.dump(document, f, indent=4)
+    print(f"Wrote results to {path}")
+
+
+def compare_with_baseline(results: dict, baseline_path: str, tolerance: float) -> list[str]:
+    """
+    Compare every latency-like key (p50/p95/p99/mean) against a previous results file.
+    Returns a description of each metric that got slower by more than the tolerance.
+    """
+    with open(baseline_path) as f:
+        baseline = json.load(f)["results"]
+
+    regressions = []
+
+    def walk(current, previous, path):
+        if isinstance(current, dict) and isinstance(previous, dict):
+            for key, value in current.items():
+                if key in previous:
+                    walk(value, previous[key], f"{path}.{key}" if path else key)
+        elif (
+            isinstance(current, (int, float))
+            and isinstance(previous, (int, float))
+            and path.rsplit(".", 1)[-1] in ("p50", "p95", "p99", "mean")
+            and previous > 0
+            and current > previous * (1 + tolerance)
+        ):
+            regressions.append(f"{path}: {previous:.4f} -> {current:.4f}")
+
+    walk(results, baseline, "")
+    return regressions
@@ -0,0 +1,450 @@
+"""
+End-to-end benchmark of the data API and the audio processor against stubbed
+Ollama and Fooocus backends.
+
+Starts the stub backends, data_api.py and process_audio_file.py on free local
+ports with a throwaway SQLite database, replays synthetic visitor sessions
+branching off the bundled prototype recordings, and reports throughput,
+time-to-first-image percentiles, tree endpoint latency at several tree sizes
+and SQLite write contention.
+
+Whisper still runs for real, pick a small model with --whisper-model to keep
+runs short.
+
+    python e2e_benchmark.py --sessions 10 --rate 6 --output e2e_results.json
+    python e2e_benchmark.py --baseline e2e_results.json --tolerance 0.2
+"""
+
+import argparse
+import os
+import random
+import socket
+import sqlite3
+import struct
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+import requests
+from benchmark_report import percentiles, write_results, compare_with_baseline
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RECORDINGS_PATH = os.path.join(REPO_ROOT, "prototypes", "Branches-TreeConversation")
+RECORDING_FILES = ["Branch-Recording.wav", "Branch-Recording-2.wav", "Branch-Recording-3.wav"]
+
+
+def wav_duration(path: str) -> float:
+    """Duration of a RIFF/WAVE file, also for the float WAVs the stdlib wave module rejects"""
+    with open(path, "rb") as f:
+        riff, _, wave_id = struct.unpack("<4sI4s", f.read(12))
+        if riff != b"RIFF" or wave_id != b"WAVE":
+            raise ValueError(f"{path} is not a WAV file")
+        byte_rate = None
+        while True:
+            header = f.read(8)
+            if len(header) < 8:
+                raise ValueError(f"{path} has no data chunk")
+            chunk_id, chunk_size = struct.unpack("<4sI", header)
+            if chunk_id == b"fmt ":
+                fmt = f.read(chunk_size)
+                byte_rate = struct.unpack("<I", fmt[8:12])[0]
+            elif chunk_id == b"data":
+                return chunk_size / byte_rate
+            else:
+                f.seek(chunk_size + chunk_size % 2, os.SEEK_CUR)
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+class Services:
+    """The stub backends, data API and processor running as local uvicorn processes"""
+
+    def __init__(self, args, work_dir: str):
+        self.work_dir = work_dir
+        self.db_path = os.path.join(work_dir, "benchmark.db")
+        self.image_path = os.path.join(work_dir, "images")
+        os.makedirs(self.image_path, exist_ok=True)
+        self.stub_url = f"http://127.0.0.1:{free_port()}"
+        self.data_api_url = f"http://127.0.0.1:{free_port()}"
+        self.processor_url = f"http://127.0.0.1:{free_port()}"
+        self.processes: list[subprocess.Popen] = []
+
+        self.env = dict(os.environ)
+        self.env.update(
+            {
+                "DB_PATH": self.db_path,
+                "AUDIO_PROCESSOR_URL": self.processor_url,
+                "DATA_STORE_API_URL": self.data_api_url,
+                "IMAGE_GENERATION_API_URL": self.stub_url,
+                "OLLAMA_HOST": self.stub_url,
+                "OLLAMA_MODEL": "stub",
+                "WHISPER_MODEL": args.whisper_model,
+                "PROMPT_TEMPLATE": "{prompt}",
+                "SECONDS_PER_PROMPT": str(args.seconds_per_prompt),
+                "IMAGE_GENERATIONS_PATH": self.image_path,
+                "AUDIO_RECORDINGS_PATH": RECORDINGS_PATH,
+                "AUDIO_STORAGE_PATH": RECORDINGS_PATH,
+                "STUB_OLLAMA_LATENCY": str(args.ollama_latency),
+                "STUB_FOOOCUS_LATENCY": str(args.fooocus_latency),
+                "STUB_FOOOCUS_FAILURE_RATE": str(args.fooocus_failure_rate),
+            }
+        )
+
+    def _start(self, module: str, url: str, cwd: str, log_name: str):
+        port = url.rsplit(":", 1)[1]
+        log_file = open(os.path.join(self.work_dir, log_name), "w")
+        self.processes.append(
+            subprocess.Popen(
+                [sys.executable, "-m", "uvicorn", module, "--port", port, "--log-level", "warning"],
+                cwd=cwd,
+                env=self.env,
+                stdout=log_file,
+                stderr=subprocess.STDOUT,
+            )
+        )
+
+    def _wait_until_up(self, url: str, timeout: float, path: str = "/openapi.json"):
+        deadline = time.time() + timeout
+        while time.time() < deadline:
+            try:
+                if requests.get(f"{url}{path}", timeout=5).ok:
+                    return
+            except requests.RequestException:
+                pass
+            time.sleep(0.25)
+        raise TimeoutError(f"{url} did not come up within {timeout} seconds, see logs in {self.work_dir}")
+
+    def start(self, startup_timeout: float):
+        subprocess.run(
+            [sys.executable, "remigrate.py"],
+            cwd=os.path.join(REPO_ROOT, "data_store"),
+            env=self.env,
+            check=True,
+        )
+        self._start("stub_backends:app", self.stub_url, os.path.join(REPO_ROOT, "benchmarks"), "stub_backends.log")
+        self._start("data_api:app", self.data_api_url, os.path.join(REPO_ROOT, "data_store"), "data_api.log")
+        self._start(
+            "process_audio_file:app",
+            self.processor_url,
+            os.path.join(REPO_ROOT, "audio-llm-processing"),
+            "processor.log",
+        )
+        for url in (self.stub_url, self.data_api_url):
+            self._wait_until_up(url, startup_timeout)
+        # The processor answers right away and loads Whisper in the background, wait for the model
+        self._wait_until_up(self.processor_url, startup_timeout, "/ready")
+
+    def stop(self):
+        for process in self.processes:
+            process.terminate()
+        for process in self.processes:
+            try:
+                process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                process.kill()
+
+
+def replay_sessions(args, services: Services) -> dict:
+    """Replay visitor sessions arriving as a Poisson process, each branching a few times"""
+    durations = {name: wav_duration(os.path.join(RECORDINGS_PATH, name)) for name in RECORDING_FILES}
+    created: list[dict] = []
+    errors: list[str] = []
+    post_latencies: list[float] = []
+    lock = threading.Lock()
+    rng = random.Random(args.seed)
+
+    def create(audio_file: str, parent: dict = None) -> dict:
+        payload = {"audio_file_path": audio_file}
+        if parent:
+            payload["parent_audio_recording_id"] = parent["id"]
+            payload["parent_time"] = round(rng.uniform(0, durations[parent["audio_file"]]), 2)
+        start_time = time.perf_counter()
+        response = requests.post(f"{services.data_api_url}/recordings/", json=payload, timeout=60)
+        with lock:
+            post_latencies.append(time.perf_counter() - start_time)
+        response.raise_for_status()
+        recording = {"id": response.json()["id"], "audio_file": audio_file}
+        with lock:
+            created.append(recording)
+        return recording
+
+    def session(start_offset: float, branch_count: int):
+        time.sleep(start_offset)
+        try:
+            nodes = [create(rng.choice(RECORDING_FILES))]
+            for _ in range(branch_count):
+                time.sleep(args.think_time)
+                nodes.append(create(rng.choice(RECORDING_FILES), rng.choice(nodes)))
+        except requests.RequestException as e:
+            with lock:
+                errors.append(str(e))
+
+    offsets = []
+    offset = 0.0
+    for _ in range(args.sessions):
+        offsets.append(offset)
+        offset += rng.expovariate(args.rate / 60)
+
+    replay_start = time.time()
+    threads = [
+        threading.Thread(target=session, args=(offsets[i], rng.randint(0, args.max_branches)))
+        for i in range(args.sessions)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    return {
+        "recordings": created,
+        "errors": errors,
+        "post_latency": percentiles(post_latencies),
+        "replay_seconds": time.time() - replay_start,
+    }
+
+
+def wait_for_images(services: Services, recording_ids: list[int], timeout: float) -> bool:
+    """Wait until every recording with speech has prompts and none of its images is still pending"""
+    placeholders = ",".join("?" * len(recording_ids))
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        with sqlite3.connect(services.db_path) as conn:
+            unprompted = conn.execute(
+                f"SELECT COUNT(*) FROM audio_recordings WHERE id IN ({placeholders}) AND prompts IS NULL "
+                f"AND status IS NOT 'empty'",
+                recording_ids,
+            ).fetchone()[0]
+            in_flight = conn.execute(
+                f"SELECT COUNT(*) FROM recording_image_generations "
+                f"WHERE audio_recording_id IN ({placeholders}) AND NOT speculative "
+                f"AND status NOT IN ('completed', 'failed', 'cancelled')",
+                recording_ids,
+            ).fetchone()[0]
+        if unprompted == 0 and in_flight == 0:
+            return True
+        time.sleep(1)
+    return False
+
+
+def image_results(services: Services, recording_ids: list[int]) -> dict:
+    placeholders = ",".join("?" * len(recording_ids))
+    with sqlite3.connect(services.db_path) as conn:
+        recordings = dict(
+            conn.execute(
+                f"SELECT id, created_date FROM audio_recordings WHERE id IN ({placeholders})",
+                recording_ids,
+            ).fetchall()
+        )
+        empty_count = conn.execute(
+            f"SELECT COUNT(*) FROM audio_recordings WHERE id IN ({placeholders}) AND status = 'empty'",
+            recording_ids,
+        ).fetchone()[0]
+        generations = conn.execute(
+            f"SELECT audio_recording_id, status, updated_date FROM recording_image_generations "
+            f"WHERE audio_recording_id IN ({placeholders}) AND NOT speculative",
+            recording_ids,
+        ).fetchall()
+
+    first_image: dict[int, datetime] = {}
+    completed_times = []
+    status_counts: dict[str, int] = {}
+    for recording_id, status, updated_date in generations:
+        status_counts[status] = status_counts.get(status, 0) + 1
+        if status == "completed":
+            completed_at = datetime.fromisoformat(updated_date)
+            completed_times.append(completed_at)
+            if recording_id not in first_image or completed_at < first_image[recording_id]:
+                first_image[recording_id] = completed_at
+
+    time_to_first_image = [
+        (completed_at - datetime.fromisoformat(recordings[recording_id])).total_seconds()
+        for recording_id, completed_at in first_image.items()
+    ]
+    first_created = min(datetime.fromisoformat(created) for created in recordings.values())
+    elapsed = (max(completed_times) - first_created).total_seconds() if completed_times else 0
+    return {
+        "time_to_first_image": percentiles(time_to_first_image),
+        "recordings_without_image": len(recordings) - empty_count - len(first_image),
+        "recordings_without_speech": empty_count,
+        "image_statuses": status_counts,
+        "throughput": {
+            "images_per_minute": len(completed_times) / elapsed * 60 if elapsed else 0,
+            "recordings_per_minute": len(first_image) / elapsed * 60 if elapsed else 0,
+        },
+    }
+
+
+def stage_averages(metrics_url: str) -> dict:
+    """Average seconds per processing stage from the processor's Prometheus histograms"""
+    sums, counts = {}, {}
+    for line in requests.get(metrics_url, timeout=10).text.splitlines():
+        for suffix, target in (("_sum", sums), ("_count", counts)):
+            prefix = f"branches_processing_stage_seconds{suffix}{{stage=\""
+            if line.startswith(prefix):
+                stage = line[len(prefix):].split('"', 1)[0]
+                target[stage] = float(line.rsplit(" ", 1)[1])
+    return {stage: sums[stage] / counts[stage] for stage in sums if counts.get(stage)}
+
+
+def insert_synthetic_tree(db_path: str, size: int, rng: random.Random) -> tuple[int, list[int]]:
+    """Insert a random tree straight into SQLite, returning its root id and all node ids"""
+    now = datetime.now().isoformat(sep=" ")
+    with sqlite3.connect(db_path) as conn:
+        insert = (
+            "INSERT INTO audio_recordings (audio_file_path, created_date, updated_date, "
+            "transcription, parent_audio_recording_id, parent_time, duration) VALUES (?, ?, ?, ?, ?, ?, ?)"
+        )
+        root_id = conn.execute(insert, ("synthetic.wav", now, now, "synthetic", None, None, 15.0)).lastrowid
+        ids = [root_id]
+        for _ in range(size - 1):
+            parent_id = rng.choice(ids)
+            ids.append(
+                conn.execute(
+                    insert,
+                    ("synthetic.wav", now, now, "synthetic", parent_id, rng.uniform(0, 15), 15.0),
+                ).lastrowid
+            )
+    return root_id, ids
+
+
+def tree_endpoint_latency(args, services: Services, rng: random.Random) -> dict:
+    results = {}
+    for size in args.tree_sizes:
+        root_id, _ = insert_synthetic_tree(services.db_path, size, rng)
+        latencies = []
+        for _ in range(args.tree_requests):
+            start_time = time.perf_counter()
+            response = requests.get(f"{services.data_api_url}/recordings/{root_id}/tree", timeout=120)
+            latencies.append(time.perf_counter() - start_time)
+            response.raise_for_status()
+        results[str(size)] = percentiles(latencies)
+    return results
+
+
+def sqlite_contention(args, services: Services, rng: random.Random) -> dict:
+    """Concurrent transcription writes and image generation batches mixed with tree reads"""
+    root_id, ids = insert_synthetic_tree(services.db_path, args.contention_tree_size, rng)
+    write_latencies, read_latencies, errors = [], [], []
+    lock = threading.Lock()
+
+    def write(index: int):
+        recording_id = ids[index % len(ids)]
+        start_time = time.perf_counter()
+        if index % 2:
+            response = requests.put(
+                f"{services.data_api_url}/recordings/{recording_id}/transcription",
+                json={"transcription": f"contention {index}"},
+                timeout=60,
+            )
+        else:
+            response = requests.post(
+                f"{services.data_api_url}/recordings/{recording_id}/image-generations/batch",
+                json={"generations": [{"audio_recording_id": recording_id, "prompt": "contention"}] * 4},
+                timeout=60,
+            )
+        with lock:
+            write_latencies.append(time.perf_counter() - start_time)
+            if not response.ok:
+                errors.append(response.text)
+
+    def read(_):
+        start_time = time.perf_counter()
+        response = requests.get(f"{services.data_api_url}/recordings/{root_id}/tree", timeout=60)
+        with lock:
+            read_latencies.append(time.perf_counter() - start_time)
+            if not response.ok:
+                errors.append(response.text)
+
+    with ThreadPoolExecutor(max_workers=args.contention_workers) as executor:
+        futures = [executor.submit(write, i) for i in range(args.contention_writes)]
+        futures += [executor.submit(read, i) for i in range(args.contention_writes // 4)]
+        for future in futures:
+            future.result()
+
+    return {
+        "write_latency": percentiles(write_latencies),
+        "read_latency": percentiles(read_latencies),
+        "errors": len(errors),
+        "locked_errors": sum("database is locked" in error for error in errors),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sessions", type=int, default=10, help="Number of visitor sessions to replay")
+    parser.add_argument("--rate", type=float, default=6, help="Session arrivals per minute")
+    parser.add_argument("--max-branches", type=int, default=3, help="Maximum branches per session")
+    parser.add_argument("--think-time", type=float, default=5, help="Seconds between branches of a session")
+    parser.add_argument("--ollama-latency", type=float, default=2.0)
+    parser.add_argument("--fooocus-latency", type=float, default=3.0)
+    parser.add_argument("--fooocus-failure-rate", type=float, default=0.0)
+    parser.add_argument("--seconds-per-prompt", type=int, default=5)
+    parser.add_argument("--whisper-model", default="tiny")
+    parser.add_argument("--tree-sizes", type=lambda v: [int(s) for s in v.split(",")], default=[10, 100, 1000])
+    parser.add_argument("--tree-requests", type=int, default=20, help="Tree requests per tree size")
+    parser.add_argument("--contention-tree-size", type=int, default=200)
+    parser.add_argument("--contention-writes", type=int, default=200)
+    parser.add_argument("--contention-workers", type=int, default=16)
+    parser.add_argument("--startup-timeout", type=float, default=300)
+    parser.add_argument("--timeout", type=float, default=900, help="Seconds to wait for all images")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--work-dir", help="Keep the database, images and logs here instead of a temp dir")
+    parser.add_argument("--output", default="e2e_results.json")
+    parser.add_argument("--baseline", help="Previous results file to check for regressions")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="Allowed relative slowdown")
+    args = parser.parse_args()
+
+    work_dir = args.work_dir or tempfile.mkdtemp(prefix="branches-e2e-")
+    os.makedirs(work_dir, exist_ok=True)
+    services = Services(args, work_dir)
+    rng = random.Random(args.seed)
+    try:
+        print(f"Starting services, logs in {work_dir}")
+        services.start(args.startup_timeout)
+
+        print(f"Replaying {args.sessions} sessions at {args.rate} per minute")
+        replay = replay_sessions(args, services)
+        recording_ids = [recording["id"] for recording in replay["recordings"]]
+        if not recording_ids:
+            raise RuntimeError(f"No recordings were created: {replay['errors']}")
+        finished = wait_for_images(services, recording_ids, args.timeout)
+
+        results = {
+            "finished": finished,
+            "recordings_created": len(recording_ids),
+            "session_errors": len(replay["errors"]),
+            "create_recording_latency": replay["post_latency"],
+            **image_results(services, recording_ids),
+            "stage_avg_seconds": stage_averages(f"{services.processor_url}/metrics"),
+        }
+        print("Measuring tree endpoint latency")
+        results["tree_endpoint_latency"] = tree_endpoint_latency(args, services, rng)
+        print("Measuring SQLite contention")
+        results["sqlite_contention"] = sqlite_contention(args, services, rng)
+    finally:
+        services.stop()
+
+    write_results(args.output, "e2e", vars(args), results)
+    ttfi = results["time_to_first_image"]
+    print(
+        f"Time to first image p50={ttfi.get('p50', 0):.2f}s p95={ttfi.get('p95', 0):.2f}s "
+        f"p99={ttfi.get('p99', 0):.2f}s, {results['throughput']['images_per_minute']:.1f} images/min"
+    )
+
+    if args.baseline:
+        regressions = compare_with_baseline(results, args.baseline, args.tolerance)
+        for regression in regressions:
+            print(f"Regression: {regression}")
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,137 @@
+"""
+Stand-ins for the Ollama and Fooocus APIs used by the audio processor.
+
+Both APIs are served from one app so OLLAMA_HOST and IMAGE_GENERATION_API_URL
+can point at the same port. Responses mimic the real response shapes, latency
+is configurable and Fooocus requests are serialized like on a single GPU.
+
+    python -m uvicorn stub_backends:app --port 8888
+"""
+
+import asyncio
+import json
+import os
+import random
+import re
+import uuid
+from datetime import datetime, timezone
+from fastapi import FastAPI, Request
+
+# 1x1 transparent PNG
+STUB_IMAGE_DATA_URL = (
+    "data:image/png;base64,"
+    "iVBORw0KGgoAAAANSUhEUgAAAAEAAAABCAYAAAAfFcSJAAAADElEQVR4nGNgYGAAAAAEAAH2FzhVAAAAAElFTkSuQmCC"
+)
+
+OLLAMA_LATENCY = float(os.getenv("STUB_OLLAMA_LATENCY", "2.0"))
+# Fooocus latency is per image, requests asking for several images take proportionally longer
+FOOOCUS_LATENCY = float(os.getenv("STUB_FOOOCUS_LATENCY", "3.0"))
+# Relative jitter applied to both latencies, 0.2 means +/-20%
+LATENCY_JITTER = float(os.getenv("STUB_LATENCY_JITTER", "0.2"))
+# Fraction of Fooocus requests answered with an error, to exercise retries
+FOOOCUS_FAILURE_RATE = float(os.getenv("STUB_FOOOCUS_FAILURE_RATE", "0"))
+
+app = FastAPI()
+gpu_lock = asyncio.Lock()
+stop_requested = asyncio.Event()
+# Async jobs by id, run one at a time in submission order like the Fooocus worker queue
+jobs: dict[str, dict] = {}
+job_slots = asyncio.Semaphore(1)
+
+
+def _jittered(latency: float) -> float:
+    return max(0.0, latency * random.uniform(1 - LATENCY_JITTER, 1 + LATENCY_JITTER))
+
+
+@app.post("/api/generate")
+async def ollama_generate(request: Request):
+    """Mimics a non-streaming Ollama generate call returning a JSON array of prompts"""
+    body = await request.json()
+    match = re.search(r"Generate (\d+) image prompts", body.get("prompt", ""))
+    prompt_count = int(match.group(1)) if match else 6
+    await asyncio.sleep(_jittered(OLLAMA_LATENCY))
+    prompts = [f"Stub image prompt {index}" for index in range(prompt_count)]
+    return {
+        "model": body.get("model"),
+        "created_at": datetime.now(timezone.utc).isoformat(),
+        "response": json.dumps(prompts),
+        "done": True,
+        "done_reason": "stop",
+    }
+
+
+def _image_results(image_number: int) -> list[dict]:
+    if random.random() < FOOOCUS_FAILURE_RATE:
+        return [{"base64": None, "url": None, "seed": None, "finish_reason": "ERROR"}]
+    return [
+        {
+            "base64": None,
+            "url": STUB_IMAGE_DATA_URL,
+            "seed": str(random.randint(0, 2**31)),
+            "finish_reason": "SUCCESS",
+        }
+        for _ in range(image_number)
+    ]
+
+
+async def _run_generation(image_number: int) -> list[dict]:
+    async with gpu_lock:
+        stop_requested.clear()
+        try:
+            await asyncio.wait_for(stop_requested.wait(), _jittered(FOOOCUS_LATENCY) * image_number)
+            return [{"base64": None, "url": None, "seed": None, "finish_reason": "USER_CANCEL"}]
+        except asyncio.TimeoutError:
+            pass
+    return _image_results(image_number)
+
+
+async def _run_job(job_id: str, image_number: int):
+    job = jobs[job_id]
+    async with job_slots:
+        job["job_stage"] = "RUNNING"
+        results = await _run_generation(image_number)
+    succeeded = results[0]["finish_reason"] == "SUCCESS"
+    job.update(
+        job_stage="SUCCESS" if succeeded else "ERROR",
+        job_status="Finished" if succeeded else results[0]["finish_reason"],
+        job_result=results,
+    )
+
+
+@app.get("/api/tags")
+async def ollama_tags():
+    """Mimics listing the local Ollama models, used as its readiness check"""
+    return {"models": [{"name": "stub"}]}
+
+
+@app.get("/ping")
+async def fooocus_ping():
+    """Mimics the Fooocus API liveness check"""
+    return "pong"
+
+
+@app.post("/v1/generation/text-to-image")
+async def fooocus_text_to_image(request: Request):
+    """Mimics the Fooocus API text-to-image call, queueing a job when async_process is set"""
+    body = await request.json()
+    image_number = int(body.get("image_number", 1))
+    if body.get("async_process"):
+        job_id = str(uuid.uuid4())
+        jobs[job_id] = {"job_id": job_id, "job_stage": "WAITING", "job_status": None, "job_result": None}
+        asyncio.create_task(_run_job(job_id, image_number))
+        return {"job_id": job_id, "job_type": "Text to Image", "job_stage": "WAITING"}
+    return await _run_generation(image_number)
+
+
+@app.get("/v1/generation/query-job")
+async def fooocus_query_job(job_id: str):
+    """Mimics polling an async Fooocus job"""
+    return jobs[job_id]
+
+
+@app.post("/v1/generation/stop")
+async def fooocus_stop():
+    """Mimics stopping the generation currently running on the GPU"""
+    if gpu_lock.locked():
+        stop_requested.set()
+    return {"msg": "success"}
@@ -0,0 +1,177 @@
+"""
+Micro-benchmarks of tree queries and writes in the data_store at scale.
+
+Generates synthetic trees of every requested size and shape into a throwaway
+SQLite database, then measures, pytest-benchmark style (calibrated rounds,
+min/max/mean/stddev/percentiles), the tree endpoint, raw tree and subtree
+fetches, cached and 304 tree responses, cold and cached spiral layouts and
+incremental layout updates, full-text search, image generation status scans and batch inserts, along with the peak
+Python memory of one traced round.
+
+    python tree_benchmark.py --sizes 1000,10000,100000 --output tree_results.json
+    python tree_benchmark.py --baseline tree_results.json --tolerance 0.2
+"""
+
+import argparse
+import asyncio
+import itertools
+import os
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+from starlette.requests import Request
+from benchmark_report import percentiles, write_results, compare_with_baseline
+from tree_generator import SHAPES, load_data_store, generate_tree
+
+
+def bench(fn, budget: float, min_rounds: int, max_rounds: int) -> dict:
+    """Run fn as many rounds as fit in the time budget, then one more under tracemalloc"""
+    timings = []
+    started = time.perf_counter()
+    while len(timings) < max_rounds and (
+        len(timings) < min_rounds or time.perf_counter() - started < budget
+    ):
+        start_time = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - start_time)
+
+    tracemalloc.start()
+    try:
+        fn()
+        _, peak_memory = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    return {
+        **percentiles(timings),
+        "min": min(timings),
+        "stddev": statistics.stdev(timings) if len(timings) > 1 else 0.0,
+        "peak_memory_bytes": peak_memory,
+    }
+
+
+def run_benchmarks(args, data_model, data_api, data_api_models, shape: str, size: int) -> dict:
+    AudioRecording = data_model.AudioRecording
+    RecordingImageGeneration = data_model.RecordingImageGeneration
+
+    start_time = time.perf_counter()
+    tree = generate_tree(data_model, size, shape, args.images_per_node, seed=args.seed)
+    results = {
+        "generation_seconds": time.perf_counter() - start_time,
+        "node_count": tree.node_count,
+        "depth": tree.depth,
+    }
+    subtree_root_id = tree.ids_by_depth[len(tree.ids_by_depth) // 2][0]
+    batch = data_api_models.BatchImageGenerationCreate(
+        generations=[
+            data_api_models.ImageGenerationCreate(audio_recording_id=tree.root_id, prompt=f"Benchmark prompt {i}")
+            for i in range(args.batch_size)
+        ]
+    )
+
+    def tree_request(etag: str = None) -> Request:
+        headers = [(b"if-none-match", etag.encode())] if etag else []
+        return Request({"type": "http", "method": "GET", "path": "/", "headers": headers})
+
+    def tree_endpoint(cached: bool = False, etag: str = None):
+        if not cached:
+            data_api.tree_cache.clear()
+        return asyncio.run(data_api.get_recording_tree(tree.root_id, tree_request(etag)))
+
+    def layout_endpoint(cached: bool = False):
+        if not cached:
+            data_api.layout_cache.clear()
+        return asyncio.run(data_api.get_recording_layout(tree.root_id, tree_request()))
+
+    def layout_add_child():
+        # Ids far past the tree's, the layout is only updated in memory
+        data_api.layout_cache.get(tree.root_id)
+        data_api.layout_cache.add_child(next(new_layout_ids), subtree_root_id, 1.0)
+
+    try:
+        cached_etag = tree_endpoint().headers["ETag"]
+    except Exception:
+        cached_etag = None  # Too deep for get_tree, the tree cases record the error
+    new_layout_ids = itertools.count(10**9)
+    cases = {
+        "tree_endpoint": tree_endpoint,
+        "tree_endpoint_cached": lambda: tree_endpoint(cached=True),
+        "tree_endpoint_not_modified": lambda: tree_endpoint(cached=True, etag=cached_etag),
+        "layout_endpoint": layout_endpoint,
+        "layout_endpoint_cached": lambda: layout_endpoint(cached=True),
+        "layout_add_child": layout_add_child,
+        "tree_fetch": lambda: AudioRecording.get_by_id(tree.root_id).get_tree(),
+        "subtree_fetch": lambda: AudioRecording.get_by_id(subtree_root_id).get_tree(),
+        "search": lambda: asyncio.run(data_api.search_recordings("grandmother river")),
+        "search_in_tree": lambda: asyncio.run(data_api.search_recordings("grandmother river", subtree_root_id)),
+        "status_scan": lambda: list(
+            RecordingImageGeneration.select().where(
+                RecordingImageGeneration.status.in_(["pending", "generating"])
+            )
+        ),
+        "batch_insert": lambda: asyncio.run(data_api.create_image_generations_batch(tree.root_id, batch)),
+    }
+    for name, fn in cases.items():
+        if args.only and name not in args.only:
+            continue
+        try:
+            results[name] = bench(fn, args.budget, args.min_rounds, args.max_rounds)
+        except Exception as e:
+            # The recursive get_tree cannot handle very deep trees, record that rather than abort
+            results[name] = {"error": f"{type(e).__name__}: {e}"}
+        print(f"  {shape}/{size} {name}: {_describe(results[name])}")
+    return results
+
+
+def _describe(result: dict) -> str:
+    if "error" in result:
+        return result["error"]
+    return (
+        f"p50={result['p50'] * 1000:.2f}ms max={result['max'] * 1000:.2f}ms "
+        f"rounds={result['count']} peak={result['peak_memory_bytes'] / 2**20:.1f}MiB"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=lambda v: [int(s) for s in v.split(",")], default=[1000, 10000, 100000])
+    parser.add_argument("--shapes", type=lambda v: v.split(","), default=list(SHAPES))
+    parser.add_argument("--only", type=lambda v: v.split(","), help="Comma separated benchmark names to run")
+    parser.add_argument("--images-per-node", type=int, default=3)
+    parser.add_argument("--batch-size", type=int, default=10, help="Image generations per batch insert")
+    parser.add_argument("--budget", type=float, default=5, help="Seconds of rounds per benchmark")
+    parser.add_argument("--min-rounds", type=int, default=1)
+    parser.add_argument("--max-rounds", type=int, default=50)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--db", help="Database file to use instead of a temporary one")
+    parser.add_argument("--output", default="tree_results.json")
+    parser.add_argument("--baseline", help="Previous results file to check for regressions")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="Allowed relative slowdown")
+    args = parser.parse_args()
+
+    db_path = args.db or os.path.join(tempfile.mkdtemp(prefix="branches-tree-"), "benchmark.db")
+    data_model = load_data_store(db_path)
+    import data_api
+    import data_api_models
+
+    results = {}
+    for shape in args.shapes:
+        for size in args.sizes:
+            print(f"Benchmarking {shape} tree of {size} recordings")
+            results[f"{shape}/{size}"] = run_benchmarks(args, data_model, data_api, data_api_models, shape, size)
+    results["database_bytes"] = os.path.getsize(db_path)
+
+    write_results(args.output, "tree", vars(args), results)
+
+    if args.baseline:
+        regressions = compare_with_baseline(results, args.baseline, args.tolerance)
+        for regression in regressions:
+            print(f"Regression: {regression}")
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,168 @@
+"""
+Synthetic conversation tree generator for the data_store SQLite database.
+
+Fills the database through the data_store models with trees of a given size
+and shape, plus image generation rows per recording.
+
+    python tree_generator.py --db synthetic.db --nodes 10000 --shape balanced --images-per-node 3
+"""
+
+import argparse
+import datetime
+import os
+import random
+import sys
+from collections import deque
+from dataclasses import dataclass, field
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DATA_STORE_PATH = os.path.join(REPO_ROOT, "data_store")
+
+# Children per recording, and whether every child or only the newest one branches further.
+# "deep" models visitors mostly continuing the latest branch, giving a depth of about nodes / 2.
+SHAPES = {
+    "wide": {"fanout": 100, "expand": "all"},
+    "balanced": {"fanout": 4, "expand": "all"},
+    "deep": {"fanout": 2, "expand": "last"},
+}
+STATUS_WEIGHTS = {"completed": 0.8, "failed": 0.05, "pending": 0.1, "generating": 0.05}
+INSERT_CHUNK_SIZE = 500
+# Transcriptions are drawn from this vocabulary so full-text search has realistic match rates
+WORDS = (
+    "tree river grandmother summer winter house garden forest light night city mountain road "
+    "sea boat bird dog mother father child school music dance rain snow fire stone bridge "
+    "window door kitchen bread apple letter train station island dream story voice song"
+).split()
+TRANSCRIPTION_WORDS = 40
+
+
+@dataclass
+class GeneratedTree:
+    root_id: int
+    node_count: int
+    depth: int
+    image_generation_count: int
+    # Node ids by depth, to pick subtree roots at a given level
+    ids_by_depth: list[list[int]] = field(default_factory=list)
+
+
+def load_data_store(db_path: str):
+    """Import data_model against the given database file, creating the tables if needed"""
+    os.environ["DB_PATH"] = db_path
+    if DATA_STORE_PATH not in sys.path:
+        sys.path.insert(0, DATA_STORE_PATH)
+    import data_model
+
+    data_model.db.connect(reuse_if_open=True)
+    data_model.ensure_schema()
+    return data_model
+
+
+def generate_tree(
+    data_model,
+    node_count: int,
+    shape: str = "balanced",
+    images_per_node: int = 3,
+    max_depth: int = None,
+    seed: int = 0,
+) -> GeneratedTree:
+    """Insert one tree of up to node_count recordings, breadth first, with explicit ids"""
+    AudioRecording = data_model.AudioRecording
+    RecordingImageGeneration = data_model.RecordingImageGeneration
+    fanout = SHAPES[shape]["fanout"]
+    expand_all = SHAPES[shape]["expand"] == "all"
+    rng = random.Random(seed)
+    now = datetime.datetime.now()
+
+    next_id = (AudioRecording.select(AudioRecording.id).order_by(AudioRecording.id.desc()).scalar() or 0) + 1
+    root_id = next_id
+    rows = [_recording_row(root_id, None, 0, now, rng)]
+    ids_by_depth = [[root_id]]
+    frontier = deque([(root_id, 0)])
+    next_id += 1
+
+    while frontier and len(rows) < node_count:
+        parent_id, depth = frontier.popleft()
+        if max_depth is not None and depth >= max_depth:
+            continue
+        children = []
+        for _ in range(min(fanout, node_count - len(rows))):
+            rows.append(_recording_row(next_id, parent_id, rng.uniform(0, 15), now, rng))
+            children.append(next_id)
+            next_id += 1
+        if len(ids_by_depth) <= depth + 1:
+            ids_by_depth.append([])
+        ids_by_depth[depth + 1].extend(children)
+        for child_id in children if expand_all else children[-1:]:
+            frontier.append((child_id, depth + 1))
+
+    statuses = list(STATUS_WEIGHTS)
+    weights = list(STATUS_WEIGHTS.values())
+    image_rows = [
+        {
+            "audio_recording_id": row["id"],
+            "created_date": now,
+            "updated_date": now,
+            "prompt": f"Synthetic prompt {index}",
+            "status": status,
+            "image_file_path": f"{row['id']}_{index}.png" if status == "completed" else None,
+        }
+        for row in rows
+        for index, status in enumerate(rng.choices(statuses, weights, k=images_per_node))
+    ]
+
+    with data_model.db.atomic():
+        for start in range(0, len(rows), INSERT_CHUNK_SIZE):
+            AudioRecording.insert_many(rows[start:start + INSERT_CHUNK_SIZE]).execute()
+        for start in range(0, len(image_rows), INSERT_CHUNK_SIZE):
+            RecordingImageGeneration.insert_many(image_rows[start:start + INSERT_CHUNK_SIZE]).execute()
+
+    return GeneratedTree(
+        root_id=root_id,
+        node_count=len(rows),
+        depth=len(ids_by_depth) - 1,
+        image_generation_count=len(image_rows),
+        ids_by_depth=ids_by_depth,
+    )
+
+
+def _recording_row(
+    recording_id: int, parent_id: int, parent_time: float, now: datetime.datetime, rng: random.Random
+) -> dict:
+    return {
+        "id": recording_id,
+        "audio_file_path": "synthetic.wav",
+        "created_date": now,
+        "updated_date": now,
+        "transcription": " ".join(rng.choices(WORDS, k=TRANSCRIPTION_WORDS)),
+        "prompts": ["Synthetic prompt 0", "Synthetic prompt 1", "Synthetic prompt 2"],
+        "parent_audio_recording": parent_id,
+        "parent_time": parent_time if parent_id else None,
+        "duration": 15.0,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--db", required=True, help="SQLite database file to fill")
+    parser.add_argument("--nodes", type=int, default=1000)
+    parser.add_argument("--shape", choices=SHAPES, default="balanced")
+    parser.add_argument("--images-per-node", type=int, default=3)
+    parser.add_argument("--max-depth", type=int)
+    parser.add_argument("--trees", type=int, default=1)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    data_model = load_data_store(args.db)
+    for index in range(args.trees):
+        tree = generate_tree(
+            data_model, args.nodes, args.shape, args.images_per_node, args.max_depth, args.seed + index
+        )
+        print(
+            f"Created tree {tree.root_id} with {tree.node_count} recordings, depth {tree.depth}, "
+            f"{tree.image_generation_count} image generations"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,421 @@
+"""
+Compaction of the data store for installations running for weeks.
+
+Re-encodes old generated images to WebP or AVIF, deletes failed and abandoned image
+generation rows and finished jobs, packs the images and audio of trees nobody touched
+for a while into one zip per tree with an index, deletes files no row references and
+optimizes the SQLite database. The data API unpacks an archived tree again as soon as
+its tree, layout or audio is requested.
+
+    python compaction.py --image-age-days 7 --cold-tree-days 30
+    python compaction.py --tasks purge_orphans --dry-run
+    python compaction.py --restore 42
+"""
+
+import argparse
+import datetime
+import json
+import logging
+import os
+import subprocess
+import threading
+import time
+import zipfile
+from dataclasses import asdict, dataclass, field
+from peewee import fn
+from playhouse.shortcuts import model_to_dict
+from data_model import (
+    db,
+    AudioRecording,
+    RecordingImageGeneration,
+    ProcessingJob,
+    TreeArchive,
+    RecordingSearch,
+)
+from data_api_audio import AUDIO_STORAGE_PATH, FFMPEG_PATH
+from data_api_metrics import COMPACTION_ITEMS, COMPACTION_LATENCY
+
+logger = logging.getLogger(__name__)
+
+IMAGE_GENERATIONS_PATH = os.getenv("IMAGE_GENERATIONS_PATH", "images")
+ARCHIVE_PATH = os.getenv("ARCHIVE_PATH", "archive")
+
+TASKS = ["reencode_images", "purge_stale_rows", "archive_cold_trees", "purge_orphans", "optimize_database"]
+IMAGE_FORMATS = {
+    "webp": ["-c:v", "libwebp", "-quality", "90"],
+    "avif": ["-c:v", "libaom-av1", "-still-picture", "1", "-crf", "28"],
+}
+# Audio storage may be shared with the recorder, only files the data API wrote are purged
+DATA_API_AUDIO_PREFIXES = ("recording-", "upload-")
+
+
+@dataclass
+class CompactionOptions:
+    image_age_days: float = 7  # Re-encode completed images older than this
+    image_format: str = "webp"
+    stale_row_days: float = 2  # Delete failed rows, abandoned pending rows and finished jobs older than this
+    cold_tree_days: float = 30  # Archive trees with no recording or image change for this long
+    orphan_grace_hours: float = 1  # Leave unreferenced files this young, they may belong to running work
+    tasks: list[str] = field(default_factory=lambda: list(TASKS))
+    dry_run: bool = False
+
+
+def run_compaction(options: CompactionOptions) -> dict:
+    """Run the selected tasks in order, a failing task is reported without stopping the others"""
+    start_time = time.perf_counter()
+    report = {"started": datetime.datetime.now().isoformat(), "options": asdict(options), "tasks": {}}
+    for task in TASKS:
+        if task not in options.tasks:
+            continue
+        logger.info(f"Compaction task {task}{' (dry run)' if options.dry_run else ''}")
+        try:
+            result = TASK_FUNCTIONS[task](options)
+            if not options.dry_run:
+                COMPACTION_ITEMS.labels(task=task).inc(result["count"])
+        except Exception as e:
+            logger.error(f"Compaction task {task} failed: {str(e)}", exc_info=True)
+            result = {"error": str(e)}
+        report["tasks"][task] = result
+    report["duration"] = time.perf_counter() - start_time
+    COMPACTION_LATENCY.observe(report["duration"])
+    return report
+
+
+def days_ago(days: float) -> datetime.datetime:
+    return datetime.datetime.now() - datetime.timedelta(days=days)
+
+
+def encode_image(source_path: str, destination_path: str, image_format: str):
+    result = subprocess.run(
+        [FFMPEG_PATH, "-nostdin", "-y", "-v", "error", "-i", source_path,
+         *IMAGE_FORMATS[image_format], "-frames:v", "1", destination_path],
+        capture_output=True,
+        text=True,
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"Encoding {source_path} to {image_format} failed: {result.stderr.strip()}")
+
+
+def reencode_images(options: CompactionOptions) -> dict:
+    """Re-encode completed PNGs older than image_age_days, pointing their rows at the new files"""
+    extension = f".{options.image_format}"
+    query = RecordingImageGeneration.select().where(
+        (RecordingImageGeneration.status == "completed")
+        & RecordingImageGeneration.image_file_path.endswith(".png")
+        & (RecordingImageGeneration.updated_date < days_ago(options.image_age_days))
+    )
+    count = saved_bytes = 0
+    for image_generation in query.iterator():
+        source_path = os.path.join(IMAGE_GENERATIONS_PATH, image_generation.image_file_path)
+        if not os.path.isfile(source_path):
+            continue  # Archived or lost, nothing to re-encode
+        count += 1
+        if options.dry_run:
+            continue
+        file_name = os.path.splitext(image_generation.image_file_path)[0] + extension
+        destination_path = os.path.join(IMAGE_GENERATIONS_PATH, file_name)
+        encode_image(source_path, destination_path, options.image_format)
+        saved_bytes += os.path.getsize(source_path) - os.path.getsize(destination_path)
+        # Not saved through the model, re-encoding should not count as touching the tree
+        RecordingImageGeneration.update(image_file_path=file_name).where(
+            RecordingImageGeneration.id == image_generation.id
+        ).execute()
+        os.remove(source_path)
+    return {"count": count, "saved_bytes": saved_bytes}
+
+
+def purge_stale_rows(options: CompactionOptions) -> dict:
+    """Delete old failed and cancelled image generations, pending ones nobody will render, and finished jobs"""
+    cutoff = days_ago(options.stale_row_days)
+    active_jobs = ProcessingJob.select(ProcessingJob.image_generation).where(
+        ProcessingJob.status.in_(["queued", "leased"]) & ProcessingJob.image_generation.is_null(False)
+    )
+    stale_ids = [
+        image_generation_id
+        for (image_generation_id,) in RecordingImageGeneration.select(RecordingImageGeneration.id)
+        .where(
+            RecordingImageGeneration.status.in_(["failed", "cancelled", "pending", "generating"])
+            & (RecordingImageGeneration.updated_date < cutoff)
+            & RecordingImageGeneration.id.not_in(active_jobs)
+        )
+        .tuples()
+    ]
+    finished_jobs = ProcessingJob.select(ProcessingJob.id).where(
+        ProcessingJob.status.in_(["completed", "failed", "cancelled"]) & (ProcessingJob.updated_date < cutoff)
+    )
+    if options.dry_run:
+        return {"count": len(stale_ids), "image_generations": len(stale_ids), "jobs": finished_jobs.count()}
+
+    deleted_jobs = ProcessingJob.delete().where(ProcessingJob.id.in_(finished_jobs)).execute()
+    deleted_generations = 0
+    with db.atomic():
+        # Stay below SQLite's limit of bound parameters per statement
+        for start in range(0, len(stale_ids), 500):
+            chunk = stale_ids[start:start + 500]
+            ProcessingJob.delete().where(ProcessingJob.image_generation.in_(chunk)).execute()
+            deleted_generations += (
+                RecordingImageGeneration.delete().where(RecordingImageGeneration.id.in_(chunk)).execute()
+            )
+    return {"count": deleted_generations, "image_generations": deleted_generations, "jobs": deleted_jobs}
+
+
+def get_tree_files(recordings: list[AudioRecording], image_generations: list[RecordingImageGeneration]):
+    """(name in the pack, path on disk) of every file of a tree that is still on disk"""
+    files = [
+        (f"images/{image_generation.image_file_path}", os.path.join(IMAGE_GENERATIONS_PATH, image_generation.image_file_path))
+        for image_generation in image_generations
+        if image_generation.image_file_path
+    ]
+    for recording in recordings:
+        for file_name in (recording.audio_file_path, recording.playback_file_path):
+            # Audio storage may be shared with the recorder, whose files stay where it wrote them
+            if file_name and os.path.basename(file_name).startswith(DATA_API_AUDIO_PREFIXES):
+                files.append((f"audio/{file_name}", os.path.join(AUDIO_STORAGE_PATH, file_name)))
+    return [(name, path) for name, path in files if os.path.isfile(path)]
+
+
+def archive_cold_trees(options: CompactionOptions) -> dict:
+    """Pack the files of trees untouched for cold_tree_days into one zip per tree, with an index of its rows"""
+    cutoff = days_ago(options.cold_tree_days)
+    archived_roots = TreeArchive.select(TreeArchive.root_audio_recording)
+    roots = AudioRecording.select(AudioRecording.id).where(
+        AudioRecording.parent_audio_recording.is_null() & AudioRecording.id.not_in(archived_roots)
+    )
+    count = file_count = archived_bytes = 0
+    for root in roots:
+        subtree = AudioRecording.subtree_ids(root.id)
+        generations_query = RecordingImageGeneration.select().where(
+            RecordingImageGeneration.audio_recording_id.in_(subtree)
+        )
+        last_recording_change = (
+            AudioRecording.select(fn.MAX(AudioRecording.updated_date))
+            .where(AudioRecording.id.in_(subtree))
+            .scalar()
+        )
+        last_image_change = generations_query.select(fn.MAX(RecordingImageGeneration.updated_date)).scalar()
+        if max(filter(None, (last_recording_change, last_image_change))) >= cutoff:
+            continue
+        if generations_query.where(RecordingImageGeneration.status.in_(["pending", "generating"])).exists():
+            continue  # Work still queued for it, leave it alone
+
+        recordings = list(AudioRecording.select().where(AudioRecording.id.in_(subtree)))
+        image_generations = list(generations_query)
+        files = get_tree_files(recordings, image_generations)
+        if not files:
+            continue
+        count += 1
+        file_count += len(files)
+        archived_bytes += sum(os.path.getsize(path) for _, path in files)
+        if options.dry_run:
+            continue
+        pack_tree(root.id, recordings, image_generations, files)
+    return {"count": count, "files": file_count, "bytes": archived_bytes}
+
+
+def pack_tree(root_id: int, recordings, image_generations, files):
+    os.makedirs(ARCHIVE_PATH, exist_ok=True)
+    file_name = f"tree-{root_id}.zip"
+    archive_path = os.path.join(ARCHIVE_PATH, file_name)
+    index = {
+        "root_id": root_id,
+        "created_date": datetime.datetime.now().isoformat(),
+        "recordings": [model_to_dict(recording, recurse=False) for recording in recordings],
+        "image_generations": [model_to_dict(image_generation, recurse=False) for image_generation in image_generations],
+        "files": [name for name, _ in files],
+    }
+    # Images and FLAC are compressed already, storing them keeps packing and restoring cheap
+    with zipfile.ZipFile(archive_path + ".tmp", "w", compression=zipfile.ZIP_STORED) as pack:
+        for name, path in files:
+            pack.write(path, name)
+        pack.writestr("index.json", json.dumps(index, default=str), compress_type=zipfile.ZIP_DEFLATED)
+    os.replace(archive_path + ".tmp", archive_path)
+
+    TreeArchive.create(
+        root_audio_recording=root_id,
+        archive_file_path=file_name,
+        file_count=len(files),
+        size=os.path.getsize(archive_path),
+    )
+    for _, path in files:
+        os.remove(path)
+    logger.info(f"Archived {len(files)} files of tree {root_id} to {archive_path}")
+
+
+def restore_tree(root_id: int) -> int:
+    """Unpack an archived tree's files back into place and forget the archive"""
+    tree_archive = TreeArchive.get(TreeArchive.root_audio_recording == root_id)
+    archive_path = os.path.join(ARCHIVE_PATH, tree_archive.archive_file_path)
+    destinations = {"images": IMAGE_GENERATIONS_PATH, "audio": AUDIO_STORAGE_PATH}
+    restored = 0
+    with zipfile.ZipFile(archive_path) as pack:
+        for name in pack.namelist():
+            kind, _, file_name = name.partition("/")
+            if kind not in destinations:
+                continue
+            with pack.open(name) as source, open(
+                os.path.join(destinations[kind], os.path.basename(file_name)), "wb"
+            ) as destination:
+                while chunk := source.read(2**20):
+                    destination.write(chunk)
+            restored += 1
+    tree_archive.delete_instance()
+    os.remove(archive_path)
+    return restored
+
+
+restore_lock = threading.Lock()
+
+
+def restore_archived_tree(recording_id: int) -> bool:
+    """Restore the archive of the tree a recording belongs to, if it was archived, so its files can be served"""
+    if not TreeArchive.select().exists():
+        return False  # Spares the walk up to the root while nothing is archived
+    root_id = AudioRecording.root_id(recording_id)
+    # Concurrent requests for the same cold tree restore it once
+    with restore_lock:
+        if root_id is None or not TreeArchive.select().where(TreeArchive.root_audio_recording == root_id).exists():
+            return False
+        logger.info(f"Restoring archived tree {root_id} on access to recording {recording_id}")
+        restore_tree(root_id)
+    return True
+
+
+def purge_orphans(options: CompactionOptions) -> dict:
+    """Delete images, uploads and packs no row references, unless modified within orphan_grace_hours"""
+    cutoff = time.time() - options.orphan_grace_hours * 3600
+    referenced_images = {
+        file_name
+        for (file_name,) in RecordingImageGeneration.select(RecordingImageGeneration.image_file_path)
+        .where(RecordingImageGeneration.image_file_path.is_null(False))
+        .tuples()
+    }
+    referenced_audio = set()
+    for audio_file_path, playback_file_path in AudioRecording.select(
+        AudioRecording.audio_file_path, AudioRecording.playback_file_path
+    ).tuples():
+        referenced_audio.update((audio_file_path, playback_file_path))
+    referenced_archives = {file_name for (file_name,) in TreeArchive.select(TreeArchive.archive_file_path).tuples()}
+
+    orphans = []
+    for directory, is_orphan in (
+        (IMAGE_GENERATIONS_PATH, lambda name: name not in referenced_images),
+        (
+            AUDIO_STORAGE_PATH,
+            lambda name: name.startswith(DATA_API_AUDIO_PREFIXES) and name not in referenced_audio,
+        ),
+        (ARCHIVE_PATH, lambda name: name not in referenced_archives),
+    ):
+        if not os.path.isdir(directory):
+            continue
+        with os.scandir(directory) as entries:
+            orphans += [
+                entry
+                for entry in entries
+                if entry.is_file() and is_orphan(entry.name) and entry.stat().st_mtime < cutoff
+            ]
+
+    purged_bytes = sum(entry.stat().st_size for entry in orphans)
+    if not options.dry_run:
+        for entry in orphans:
+            os.remove(entry.path)
+    return {"count": len(orphans), "bytes": purged_bytes}
+
+
+def optimize_database(options: CompactionOptions) -> dict:
+    """Merge the search index segments, refresh the query planner statistics and VACUUM"""
+    size_before = os.path.getsize(db.database)
+    if options.dry_run:
+        return {"count": 0, "size_before": size_before}
+    RecordingSearch.optimize()
+    db.execute_sql("ANALYZE")
+    db.execute_sql("VACUUM")
+    return {"count": 1, "size_before": size_before, "size_after": os.path.getsize(db.database)}
+
+
+TASK_FUNCTIONS = {
+    "reencode_images": reencode_images,
+    "purge_stale_rows": purge_stale_rows,
+    "archive_cold_trees": archive_cold_trees,
+    "purge_orphans": purge_orphans,
+    "optimize_database": optimize_database,
+}
+
+
+class CompactionRunner:
+    """Runs compaction on a background thread, one run at a time, optionally on a schedule"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.thread: threading.Thread = None
+        self.scheduler: threading.Thread = None
+        self.stopping = threading.Event()
+        self.last_report: dict = None
+
+    @property
+    def running(self) -> bool:
+        return self.thread is not None and self.thread.is_alive()
+
+    def start(self, options: CompactionOptions) -> bool:
+        """Start a run, False if one is still going"""
+        with self.lock:
+            if self.running:
+                return False
+            self.thread = threading.Thread(target=self._run, args=(options,), name="compaction", daemon=True)
+            self.thread.start()
+            return True
+
+    def start_schedule(self, interval_hours: float):
+        self.stopping.clear()
+        self.scheduler = threading.Thread(
+            target=self._schedule, args=(interval_hours,), name="compaction-schedule", daemon=True
+        )
+        self.scheduler.start()
+
+    def stop(self):
+        self.stopping.set()
+        if self.scheduler is not None:
+            self.scheduler.join()
+
+    def _schedule(self, interval_hours: float):
+        while not self.stopping.wait(interval_hours * 3600):
+            if not self.start(CompactionOptions()):
+                logger.info("Skipping scheduled compaction, the previous run is still going")
+
+    def _run(self, options: CompactionOptions):
+        # The worker thread opens its own connection and closes it when done
+        with db.connection_context():
+            self.last_report = run_compaction(options)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    defaults = CompactionOptions()
+    parser.add_argument("--tasks", type=lambda v: v.split(","), default=defaults.tasks, help=f"Comma separated, of {', '.join(TASKS)}")
+    parser.add_argument("--image-age-days", type=float, default=defaults.image_age_days)
+    parser.add_argument("--image-format", choices=IMAGE_FORMATS, default=defaults.image_format)
+    parser.add_argument("--stale-row-days", type=float, default=defaults.stale_row_days)
+    parser.add_argument("--cold-tree-days", type=float, default=defaults.cold_tree_days)
+    parser.add_argument("--orphan-grace-hours", type=float, default=defaults.orphan_grace_hours)
+    parser.add_argument("--dry-run", action="store_true", help="Report what would be done without changing anything")
+    parser.add_argument("--restore", type=int, metavar="ROOT_ID", help="Unpack an archived tree instead of compacting")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+    db.connect(reuse_if_open=True)
+    if args.restore is not None:
+        print(f"Restored {restore_tree(args.restore)} files of tree {args.restore}")
+        return
+    options = CompactionOptions(
+        image_age_days=args.image_age_days,
+        image_format=args.image_format,
+        stale_row_days=args.stale_row_days,
+        cold_tree_days=args.cold_tree_days,
+        orphan_grace_hours=args.orphan_grace_hours,
+        tasks=args.tasks,
+        dry_run=args.dry_run,
+    )
+    print(json.dumps(run_compaction(options), indent=4))
+
+
+if __name__ == "__main__":
+    main()
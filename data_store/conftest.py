@@ -0,0 +1,29 @@
+import os
+import sys
+import tempfile
+import pytest
+
+# data_model opens DB_PATH when imported, so the tests get a database of their own
+os.environ["DB_PATH"] = os.path.join(tempfile.mkdtemp(), "test.db")
+sys.path.insert(0, os.path.dirname(__file__))
+
+
+@pytest.fixture
+def client(monkeypatch):
+    """
+    A client of the data API over an empty database and empty caches, queueing jobs for new
+    recordings as in pull mode instead of posting them to a processor
+    """
+    from fastapi.testclient import TestClient
+    import data_api
+    from data_api import app, tree_cache, layout_cache
+    from data_model import AudioRecording, RecordingImageGeneration, ProcessingJob, TreeArchive
+
+    monkeypatch.setattr(data_api, "PROCESSING_MODE", "pull")
+
+    with TestClient(app) as client:
+        for model in (ProcessingJob, RecordingImageGeneration, TreeArchive, AudioRecording):
+            model.delete().execute()
+        tree_cache.clear()
+        layout_cache.clear()
+        yield client
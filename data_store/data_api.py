@@ -1,28 +1,87 @@
 import os
+import json
+import time
+import uuid
+import datetime
 import requests
 from contextlib import asynccontextmanager
-from fastapi import FastAPI, HTTPException
-from data_model import db, AudioRecording, RecordingImageGeneration
+from fastapi import FastAPI, Header, HTTPException, Request, Response
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import FileResponse
+from starlette.concurrency import run_in_threadpool
+from prometheus_client import generate_latest, CONTENT_TYPE_LATEST
+from opentelemetry import trace
+from data_model import (
+    db,
+    AudioRecording,
+    RecordingImageGeneration,
+    ProcessingJob,
+    RecordingSearch,
+    ensure_schema,
+)
+from peewee import fn, JOIN
 from playhouse.shortcuts import model_to_dict
 import logging
 from data_api_models import (
     AudioRecordingCreate,
     TranscriptionUpdate,
+    VoiceActivityUpdate,
     PromptsUpdate,
     ImageGenerationCreate,
     ImageGenerationUpdate,
     BatchImageGenerationCreate,
+    JobClaim,
+    JobHeartbeat,
+    JobComplete,
+    JobFail,
+    CompactionRequest,
+)
+from data_api_metrics import (
+    REQUEST_LATENCY,
+    PROCESSOR_REQUEST_LATENCY,
+    PROCESSOR_REQUEST_FAILURES,
+    TIME_TO_FIRST_IMAGE,
+    PROCESSING_JOBS_QUEUED,
+    PROCESSING_JOB_OUTCOMES,
+    TREE_CACHE_REQUESTS,
+    LAYOUT_REQUESTS,
+)
+from data_api_cache import TreeCache, etag_matches
+from data_api_layout import LayoutCache, NODE_FIELDS, BRANCH_SAMPLES
+from compaction import CompactionRunner, CompactionOptions, restore_archived_tree
+from data_api_audio import (
+    AUDIO_STORAGE_PATH,
+    receive_upload,
+    store_upload,
+    resolve_audio_path,
+    get_media_type,
+)
+from data_api_tracing import (
+    tracer,
+    configure_tracing,
+    inject_trace_headers,
+    extract_trace_context,
 )
 
 logger = logging.getLogger(__name__)
 
+configure_tracing("branches-data-api")
+
+COMPACTION_INTERVAL_HOURS = float(os.getenv("COMPACTION_INTERVAL_HOURS", "0"))  # 0 only compacts on request
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN")  # Required in X-Admin-Token by the admin routes, which are disabled without it
+compaction_runner = CompactionRunner()
+
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     """Handle startup/shutdown events"""
     if db.is_closed():
         db.connect()
+    ensure_schema()
+    if COMPACTION_INTERVAL_HOURS > 0:
+        compaction_runner.start_schedule(COMPACTION_INTERVAL_HOURS)
     yield
+    compaction_runner.stop()
     if not db.is_closed():
         db.close()
 
@@ -30,51 +89,218 @@ async def lifespan(app: FastAPI):
 app = FastAPI(lifespan=lifespan)
 
 
+@app.middleware("http")
+async def observe_request_latency(request: Request, call_next):
+    """Record request latency labelled by the matched route template"""
+    start_time = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        route = request.scope.get("route")
+        REQUEST_LATENCY.labels(
+            method=request.method,
+            route=route.path if route else "unmatched",
+            status=str(status),
+        ).observe(time.perf_counter() - start_time)
+
+
+@app.middleware("http")
+async def trace_requests(request: Request, call_next):
+    """Continue the caller's trace, or start one, and return its id for log correlation"""
+    with tracer.start_as_current_span(
+        f"{request.method} {request.url.path}",
+        context=extract_trace_context(dict(request.headers)),
+        kind=trace.SpanKind.SERVER,
+    ) as span:
+        response = await call_next(request)
+        route = request.scope.get("route")
+        if route:
+            span.update_name(f"{request.method} {route.path}")
+        span.set_attribute("http.status_code", response.status_code)
+        response.headers["X-Trace-Id"] = trace.format_trace_id(
+            span.get_span_context().trace_id
+        )
+        return response
+
+
+@app.get("/metrics")
+async def metrics():
+    """Prometheus metrics for the data API"""
+    return Response(content=generate_latest(), media_type=CONTENT_TYPE_LATEST)
+
+
 AUDIO_PROCESSOR_URL = os.getenv("AUDIO_PROCESSOR_URL", "http://localhost:8001")
+# "push" hands every recording to AUDIO_PROCESSOR_URL, "pull" queues jobs for workers to claim
+PROCESSING_MODE = os.getenv("PROCESSING_MODE", "push")
+MAX_JOB_ATTEMPTS = int(os.getenv("MAX_JOB_ATTEMPTS", "3"))  # Claims per job before it is failed
+TREE_CACHE_MAX_BYTES = int(os.getenv("TREE_CACHE_MAX_BYTES", str(64 * 2**20)))  # Memory budget of cached trees
+tree_cache = TreeCache(TREE_CACHE_MAX_BYTES)
+LAYOUT_CACHE_MAX_BYTES = int(os.getenv("LAYOUT_CACHE_MAX_BYTES", str(64 * 2**20)))  # Memory budget of cached layouts
+layout_cache = LayoutCache(LAYOUT_CACHE_MAX_BYTES)
+# Job kinds a worker may claim for each capability it advertises
+CAPABILITY_JOB_KINDS = {"whisper": "transcribe", "llm": "prompts", "image": "image"}
+# Workers seen claiming or heartbeating, by id
+workers: dict[str, dict] = {}
+
+for job_kind in CAPABILITY_JOB_KINDS.values():
+    PROCESSING_JOBS_QUEUED.labels(kind=job_kind).set_function(
+        lambda job_kind=job_kind: ProcessingJob.select()
+        .where((ProcessingJob.kind == job_kind) & (ProcessingJob.status == "queued"))
+        .count()
+    )
 
 
 async def init_audio_processing(recording_id: int, audio_file_path: str):
     """Initiates audio processing by making request to processing service"""
     try:
-        response = requests.post(
-            f"{AUDIO_PROCESSOR_URL}/process-audio/",
-            json={"recording_id": str(recording_id), "source_file": audio_file_path},
-        )
+        with PROCESSOR_REQUEST_LATENCY.time(), tracer.start_as_current_span(
+            "init_audio_processing", attributes={"recording.id": recording_id}
+        ):
+            response = requests.post(
+                f"{AUDIO_PROCESSOR_URL}/process-audio/",
+                json={"recording_id": str(recording_id), "source_file": audio_file_path},
+                headers=inject_trace_headers(),
+            )
         response.raise_for_status()
         return response.json()
     except requests.RequestException as e:
+        PROCESSOR_REQUEST_FAILURES.inc()
         raise HTTPException(
             status_code=500, detail=f"Failed to initiate audio processing: {str(e)}"
         )
 
 
+async def insert_recording(
+    audio_file_path: str,
+    parent_audio_recording_id: int = None,
+    parent_time: float = None,
+    playback_file_path: str = None,
+) -> dict:
+    """Store a new recording and hand it over for processing"""
+    # The new branch changes every cached tree its parent is in
+    if parent_audio_recording_id is not None:
+        tree_cache.invalidate(parent_audio_recording_id)
+    with db.atomic():
+        db_recording = AudioRecording(
+            audio_file_path=audio_file_path,
+            playback_file_path=playback_file_path,
+            parent_audio_recording=parent_audio_recording_id,
+            parent_time=parent_time,
+        )
+        db_recording.save()
+        trace.get_current_span().set_attribute("recording.id", db_recording.id)
+
+        if PROCESSING_MODE == "pull":
+            enqueue_job("transcribe", db_recording.id)
+        else:
+            await init_audio_processing(db_recording.id, db_recording.audio_file_path)
+
+    if parent_audio_recording_id is not None:
+        layout_cache.add_child(db_recording.id, parent_audio_recording_id, parent_time)
+    return {
+        "id": db_recording.id,
+        "audio_file_path": db_recording.audio_file_path,
+        "playback_file_path": db_recording.playback_file_path,
+        "created_date": db_recording.created_date.isoformat(),
+        "updated_date": db_recording.updated_date.isoformat(),
+        "parent_audio_recording": db_recording.parent_audio_recording_id,
+        "parent_time": db_recording.parent_time,
+    }
+
+
 @app.post("/recordings/")
 async def create_recording(recording: AudioRecordingCreate):
     """Create a new audio recording entry in the database"""
     try:
-        with db.atomic():
-            db_recording = AudioRecording(
-                audio_file_path=recording.audio_file_path,
-                parent_audio_recording=recording.parent_audio_recording_id,
-                parent_time=recording.parent_time,
-            )
-            db_recording.save()
+        return await insert_recording(
+            recording.audio_file_path,
+            recording.parent_audio_recording_id,
+            recording.parent_time,
+        )
+    except Exception as e:
+        logger.error(f"Error creating recording: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
 
-            await init_audio_processing(db_recording.id, db_recording.audio_file_path)
 
-            return {
-                "id": db_recording.id,
-                "audio_file_path": db_recording.audio_file_path,
-                "created_date": db_recording.created_date.isoformat(),
-                "updated_date": db_recording.updated_date.isoformat(),
-                "parent_audio_recording": db_recording.parent_audio_recording_id,
-                "parent_time": db_recording.parent_time,
-            }
+@app.get("/recordings/")
+async def list_recordings(
+    created_after: datetime.datetime = None,
+    created_before: datetime.datetime = None,
+    after_id: int = 0,
+    limit: int = 500,
+):
+    """
+    List recordings created within a date range by id, a page at a time. Pass the last id
+    of a page as after_id to get the next one.
+    """
+    try:
+        query = AudioRecording.select().where(AudioRecording.id > after_id)
+        if created_after is not None:
+            query = query.where(AudioRecording.created_date >= created_after)
+        if created_before is not None:
+            query = query.where(AudioRecording.created_date < created_before)
+        recordings = query.order_by(AudioRecording.id).limit(max(1, min(limit, 1000)))
+        return [model_to_dict(recording, recurse=False) for recording in recordings]
     except Exception as e:
-        logger.error(f"Error creating recording: {str(e)}")
+        logger.error(f"Error listing recordings: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@app.post("/recordings/upload")
+async def upload_recording(
+    request: Request, parent_audio_recording_id: int = None, parent_time: float = None
+):
+    """
+    Create a recording from audio streamed in the request body, written to disk as it arrives
+    and stored transcoded, so the recorder needs no filesystem shared with the data API
+    """
+    os.makedirs(AUDIO_STORAGE_PATH, exist_ok=True)
+    upload_path = resolve_audio_path(f"upload-{uuid.uuid4().hex}.part")
+    try:
+        await receive_upload(request, upload_path)
+        audio_file_path, playback_file_path = await run_in_threadpool(store_upload, upload_path)
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error storing uploaded recording: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+    finally:
+        if os.path.exists(upload_path):
+            os.remove(upload_path)
+
+    try:
+        return await insert_recording(
+            audio_file_path, parent_audio_recording_id, parent_time, playback_file_path
+        )
+    except Exception as e:
+        logger.error(f"Error creating uploaded recording: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@app.get("/recordings/{recording_id}/audio")
+async def get_recording_audio(recording_id: int, playback: bool = False):
+    """
+    Serve a recording's stored audio, or its playback copy when asked for and available.
+    Range requests are supported for seeking. Audio of an archived tree is restored first.
+    """
+    try:
+        recording = AudioRecording.get_by_id(recording_id)
+    except AudioRecording.DoesNotExist:
+        raise HTTPException(status_code=404, detail="Recording not found")
+    file_name = recording.audio_file_path
+    if playback and recording.playback_file_path:
+        file_name = recording.playback_file_path
+    path = resolve_audio_path(file_name)
+    if not os.path.isfile(path):
+        restored = await run_in_threadpool(restore_archived_tree, recording_id)
+        if not restored or not os.path.isfile(path):
+            raise HTTPException(status_code=404, detail="Audio file not found")
+    return FileResponse(path, media_type=get_media_type(file_name), filename=os.path.basename(file_name))
+
+
 @app.put("/recordings/{id}/transcription")
 async def update_transcription(id: int, update: TranscriptionUpdate):
     """Update the transcription for a recording"""
@@ -83,6 +309,7 @@ async def update_transcription(id: int, update: TranscriptionUpdate):
             recording = AudioRecording.get_by_id(id)
             recording.transcription = update.transcription
             recording.save()
+            tree_cache.invalidate(id)
             return {"message": "Transcription updated successfully"}
     except AudioRecording.DoesNotExist:
         raise HTTPException(status_code=404, detail="Recording not found")
@@ -91,6 +318,26 @@ async def update_transcription(id: int, update: TranscriptionUpdate):
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@app.put("/recordings/{id}/voice-activity")
+async def update_voice_activity(id: int, update: VoiceActivityUpdate):
+    """Store what voice activity detection found in a recording, "empty" ones are not processed further"""
+    try:
+        with db.atomic():
+            recording = AudioRecording.get_by_id(id)
+            recording.status = update.status
+            recording.duration = update.duration
+            recording.speech_duration = update.speech_duration
+            recording.save()
+            tree_cache.invalidate(id)
+        layout_cache.set_duration(id, update.duration)
+        return {"message": "Voice activity updated successfully"}
+    except AudioRecording.DoesNotExist:
+        raise HTTPException(status_code=404, detail="Recording not found")
+    except Exception as e:
+        logger.error(f"Error updating voice activity: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+
 @app.put("/recordings/{id}/prompts")
 async def update_prompts(id: int, update: PromptsUpdate):
     """Update the prompts for a recording"""
@@ -99,6 +346,7 @@ async def update_prompts(id: int, update: PromptsUpdate):
             recording = AudioRecording.get_by_id(id)
             recording.prompts = update.prompts
             recording.save()
+            tree_cache.invalidate(id)
             return {"message": "Prompts updated successfully"}
     except AudioRecording.DoesNotExist:
         raise HTTPException(status_code=404, detail="Recording not found")
@@ -127,6 +375,8 @@ async def create_image_generation(
                 seed=image_generation.seed,
                 request_payload=image_generation.request_payload,
                 status=image_generation.status,
+                speculative=image_generation.speculative,
+                variant=image_generation.variant,
             )
             db_image_generation.save()
 
@@ -137,6 +387,8 @@ async def create_image_generation(
                 "seed": db_image_generation.seed,
                 "request_payload": db_image_generation.request_payload,
                 "status": db_image_generation.status,
+                "speculative": db_image_generation.speculative,
+                "variant": db_image_generation.variant,
                 "created_date": db_image_generation.created_date.isoformat(),
                 "updated_date": db_image_generation.updated_date.isoformat(),
             }
@@ -145,6 +397,25 @@ async def create_image_generation(
         raise HTTPException(status_code=500, detail=str(e))
 
 
+def is_first_pass_image(image_generation: RecordingImageGeneration) -> bool:
+    """Whether a row is one of the images rendered for a new recording, not a speculative or re-processed variant"""
+    return not image_generation.speculative and image_generation.variant is None
+
+
+def has_completed_image(recording_id: int) -> bool:
+    """Whether one of the recording's first pass images completed already"""
+    return (
+        RecordingImageGeneration.select()
+        .where(
+            (RecordingImageGeneration.audio_recording_id == recording_id)
+            & (RecordingImageGeneration.status == "completed")
+            & ~RecordingImageGeneration.speculative
+            & RecordingImageGeneration.variant.is_null()
+        )
+        .exists()
+    )
+
+
 @app.put("/recordings/{recording_id}/image-generations/{generation_id}")
 async def update_image_generation(
     recording_id: int, generation_id: int, update: ImageGenerationUpdate
@@ -153,7 +424,7 @@ async def update_image_generation(
     try:
         # Verify the audio recording exists
         try:
-            AudioRecording.get_by_id(recording_id)
+            recording = AudioRecording.get_by_id(recording_id)
         except AudioRecording.DoesNotExist:
             raise HTTPException(status_code=404, detail="Audio recording not found")
 
@@ -169,10 +440,23 @@ async def update_image_generation(
         # Update only provided fields
         with db.atomic():
             update_dict = update.model_dump(exclude_unset=True)
+            # A render that finishes after its recording was cancelled is not stored
+            if image_generation.status == "cancelled" and update_dict.get("status", "cancelled") != "cancelled":
+                raise HTTPException(status_code=409, detail="Image generation was cancelled")
             if update_dict:
+                is_first_image = (
+                    update_dict.get("status") == "completed"
+                    and image_generation.status != "completed"
+                    and is_first_pass_image(image_generation)
+                    and not has_completed_image(recording_id)
+                )
                 for field, value in update_dict.items():
                     setattr(image_generation, field, value)
                 image_generation.save()
+                if is_first_image:
+                    TIME_TO_FIRST_IMAGE.observe(
+                        (datetime.datetime.now() - recording.created_date).total_seconds()
+                    )
 
             return {
                 "id": image_generation.id,
@@ -184,20 +468,113 @@ async def update_image_generation(
                 "created_date": image_generation.created_date.isoformat(),
                 "updated_date": image_generation.updated_date.isoformat(),
             }
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error updating image generation: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@app.get("/recordings/{recording_id}/image-generations/")
+async def get_image_generations(recording_id: int, status: str = None):
+    """List the image generations of a recording, regular ones before speculative variants"""
+    try:
+        query = RecordingImageGeneration.select().where(
+            RecordingImageGeneration.audio_recording_id == recording_id
+        )
+        if status:
+            query = query.where(RecordingImageGeneration.status == status)
+        query = query.order_by(
+            RecordingImageGeneration.speculative, RecordingImageGeneration.id
+        )
+        return [model_to_dict(image_generation, recurse=False) for image_generation in query]
+    except Exception as e:
+        logger.error(f"Error listing image generations: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@app.get("/speculation/candidates")
+async def get_speculation_candidates(limit: int = 5, window_hours: float = 24):
+    """
+    Recordings worth rendering extra variants for while the GPU is idle: those with the most
+    branches created within the window, most recent first, with the variants already rendered
+    """
+    try:
+        since = datetime.datetime.now() - datetime.timedelta(hours=window_hours)
+        children = AudioRecording.alias()
+        recent_branch_count = fn.COUNT(children.id)
+        candidates = (
+            AudioRecording.select(AudioRecording, recent_branch_count.alias("recent_branch_count"))
+            .join(
+                children,
+                JOIN.LEFT_OUTER,
+                on=(
+                    (children.parent_audio_recording == AudioRecording.id)
+                    & (children.created_date >= since)
+                ),
+            )
+            .where(AudioRecording.prompts.is_null(False))
+            .group_by(AudioRecording.id)
+            .order_by(recent_branch_count.desc(), AudioRecording.created_date.desc())
+            .limit(limit)
+        )
+
+        results = []
+        for recording in candidates:
+            rendered_variants = (
+                RecordingImageGeneration.select(
+                    RecordingImageGeneration.prompt, RecordingImageGeneration.variant
+                )
+                .where(
+                    (RecordingImageGeneration.audio_recording_id == recording.id)
+                    & RecordingImageGeneration.speculative
+                    & (RecordingImageGeneration.status != "cancelled")
+                )
+                .tuples()
+            )
+            results.append(
+                {
+                    "recording_id": recording.id,
+                    "prompts": recording.prompts,
+                    "recent_branch_count": recording.recent_branch_count,
+                    "rendered_variants": [list(variant) for variant in rendered_variants],
+                }
+            )
+        return results
+    except Exception as e:
+        logger.error(f"Error getting speculation candidates: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+
 @app.get("/recordings/{recording_id}/tree")
-async def get_recording_tree(recording_id: int):
-    """Get the tree of recordings for a given recording"""
+async def get_recording_tree(recording_id: int, request: Request):
+    """
+    Get the tree of recordings for a given recording, served from the tree cache when possible.
+    Polls sending the ETag of an unchanged tree in If-None-Match get a 304. An archived tree is
+    restored first, the visual interface reads its images from disk.
+    """
     try:
-        recording = AudioRecording.get_by_id(recording_id)
-        return [
-            model_to_dict(recording, recurse=False)
-            for recording in recording.get_tree()
-        ]
+        await run_in_threadpool(restore_archived_tree, recording_id)
+        if_none_match = request.headers.get("if-none-match")
+        cached_tree = tree_cache.get(recording_id)
+        if cached_tree is None:
+            TREE_CACHE_REQUESTS.labels(result="miss").inc()
+            tree = AudioRecording.get_by_id(recording_id).get_tree()
+            body = json.dumps(
+                jsonable_encoder([model_to_dict(recording, recurse=False) for recording in tree]),
+                ensure_ascii=False,
+                separators=(",", ":"),
+            ).encode("utf-8")
+            cached_tree = tree_cache.put(recording_id, body, (recording.id for recording in tree))
+        elif etag_matches(if_none_match, cached_tree.etag):
+            TREE_CACHE_REQUESTS.labels(result="not_modified").inc()
+        else:
+            TREE_CACHE_REQUESTS.labels(result="hit").inc()
+
+        headers = {"ETag": cached_tree.etag, "Cache-Control": "no-cache"}
+        if etag_matches(if_none_match, cached_tree.etag):
+            return Response(status_code=304, headers=headers)
+        return Response(content=cached_tree.body, media_type="application/json", headers=headers)
     except AudioRecording.DoesNotExist:
         raise HTTPException(status_code=404, detail=f"Recording {recording_id} not found")
     except Exception as e:
@@ -205,6 +582,43 @@ async def get_recording_tree(recording_id: int):
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@app.get("/recordings/{recording_id}/layout")
+async def get_recording_layout(recording_id: int, request: Request):
+    """
+    Get the spiral layout of the tree below a recording as a float32 buffer: a node table with
+    the X-Layout-Node-Fields columns per recording, followed by X-Layout-Branch-Samples x, y
+    points along every branch. Layouts are cached and updated in place as the tree grows.
+    An archived tree is restored first, the visual interface reads its images from disk.
+    """
+    try:
+        await run_in_threadpool(restore_archived_tree, recording_id)
+        if_none_match = request.headers.get("if-none-match")
+        cached_layout, was_cached = layout_cache.get(recording_id)
+        body, etag = cached_layout.serialize()
+        if not was_cached:
+            LAYOUT_REQUESTS.labels(result="miss").inc()
+        elif etag_matches(if_none_match, etag):
+            LAYOUT_REQUESTS.labels(result="not_modified").inc()
+        else:
+            LAYOUT_REQUESTS.labels(result="hit").inc()
+
+        headers = {
+            "ETag": etag,
+            "Cache-Control": "no-cache",
+            "X-Layout-Nodes": str(len(cached_layout.layout.ids)),
+            "X-Layout-Node-Fields": ",".join(NODE_FIELDS),
+            "X-Layout-Branch-Samples": str(BRANCH_SAMPLES),
+        }
+        if etag_matches(if_none_match, etag):
+            return Response(status_code=304, headers=headers)
+        return Response(content=body, media_type="application/octet-stream", headers=headers)
+    except AudioRecording.DoesNotExist:
+        raise HTTPException(status_code=404, detail=f"Recording {recording_id} not found")
+    except Exception as e:
+        logger.error(f"Error getting recording layout: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+
 @app.post("/recordings/{recording_id}/image-generations/batch")
 async def create_image_generations_batch(recording_id: int, batch: BatchImageGenerationCreate):
     """Create multiple image generation entries for an audio recording in a single transaction"""
@@ -225,6 +639,8 @@ async def create_image_generations_batch(recording_id: int, batch: BatchImageGen
                     seed=gen.seed,
                     request_payload=gen.request_payload,
                     status=gen.status,
+                    speculative=gen.speculative,
+                    variant=gen.variant,
                 )
                 db_image_generation.save()
                 created_generations.append({
@@ -239,3 +655,471 @@ async def create_image_generations_batch(recording_id: int, batch: BatchImageGen
     except Exception as e:
         logger.error(f"Error creating batch image generations: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
+
+
+def enqueue_job(
+    kind: str, recording_id: int, image_generation_id: int = None, priority: int = 0, urgent: bool = False
+) -> ProcessingJob:
+    """Queue a processing job, carrying the current trace to the worker that claims it"""
+    return ProcessingJob.create(
+        kind=kind,
+        audio_recording=recording_id,
+        image_generation=image_generation_id,
+        priority=priority,
+        urgent=urgent,
+        trace_context=inject_trace_headers(),
+    )
+
+
+def serialize_job(job: ProcessingJob) -> dict:
+    """A claimed job with everything a worker needs to run it"""
+    recording = job.audio_recording
+    result = {
+        "id": job.id,
+        "kind": job.kind,
+        "recording_id": recording.id,
+        "priority": job.priority,
+        "urgent": job.urgent,
+        "attempts": job.attempts,
+        "lease_expires": job.lease_expires.isoformat(),
+        "trace_context": job.trace_context or {},
+    }
+    if job.kind == "transcribe":
+        result["audio_file_path"] = recording.audio_file_path
+    elif job.kind == "prompts":
+        result["transcription"] = recording.transcription
+        result["duration"] = recording.duration
+        result["speech_duration"] = recording.speech_duration
+    else:
+        result["image_generation_id"] = job.image_generation_id
+        result["prompt"] = job.image_generation.prompt
+    return result
+
+
+def get_leased_job(job_id: int, worker_id: str) -> ProcessingJob:
+    """The job if the worker still holds its lease, 409 otherwise so the worker drops it"""
+    try:
+        job = ProcessingJob.get_by_id(job_id)
+    except ProcessingJob.DoesNotExist:
+        raise HTTPException(status_code=404, detail="Processing job not found")
+    if job.status != "leased" or job.worker_id != worker_id:
+        raise HTTPException(status_code=409, detail="Lease is no longer held by this worker")
+    return job
+
+
+def fail_job(job: ProcessingJob, error: str):
+    job.status = "failed"
+    job.error = error
+    job.save()
+    PROCESSING_JOB_OUTCOMES.labels(kind=job.kind, outcome="failed").inc()
+    if job.image_generation_id is not None:
+        RecordingImageGeneration.update(
+            status="failed", reason=error, updated_date=datetime.datetime.now()
+        ).where(RecordingImageGeneration.id == job.image_generation_id).execute()
+
+
+def claim_next_job(kinds: list[str], worker_id: str, lease_seconds: float) -> ProcessingJob:
+    """Lease the most urgent queued job of the given kinds, or one whose lease expired"""
+    while True:
+        now = datetime.datetime.now()
+        job = (
+            ProcessingJob.select()
+            .where(
+                ProcessingJob.kind.in_(kinds)
+                & (
+                    (ProcessingJob.status == "queued")
+                    | ((ProcessingJob.status == "leased") & (ProcessingJob.lease_expires < now))
+                )
+            )
+            .order_by(ProcessingJob.urgent.desc(), ProcessingJob.priority, ProcessingJob.id)
+            .first()
+        )
+        if job is None:
+            return None
+        if job.status == "leased":
+            logger.warning(f"Lease of job {job.id} held by {job.worker_id} expired")
+            PROCESSING_JOB_OUTCOMES.labels(kind=job.kind, outcome="expired").inc()
+            if job.attempts >= MAX_JOB_ATTEMPTS:
+                fail_job(job, f"Lease expired after {job.attempts} attempts")
+                continue
+        # Only take the job if nobody else changed it since it was selected
+        claimed = (
+            ProcessingJob.update(
+                status="leased",
+                worker_id=worker_id,
+                lease_expires=now + datetime.timedelta(seconds=lease_seconds),
+                attempts=ProcessingJob.attempts + 1,
+                updated_date=now,
+            )
+            .where((ProcessingJob.id == job.id) & (ProcessingJob.updated_date == job.updated_date))
+            .execute()
+        )
+        if claimed:
+            if job.image_generation_id is not None:
+                RecordingImageGeneration.update(status="generating", updated_date=now).where(
+                    RecordingImageGeneration.id == job.image_generation_id
+                ).execute()
+            return ProcessingJob.get_by_id(job.id)
+
+
+def apply_job_result(job: ProcessingJob, result: dict):
+    """Store a finished job's result and queue the jobs that follow from it"""
+    recording = job.audio_recording
+    if job.kind == "transcribe":
+        recording.transcription = result["transcription"]
+        recording.duration = result.get("duration")
+        recording.speech_duration = result.get("speech_duration")
+        recording.status = result.get("status")
+        recording.save()
+        tree_cache.invalidate(recording.id)
+        layout_cache.set_duration(recording.id, recording.duration)
+        # Nothing was said, so there is nothing to prompt or render
+        if recording.status != "empty":
+            enqueue_job("prompts", recording.id, urgent=job.urgent)
+    elif job.kind == "prompts":
+        recording.prompts = result["prompts"]
+        recording.save()
+        tree_cache.invalidate(recording.id)
+        # Earlier prompts get lower priorities so every recording's first image renders first
+        for index, prompt in enumerate(result["prompts"]):
+            image_generation = RecordingImageGeneration.create(
+                audio_recording_id=recording.id, prompt=prompt
+            )
+            enqueue_job("image", recording.id, image_generation.id, priority=index, urgent=job.urgent)
+    else:
+        image_generation = job.image_generation
+        is_first_image = is_first_pass_image(image_generation) and not has_completed_image(recording.id)
+        image_generation.image_file_path = result["image_file_path"]
+        image_generation.seed = result.get("seed")
+        image_generation.request_payload = result.get("request_payload")
+        image_generation.duration = result.get("duration")
+        image_generation.status = "completed"
+        image_generation.save()
+        if is_first_image:
+            TIME_TO_FIRST_IMAGE.observe(
+                (datetime.datetime.now() - recording.created_date).total_seconds()
+            )
+
+
+def touch_worker(worker_id: str, capabilities: list[str] = None):
+    worker = workers.setdefault(worker_id, {"worker_id": worker_id, "capabilities": []})
+    if capabilities is not None:
+        worker["capabilities"] = capabilities
+    worker["last_seen"] = datetime.datetime.now().isoformat()
+
+
+@app.post("/jobs/claim")
+async def claim_job(claim: JobClaim):
+    """Lease the next job a worker with the given capabilities can run, 204 if there is none"""
+    try:
+        touch_worker(claim.worker_id, claim.capabilities)
+        kinds = [CAPABILITY_JOB_KINDS[capability] for capability in claim.capabilities]
+        with db.atomic():
+            job = claim_next_job(kinds, claim.worker_id, claim.lease_seconds)
+            if job is None:
+                return Response(status_code=204)
+            trace.get_current_span().set_attribute("recording.id", job.audio_recording_id)
+            return serialize_job(job)
+    except Exception as e:
+        logger.error(f"Error claiming job: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@app.post("/jobs/{job_id}/heartbeat")
+async def heartbeat_job(job_id: int, heartbeat: JobHeartbeat):
+    """Extend the lease of a job the worker is still running"""
+    touch_worker(heartbeat.worker_id)
+    with db.atomic():
+        job = get_leased_job(job_id, heartbeat.worker_id)
+        job.lease_expires = datetime.datetime.now() + datetime.timedelta(
+            seconds=heartbeat.lease_seconds
+        )
+        job.save()
+        return {"id": job.id, "lease_expires": job.lease_expires.isoformat()}
+
+
+@app.post("/jobs/{job_id}/complete")
+async def complete_job(job_id: int, completion: JobComplete):
+    """Store the result of a job and queue the work that follows it"""
+    touch_worker(completion.worker_id)
+    try:
+        with db.atomic():
+            job = get_leased_job(job_id, completion.worker_id)
+            apply_job_result(job, completion.result)
+            job.status = "completed"
+            job.lease_expires = None
+            job.save()
+            PROCESSING_JOB_OUTCOMES.labels(kind=job.kind, outcome="completed").inc()
+            return {"id": job.id, "status": job.status}
+    except KeyError as e:
+        raise HTTPException(status_code=422, detail=f"Job result is missing {str(e)}")
+
+
+@app.post("/jobs/{job_id}/fail")
+async def fail_processing_job(job_id: int, failure: JobFail):
+    """Give a job back for another attempt, or fail it when out of attempts or not retryable"""
+    touch_worker(failure.worker_id)
+    with db.atomic():
+        job = get_leased_job(job_id, failure.worker_id)
+        if failure.retry and job.attempts < MAX_JOB_ATTEMPTS:
+            job.status = "queued"
+            job.worker_id = None
+            job.lease_expires = None
+            job.error = failure.error
+            job.save()
+            PROCESSING_JOB_OUTCOMES.labels(kind=job.kind, outcome="retried").inc()
+            if job.image_generation_id is not None:
+                RecordingImageGeneration.update(status="pending", updated_date=datetime.datetime.now()).where(
+                    RecordingImageGeneration.id == job.image_generation_id
+                ).execute()
+        else:
+            fail_job(job, failure.error)
+        return {"id": job.id, "status": job.status, "attempts": job.attempts}
+
+
+def cancel_processing(recording_ids: list[int]) -> dict:
+    """
+    Cancel the queued and leased jobs and the unfinished images of the recordings. Workers
+    holding a lease on one of the jobs lose it at their next heartbeat and abort it.
+    """
+    now = datetime.datetime.now()
+    jobs = list(
+        ProcessingJob.select(ProcessingJob.id, ProcessingJob.kind).where(
+            ProcessingJob.audio_recording.in_(recording_ids)
+            & ProcessingJob.status.in_(["queued", "leased"])
+        )
+    )
+    if jobs:
+        ProcessingJob.update(status="cancelled", lease_expires=None, updated_date=now).where(
+            ProcessingJob.id.in_([job.id for job in jobs])
+        ).execute()
+    for job in jobs:
+        PROCESSING_JOB_OUTCOMES.labels(kind=job.kind, outcome="cancelled").inc()
+    unfinished_images = RecordingImageGeneration.select(RecordingImageGeneration.id).where(
+        RecordingImageGeneration.audio_recording_id.in_(recording_ids)
+        & RecordingImageGeneration.status.in_(["pending", "generating"])
+    )
+    cancelled_images = (
+        RecordingImageGeneration.update(status="cancelled", reason="Recording cancelled", updated_date=now)
+        .where(RecordingImageGeneration.id.in_(unfinished_images))
+        .execute()
+    )
+    return {"recording_ids": recording_ids, "cancelled_jobs": len(jobs), "cancelled_images": cancelled_images}
+
+
+def unfinished_recording_ids(recording_ids: list[int]) -> list[int]:
+    """Recordings the push mode processor may still hold work for: no prompts yet or images pending"""
+    return [
+        recording_id
+        for (recording_id,) in AudioRecording.select(AudioRecording.id)
+        .where(
+            AudioRecording.id.in_(recording_ids)
+            & (
+                (AudioRecording.prompts.is_null() & (AudioRecording.status.is_null() | (AudioRecording.status != "empty")))
+                | AudioRecording.id.in_(
+                    RecordingImageGeneration.select(RecordingImageGeneration.audio_recording_id).where(
+                        RecordingImageGeneration.status.in_(["pending", "generating"])
+                    )
+                )
+            )
+        )
+        .tuples()
+    ]
+
+
+def forward_to_processor(recording_id: int, action: str) -> dict:
+    """Pass a cancel or preempt on to the push mode processor, best effort as the rows are updated already"""
+    try:
+        with PROCESSOR_REQUEST_LATENCY.time():
+            response = requests.post(
+                f"{AUDIO_PROCESSOR_URL}/recordings/{recording_id}/{action}",
+                headers=inject_trace_headers(),
+            )
+        response.raise_for_status()
+        return response.json()
+    except requests.RequestException as e:
+        PROCESSOR_REQUEST_FAILURES.inc()
+        logger.warning(f"Could not {action} recording {recording_id} in the processor: {str(e)}")
+        return {"recording_id": str(recording_id), "error": str(e)}
+
+
+@app.post("/recordings/{recording_id}/cancel")
+async def cancel_recording(recording_id: int, subtree: bool = False):
+    """
+    Stop the processing of a recording, or of every branch below it as well with subtree, for
+    example when it is junk or superseded. Its queued and leased jobs and unfinished images are
+    marked cancelled, in push mode the processor also drops its queued work and aborts its render.
+    """
+    try:
+        AudioRecording.get_by_id(recording_id)
+    except AudioRecording.DoesNotExist:
+        raise HTTPException(status_code=404, detail="Audio recording not found")
+    trace.get_current_span().set_attribute("recording.id", recording_id)
+    if subtree:
+        recording_ids = [
+            row_id
+            for (row_id,) in AudioRecording.select(AudioRecording.id)
+            .where(AudioRecording.id.in_(AudioRecording.subtree_ids(recording_id)))
+            .tuples()
+        ]
+    else:
+        recording_ids = [recording_id]
+    with db.atomic():
+        # Before the images are cancelled, they tell which recordings the processor still works on
+        processor_ids = unfinished_recording_ids(recording_ids) if PROCESSING_MODE == "push" else []
+        result = cancel_processing(recording_ids)
+    # In the threadpool, as the processor calls back into this API while it cancels
+    result["processor"] = [
+        await run_in_threadpool(forward_to_processor, processor_id, "cancel") for processor_id in processor_ids
+    ]
+    return result
+
+
+@app.post("/recordings/{recording_id}/preempt")
+async def preempt_recording(recording_id: int):
+    """
+    Process a recording ahead of all other work. Its queued jobs, and the jobs that follow
+    them, are claimed before any others, in push mode the processor moves its queued work first.
+    """
+    try:
+        AudioRecording.get_by_id(recording_id)
+    except AudioRecording.DoesNotExist:
+        raise HTTPException(status_code=404, detail="Audio recording not found")
+    trace.get_current_span().set_attribute("recording.id", recording_id)
+    if PROCESSING_MODE == "push":
+        return await run_in_threadpool(forward_to_processor, recording_id, "preempt")
+    urgent_jobs = (
+        ProcessingJob.update(urgent=True)
+        .where(
+            (ProcessingJob.audio_recording == recording_id)
+            & ProcessingJob.status.in_(["queued", "leased"])
+        )
+        .execute()
+    )
+    return {"recording_id": recording_id, "urgent_jobs": urgent_jobs}
+
+
+@app.delete("/jobs/{job_id}")
+async def cancel_job(job_id: int):
+    """Cancel a queued or leased job, a worker running it aborts at its next heartbeat"""
+    with db.atomic():
+        try:
+            job = ProcessingJob.get_by_id(job_id)
+        except ProcessingJob.DoesNotExist:
+            raise HTTPException(status_code=404, detail="Processing job not found")
+        if job.status not in ("queued", "leased"):
+            raise HTTPException(status_code=409, detail=f"Job is already {job.status}")
+        now = datetime.datetime.now()
+        job.status = "cancelled"
+        job.lease_expires = None
+        job.updated_date = now
+        job.save()
+        PROCESSING_JOB_OUTCOMES.labels(kind=job.kind, outcome="cancelled").inc()
+        if job.image_generation_id is not None:
+            RecordingImageGeneration.update(status="cancelled", reason="Job cancelled", updated_date=now).where(
+                RecordingImageGeneration.id == job.image_generation_id
+            ).execute()
+        return {"id": job.id, "status": job.status}
+
+
+@app.get("/workers")
+async def get_workers():
+    """Workers seen recently, with their capabilities and the jobs they currently lease"""
+    leased_jobs = ProcessingJob.select(ProcessingJob.id, ProcessingJob.worker_id).where(
+        ProcessingJob.status == "leased"
+    )
+    jobs_by_worker = {}
+    for job in leased_jobs:
+        jobs_by_worker.setdefault(job.worker_id, []).append(job.id)
+    return [
+        {**worker, "leased_jobs": jobs_by_worker.get(worker_id, [])}
+        for worker_id, worker in workers.items()
+    ]
+
+
+# bm25 weights of the transcription and prompts columns, what was said counts more than the prompts
+SEARCH_WEIGHTS = (2.0, 1.0)
+SEARCH_MAX_LIMIT = 100
+
+
+def to_match_query(q: str) -> str:
+    """
+    Turn free text into an FTS5 query matching every word, the last one as a prefix so results
+    follow along while typing. Quoting each word keeps FTS5 operators in the input literal.
+    """
+    words = [word.replace('"', '""') for word in q.split()]
+    if not words:
+        return ""
+    return " ".join(f'"{word}"' for word in words[:-1]) + f' "{words[-1]}"*'
+
+
+@app.get("/search")
+async def search_recordings(q: str, tree_id: int = None, limit: int = 20, offset: int = 0):
+    """
+    Full-text search over transcriptions and prompts, best matches first with highlighted
+    snippets, optionally restricted to the tree below tree_id
+    """
+    match_query = to_match_query(q)
+    if not match_query:
+        return []
+    limit = max(1, min(limit, SEARCH_MAX_LIMIT))
+    try:
+        score = RecordingSearch.bm25(*SEARCH_WEIGHTS)
+        query = (
+            RecordingSearch.select(
+                RecordingSearch.rowid,
+                score.alias("score"),
+                RecordingSearch.transcription.snippet("<mark>", "</mark>", "…", 24).alias("transcription_snippet"),
+                RecordingSearch.prompts.snippet("<mark>", "</mark>", "…", 16).alias("prompts_snippet"),
+                AudioRecording.parent_audio_recording,
+                AudioRecording.created_date,
+            )
+            .join(AudioRecording, on=(RecordingSearch.rowid == AudioRecording.id))
+            .where(RecordingSearch.match(match_query))
+            .order_by(score)
+            .limit(limit)
+            .offset(offset)
+        )
+        if tree_id is not None:
+            # Adding 0 keeps SQLite from handing the ids to FTS5 as rowid lookups, which would
+            # rerun the full-text query once per recording in the tree
+            query = query.where((RecordingSearch.rowid + 0).in_(AudioRecording.subtree_ids(tree_id)))
+        return [
+            {
+                "recording_id": row["rowid"],
+                "score": -row["score"],  # bm25 is lower for better matches
+                "transcription_snippet": row["transcription_snippet"],
+                "prompts_snippet": row["prompts_snippet"],
+                "parent_audio_recording": row["parent_audio_recording"],
+                "created_date": row["created_date"],
+            }
+            for row in query.dicts()
+        ]
+    except Exception as e:
+        logger.error(f"Error searching recordings: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+def check_admin_token(token: str):
+    # Compaction deletes and archives data, so the admin routes stay closed until a token is configured
+    if not ADMIN_TOKEN:
+        raise HTTPException(status_code=403, detail="Admin routes are disabled, set ADMIN_TOKEN to enable them")
+    if token != ADMIN_TOKEN:
+        raise HTTPException(status_code=403, detail="Invalid admin token")
+
+
+@app.post("/admin/compaction", status_code=202)
+async def start_compaction(request: CompactionRequest, x_admin_token: str = Header(None)):
+    """Start a compaction run in the background, see GET /admin/compaction for its report"""
+    check_admin_token(x_admin_token)
+    options = request.model_dump(exclude_none=True)
+    if not compaction_runner.start(CompactionOptions(**options)):
+        raise HTTPException(status_code=409, detail="A compaction run is already in progress")
+    return {"status": "started"}
+
+
+@app.get("/admin/compaction")
+async def get_compaction_status(x_admin_token: str = Header(None)):
+    """Whether compaction is running, and the report of the last finished run"""
+    check_admin_token(x_admin_token)
+    return {"running": compaction_runner.running, "last_report": compaction_runner.last_report}
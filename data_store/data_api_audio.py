@@ -0,0 +1,73 @@
+import os
+import subprocess
+import time
+import uuid
+from fastapi import HTTPException, Request
+from data_api_metrics import AUDIO_TRANSCODE_LATENCY
+
+# Uploaded recordings are stored here, recordings created from a path are resolved against it too
+AUDIO_STORAGE_PATH = os.getenv("AUDIO_STORAGE_PATH", "recordings")
+# Format recordings are kept in: flac is lossless at about half the size of WAV, opus is far smaller
+AUDIO_STORAGE_FORMAT = os.getenv("AUDIO_STORAGE_FORMAT", "flac")
+# Extra copy for playback, quick to seek and stream, or "none" to play the stored file
+AUDIO_PLAYBACK_FORMAT = os.getenv("AUDIO_PLAYBACK_FORMAT", "opus")
+FFMPEG_PATH = os.getenv("FFMPEG_PATH", "ffmpeg")
+MAX_UPLOAD_BYTES = int(os.getenv("MAX_UPLOAD_BYTES", str(200 * 2**20)))
+
+AUDIO_FORMATS = {
+    "flac": {"extension": ".flac", "args": ["-c:a", "flac", "-compression_level", "8"]},
+    # Pages of about 20 ms let players seek without decoding far past the target
+    "opus": {"extension": ".opus", "args": ["-c:a", "libopus", "-b:a", "96k", "-page_duration", "20000"]},
+}
+MEDIA_TYPES = {".flac": "audio/flac", ".opus": "audio/ogg", ".wav": "audio/wav"}
+
+
+async def receive_upload(request: Request, path: str) -> int:
+    """Write the request body to path chunk by chunk as it arrives, returning its size"""
+    size = 0
+    with open(path, "wb") as f:
+        async for chunk in request.stream():
+            size += len(chunk)
+            if size > MAX_UPLOAD_BYTES:
+                raise HTTPException(status_code=413, detail=f"Upload exceeds {MAX_UPLOAD_BYTES} bytes")
+            f.write(chunk)
+    if size == 0:
+        raise HTTPException(status_code=400, detail="Upload is empty")
+    return size
+
+
+def transcode(source_path: str, destination_path: str, audio_format: str):
+    start_time = time.perf_counter()
+    result = subprocess.run(
+        [FFMPEG_PATH, "-nostdin", "-y", "-v", "error", "-i", source_path, "-vn",
+         *AUDIO_FORMATS[audio_format]["args"], destination_path],
+        capture_output=True,
+        text=True,
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"Transcoding to {audio_format} failed: {result.stderr.strip()}")
+    AUDIO_TRANSCODE_LATENCY.labels(format=audio_format).observe(time.perf_counter() - start_time)
+
+
+def store_upload(upload_path: str) -> tuple[str, str]:
+    """Transcode an upload into the storage format and the playback format, returning both file names"""
+    base_name = f"recording-{uuid.uuid4().hex}"
+    audio_file_name = base_name + AUDIO_FORMATS[AUDIO_STORAGE_FORMAT]["extension"]
+    transcode(upload_path, resolve_audio_path(audio_file_name), AUDIO_STORAGE_FORMAT)
+    playback_file_name = None
+    if AUDIO_PLAYBACK_FORMAT != "none":
+        playback_file_name = base_name + "-playback" + AUDIO_FORMATS[AUDIO_PLAYBACK_FORMAT]["extension"]
+        transcode(upload_path, resolve_audio_path(playback_file_name), AUDIO_PLAYBACK_FORMAT)
+    return audio_file_name, playback_file_name
+
+
+def resolve_audio_path(file_name: str) -> str:
+    storage_path = os.path.realpath(AUDIO_STORAGE_PATH)
+    path = os.path.realpath(os.path.join(storage_path, file_name))
+    if os.path.commonpath([path, storage_path]) != storage_path:
+        raise HTTPException(status_code=400, detail="Audio file is outside the audio storage")
+    return path
+
+
+def get_media_type(file_name: str) -> str:
+    return MEDIA_TYPES.get(os.path.splitext(file_name)[1].lower(), "application/octet-stream")
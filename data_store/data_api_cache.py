@@ -0,0 +1,83 @@
+import hashlib
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Iterable, Optional
+from data_api_metrics import TREE_CACHE_ENTRIES, TREE_CACHE_BYTES
+
+
+@dataclass
+class CachedTree:
+    body: bytes
+    etag: str
+    # Ids of every recording in the tree, a write to any of them invalidates it
+    member_ids: frozenset[int]
+
+    @property
+    def size(self) -> int:
+        # Rough cost of the member set on top of the serialized body
+        return len(self.body) + 64 * len(self.member_ids)
+
+
+def compute_etag(body: bytes) -> str:
+    return f'"{hashlib.sha1(body).hexdigest()}"'
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """Whether an If-None-Match header names the ETag, weak comparison as for GET requests"""
+    if not if_none_match:
+        return False
+    candidates = [candidate.strip().removeprefix("W/") for candidate in if_none_match.split(",")]
+    return "*" in candidates or etag in candidates
+
+
+class TreeCache:
+    """
+    Serialized trees keyed by their root recording, evicting the least recently used ones once
+    max_bytes is exceeded. Writes invalidate every cached tree containing the changed recording.
+    """
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.entries: OrderedDict[int, CachedTree] = OrderedDict()
+        self.total_bytes = 0
+        self.lock = threading.Lock()
+        TREE_CACHE_ENTRIES.set_function(lambda: len(self.entries))
+        TREE_CACHE_BYTES.set_function(lambda: self.total_bytes)
+
+    def get(self, root_id: int) -> Optional[CachedTree]:
+        with self.lock:
+            entry = self.entries.get(root_id)
+            if entry is not None:
+                self.entries.move_to_end(root_id)
+        return entry
+
+    def put(self, root_id: int, body: bytes, member_ids: Iterable[int]) -> CachedTree:
+        entry = CachedTree(body, compute_etag(body), frozenset(member_ids))
+        if entry.size > self.max_bytes:
+            return entry  # Too large to cache without evicting everything else
+        with self.lock:
+            self._remove(root_id)
+            self.entries[root_id] = entry
+            self.total_bytes += entry.size
+            while self.total_bytes > self.max_bytes:
+                self._remove(next(iter(self.entries)))
+        return entry
+
+    def invalidate(self, recording_id: int):
+        """Drop every cached tree the recording belongs to"""
+        with self.lock:
+            for root_id in [
+                root_id for root_id, entry in self.entries.items() if recording_id in entry.member_ids
+            ]:
+                self._remove(root_id)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.total_bytes = 0
+
+    def _remove(self, root_id: int):
+        entry = self.entries.pop(root_id, None)
+        if entry is not None:
+            self.total_bytes -= entry.size
@@ -0,0 +1,280 @@
+import math
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Optional
+import numpy as np
+from data_model import AudioRecording
+from data_api_cache import compute_etag
+from data_api_metrics import LAYOUT_COMPUTE_LATENCY, LAYOUT_CACHE_ENTRIES, LAYOUT_CACHE_BYTES
+
+# Spiral every branch is drawn along: the radius grows with the seconds of audio while it turns
+SPIRAL_GROWTH = 0.05  # Radius units per second of audio
+SPIRAL_TURN_SECONDS = 20.0  # Seconds of audio per full turn
+DEPTH_SCALE = 0.6  # Each level of branches is drawn this much smaller than its parent
+BRANCH_SPREAD = math.pi / 4  # Angle between a child and its parent's tangent, alternating sides per sibling
+DEFAULT_BRANCH_SECONDS = 10.0  # Length of branches whose duration is not known yet
+BRANCH_SAMPLES = 32  # Points sampled along every branch
+
+# Columns of the node table at the start of the layout buffer, ids are exact up to 2**24 as float32
+NODE_FIELDS = ("id", "parent_row", "x", "y", "heading", "depth", "length")
+
+
+class TreeLayout:
+    """
+    Spiral positions of every branch in a tree, as NumPy arrays with one row per recording.
+    A branch starts on its parent's spiral at parent_time and only depends on its ancestors,
+    so a new child is placed on its own without moving any other branch.
+    """
+
+    def __init__(self, root_id: int, ids, parent_ids, parent_times, durations):
+        self.root_id = root_id
+        self.ids = np.asarray(ids, dtype=np.int64)
+        self.rows = {int(recording_id): row for row, recording_id in enumerate(self.ids)}
+        # Ids grow with creation, so sorted by id every parent comes before its children
+        has_parent = np.asarray([parent_id is not None for parent_id in parent_ids])
+        parent_rows = np.searchsorted(
+            self.ids, np.asarray([parent_id or 0 for parent_id in parent_ids], dtype=np.int64)
+        )
+        has_parent[self.ids == root_id] = False
+        self.parent_rows = np.where(has_parent, np.minimum(parent_rows, len(self.ids) - 1), -1)
+        self.parent_times = np.nan_to_num(np.asarray(parent_times, dtype=np.float64))
+        self.durations = np.asarray(durations, dtype=np.float64)
+
+        self.depths = self._compute_depths()
+        self.sides = self._compute_sides()
+        self.child_counts = np.bincount(self.parent_rows[has_parent], minlength=len(self.ids))
+        self.child_max_times = np.zeros(len(self.ids))
+        np.maximum.at(self.child_max_times, self.parent_rows[has_parent], self.parent_times[has_parent])
+        self.lengths = self._compute_lengths(np.arange(len(self.ids)))
+
+        self.origins = np.zeros((len(self.ids), 2))
+        self.headings = np.zeros(len(self.ids))
+        self.scales = DEPTH_SCALE ** self.depths
+        # Every level winds the other way than its parent
+        self.windings = np.where(self.depths % 2 == 0, 1.0, -1.0)
+        self.points = np.zeros((len(self.ids), BRANCH_SAMPLES, 2), dtype=np.float32)
+
+        order = np.argsort(self.depths, kind="stable")
+        level_starts = np.searchsorted(self.depths[order], np.arange(1, self.depths.max(initial=0) + 1))
+        for level_rows in np.split(order, level_starts)[1:]:
+            self._place(level_rows)
+        self._sample(np.arange(len(self.ids)))
+
+    @classmethod
+    def load(cls, root_id: int) -> "TreeLayout":
+        """Lay out the tree below root_id, reading it in a single query"""
+        rows = list(
+            AudioRecording.select(
+                AudioRecording.id,
+                AudioRecording.parent_audio_recording,
+                AudioRecording.parent_time,
+                AudioRecording.duration,
+            )
+            .where(AudioRecording.id.in_(AudioRecording.subtree_ids(root_id)))
+            .order_by(AudioRecording.id)
+            .tuples()
+        )
+        if not rows:
+            raise AudioRecording.DoesNotExist(f"Recording {root_id} not found")
+        ids, parent_ids, parent_times, durations = zip(*rows)
+        return cls(
+            root_id,
+            ids,
+            parent_ids,
+            [time if time is not None else np.nan for time in parent_times],
+            [duration if duration is not None else np.nan for duration in durations],
+        )
+
+    def __contains__(self, recording_id: int) -> bool:
+        return recording_id in self.rows
+
+    def add_child(self, recording_id: int, parent_id: int, parent_time: Optional[float]):
+        """Place a new branch, lengthening its parent if it starts past the parent's end"""
+        parent_row = self.rows[parent_id]
+        row = len(self.ids)
+        parent_time = parent_time or 0.0
+        self.rows[recording_id] = row
+        self.ids = np.append(self.ids, recording_id)
+        self.parent_rows = np.append(self.parent_rows, parent_row)
+        self.parent_times = np.append(self.parent_times, parent_time)
+        self.durations = np.append(self.durations, np.nan)
+        self.depths = np.append(self.depths, self.depths[parent_row] + 1)
+        self.sides = np.append(self.sides, 1.0 if self.child_counts[parent_row] % 2 == 0 else -1.0)
+        self.child_counts[parent_row] += 1
+        self.child_counts = np.append(self.child_counts, 0)
+        self.child_max_times = np.append(self.child_max_times, 0.0)
+        self.lengths = np.append(self.lengths, DEFAULT_BRANCH_SECONDS)
+        self.origins = np.append(self.origins, np.zeros((1, 2)), axis=0)
+        self.headings = np.append(self.headings, 0.0)
+        self.scales = np.append(self.scales, self.scales[parent_row] * DEPTH_SCALE)
+        self.windings = np.append(self.windings, -self.windings[parent_row])
+        self.points = np.append(self.points, np.zeros((1, BRANCH_SAMPLES, 2), dtype=np.float32), axis=0)
+
+        changed_rows = [row]
+        self.child_max_times[parent_row] = max(self.child_max_times[parent_row], parent_time)
+        parent_length = self._compute_lengths(np.array([parent_row]))[0]
+        if parent_length != self.lengths[parent_row]:
+            self.lengths[parent_row] = parent_length
+            changed_rows.append(parent_row)
+        self._place(np.array([row]))
+        self._sample(np.array(changed_rows))
+
+    def set_duration(self, recording_id: int, duration: Optional[float]):
+        """Stretch a branch to its measured duration, moving the children clamped to its end"""
+        row = self.rows[recording_id]
+        old_length = self.lengths[row]
+        self.durations[row] = duration if duration is not None else np.nan
+        self.lengths[row] = self._compute_lengths(np.array([row]))[0]
+        changed_rows = [np.array([row])]
+        # Children starting past the shorter of both lengths start somewhere else now, and so do their descendants
+        moved_rows = np.flatnonzero(
+            (self.parent_rows == row) & (self.parent_times > min(old_length, self.lengths[row]))
+        )
+        while len(moved_rows):
+            self._place(moved_rows)
+            changed_rows.append(moved_rows)
+            moved_rows = np.flatnonzero(np.isin(self.parent_rows, moved_rows))
+        self._sample(np.concatenate(changed_rows))
+
+    def to_bytes(self) -> bytes:
+        """The node table followed by the sampled branch points, as little endian float32"""
+        nodes = np.column_stack(
+            (
+                self.ids,
+                self.parent_rows,
+                self.origins,
+                self.headings,
+                self.depths,
+                self.lengths,
+            )
+        ).astype("<f4")
+        return nodes.tobytes() + self.points.astype("<f4", copy=False).tobytes()
+
+    def _compute_depths(self) -> np.ndarray:
+        # Pointer jumping, so the work grows with log(depth) passes instead of one per level
+        jumps = np.where(self.parent_rows >= 0, self.parent_rows, np.arange(len(self.ids)))
+        depths = (self.parent_rows >= 0).astype(np.int64)
+        while True:
+            next_jumps = jumps[jumps]
+            if np.array_equal(next_jumps, jumps):
+                return depths
+            depths = depths + depths[jumps]
+            jumps = next_jumps
+
+    def _compute_sides(self) -> np.ndarray:
+        # Rank of every branch among its siblings, by creation
+        order = np.lexsort((self.ids, self.parent_rows))
+        sorted_parents = self.parent_rows[order]
+        group_starts = np.r_[0, np.flatnonzero(np.diff(sorted_parents)) + 1]
+        ranks = np.empty(len(self.ids), dtype=np.int64)
+        ranks[order] = np.arange(len(self.ids)) - np.repeat(group_starts, np.diff(np.r_[group_starts, len(self.ids)]))
+        return np.where(ranks % 2 == 0, 1.0, -1.0)
+
+    def _compute_lengths(self, rows: np.ndarray) -> np.ndarray:
+        durations = self.durations[rows]
+        return np.where(
+            np.isnan(durations),
+            np.maximum(self.child_max_times[rows], DEFAULT_BRANCH_SECONDS),
+            durations,
+        )
+
+    def _spiral(self, rows: np.ndarray, times: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        """Points and angles on the spirals of rows, times holds one time or a row of times per row"""
+        shape = rows.shape + (1,) * (times.ndim - 1)
+        angles = (
+            self.headings[rows].reshape(shape)
+            + self.windings[rows].reshape(shape) * 2 * math.pi * times / SPIRAL_TURN_SECONDS
+        )
+        radii = self.scales[rows].reshape(shape) * SPIRAL_GROWTH * times
+        origins = self.origins[rows].reshape(shape + (2,))
+        points = origins + radii[..., np.newaxis] * np.stack((np.cos(angles), np.sin(angles)), axis=-1)
+        return points, angles
+
+    def _place(self, rows: np.ndarray):
+        """Start rows on their parents' spirals, their parents have to be placed already"""
+        parent_rows = self.parent_rows[rows]
+        times = np.minimum(self.parent_times[rows], self.lengths[parent_rows])
+        origins, angles = self._spiral(parent_rows, times)
+        self.origins[rows] = origins
+        self.headings[rows] = angles + self.sides[rows] * BRANCH_SPREAD
+
+    def _sample(self, rows: np.ndarray):
+        times = self.lengths[rows, np.newaxis] * np.linspace(0, 1, BRANCH_SAMPLES)
+        self.points[rows] = self._spiral(rows, times)[0]
+
+
+@dataclass
+class CachedLayout:
+    layout: TreeLayout
+    # Serialized buffer, dropped whenever the layout changes
+    body: Optional[bytes] = None
+    etag: Optional[str] = None
+
+    @property
+    def size(self) -> int:
+        # The per row arrays, dominated by the sampled points, plus the serialized buffer
+        return len(self.layout.ids) * (BRANCH_SAMPLES * 8 + 128) + len(self.body or b"")
+
+    def serialize(self) -> tuple[bytes, str]:
+        if self.body is None:
+            self.body = self.layout.to_bytes()
+            self.etag = compute_etag(self.body)
+        return self.body, self.etag
+
+
+class LayoutCache:
+    """
+    Tree layouts keyed by their root recording, evicting the least recently used ones once
+    max_bytes is exceeded. Writes update the cached layouts in place instead of dropping them.
+    """
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.entries: OrderedDict[int, CachedLayout] = OrderedDict()
+        self.lock = threading.Lock()
+        LAYOUT_CACHE_ENTRIES.set_function(lambda: len(self.entries))
+        LAYOUT_CACHE_BYTES.set_function(lambda: sum(entry.size for entry in list(self.entries.values())))
+
+    def get(self, root_id: int) -> tuple[CachedLayout, bool]:
+        """The cached layout of the tree, computing it on a miss, and whether it was cached"""
+        with self.lock:
+            entry = self.entries.get(root_id)
+            if entry is not None:
+                self.entries.move_to_end(root_id)
+                return entry, True
+        start_time = time.perf_counter()
+        entry = CachedLayout(TreeLayout.load(root_id))
+        entry.serialize()
+        LAYOUT_COMPUTE_LATENCY.labels(mode="full").observe(time.perf_counter() - start_time)
+        with self.lock:
+            if entry.size <= self.max_bytes:
+                self.entries[root_id] = entry
+                self._evict()
+        return entry, False
+
+    def add_child(self, recording_id: int, parent_id: int, parent_time: Optional[float]):
+        self._update(parent_id, lambda layout: layout.add_child(recording_id, parent_id, parent_time))
+        with self.lock:
+            self._evict()
+
+    def set_duration(self, recording_id: int, duration: Optional[float]):
+        self._update(recording_id, lambda layout: layout.set_duration(recording_id, duration))
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def _update(self, recording_id: int, apply):
+        with self.lock:
+            for entry in self.entries.values():
+                if recording_id in entry.layout:
+                    start_time = time.perf_counter()
+                    apply(entry.layout)
+                    entry.body = entry.etag = None
+                    LAYOUT_COMPUTE_LATENCY.labels(mode="incremental").observe(time.perf_counter() - start_time)
+
+    def _evict(self):
+        while self.entries and sum(entry.size for entry in self.entries.values()) > self.max_bytes:
+            self.entries.popitem(last=False)
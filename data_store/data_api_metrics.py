@@ -0,0 +1,84 @@
+from prometheus_client import Counter, Gauge, Histogram
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+# Time to first image spans transcription, prompting and a Fooocus render
+END_TO_END_BUCKETS = (1, 2.5, 5, 10, 15, 20, 30, 45, 60, 90, 120, 180, 300, 600)
+
+REQUEST_LATENCY = Histogram(
+    "branches_data_api_request_seconds",
+    "Latency of data API requests by route",
+    ["method", "route", "status"],
+    buckets=LATENCY_BUCKETS,
+)
+PROCESSOR_REQUEST_LATENCY = Histogram(
+    "branches_data_api_processor_request_seconds",
+    "Round trip of handing a recording over to the audio processor",
+    buckets=LATENCY_BUCKETS,
+)
+PROCESSOR_REQUEST_FAILURES = Counter(
+    "branches_data_api_processor_request_failures_total",
+    "Number of failed hand-overs to the audio processor",
+)
+TIME_TO_FIRST_IMAGE = Histogram(
+    "branches_recording_time_to_first_image_seconds",
+    "Time from a recording being created to its first completed image",
+    buckets=END_TO_END_BUCKETS,
+)
+PROCESSING_JOBS_QUEUED = Gauge(
+    "branches_data_api_processing_jobs_queued",
+    "Number of processing jobs waiting for a worker",
+    ["kind"],
+)
+PROCESSING_JOB_OUTCOMES = Counter(
+    "branches_data_api_processing_job_outcomes_total",
+    "Processing jobs by kind and outcome, retried and expired leases included",
+    ["kind", "outcome"],
+)
+TREE_CACHE_REQUESTS = Counter(
+    "branches_data_api_tree_cache_requests_total",
+    "Tree requests by cache result: hit, miss, or not_modified when a cached ETag matched",
+    ["result"],
+)
+TREE_CACHE_ENTRIES = Gauge(
+    "branches_data_api_tree_cache_entries",
+    "Number of serialized trees in the tree cache",
+)
+TREE_CACHE_BYTES = Gauge(
+    "branches_data_api_tree_cache_bytes",
+    "Approximate memory held by the tree cache",
+)
+LAYOUT_REQUESTS = Counter(
+    "branches_data_api_layout_requests_total",
+    "Layout requests by cache result: hit, miss, or not_modified when a cached ETag matched",
+    ["result"],
+)
+LAYOUT_COMPUTE_LATENCY = Histogram(
+    "branches_data_api_layout_compute_seconds",
+    "Time to lay out a whole tree, or to update a cached layout for one change",
+    ["mode"],
+    buckets=LATENCY_BUCKETS,
+)
+LAYOUT_CACHE_ENTRIES = Gauge(
+    "branches_data_api_layout_cache_entries",
+    "Number of tree layouts in the layout cache",
+)
+LAYOUT_CACHE_BYTES = Gauge(
+    "branches_data_api_layout_cache_bytes",
+    "Approximate memory held by the layout cache",
+)
+AUDIO_TRANSCODE_LATENCY = Histogram(
+    "branches_data_api_audio_transcode_seconds",
+    "Time to transcode an uploaded recording, by target format",
+    ["format"],
+    buckets=END_TO_END_BUCKETS,
+)
+COMPACTION_ITEMS = Counter(
+    "branches_data_api_compaction_items_total",
+    "Items handled by compaction runs, by task",
+    ["task"],
+)
+COMPACTION_LATENCY = Histogram(
+    "branches_data_api_compaction_seconds",
+    "Duration of compaction runs",
+    buckets=END_TO_END_BUCKETS,
+)
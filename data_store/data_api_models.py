@@ -19,6 +19,20 @@ class TranscriptionUpdate(BaseModel):
     transcription: str
 
 
+class VoiceActivityUpdate(BaseModel):
+    status: str
+    duration: Optional[float] = None
+    speech_duration: Optional[float] = None
+
+    @field_validator("status")
+    @classmethod
+    def validate_status(cls, v):
+        valid_statuses = ["speech", "empty"]
+        if v not in valid_statuses:
+            raise ValueError(f"status must be one of: {', '.join(valid_statuses)}")
+        return v
+
+
 class PromptsUpdate(BaseModel):
     prompts: List[str]
 
@@ -31,6 +45,8 @@ class ImageGenerationCreate(BaseModel):
     prompt: str
     status: str = "pending"
     reason: Optional[str] = None
+    speculative: bool = False
+    variant: Optional[str] = None
 
     @field_validator("image_file_path")
     @classmethod
@@ -42,7 +58,7 @@ class ImageGenerationCreate(BaseModel):
     @field_validator("status")
     @classmethod
     def validate_status(cls, v):
-        valid_statuses = ["pending", "generating", "completed", "failed"]
+        valid_statuses = ["pending", "generating", "completed", "failed", "cancelled"]
         if v not in valid_statuses:
             raise ValueError(f"status must be one of: {', '.join(valid_statuses)}")
         return v
@@ -68,7 +84,7 @@ class ImageGenerationUpdate(BaseModel):
     @classmethod
     def validate_status(cls, v):
         if v is not None:
-            valid_statuses = ["pending", "generating", "completed", "failed"]
+            valid_statuses = ["pending", "generating", "completed", "failed", "cancelled"]
             if v not in valid_statuses:
                 raise ValueError(f"status must be one of: {', '.join(valid_statuses)}")
         return v
@@ -82,4 +98,59 @@ class BatchImageGenerationCreate(BaseModel):
     def validate_generations(cls, v):
         if not v:
             raise ValueError("generations list cannot be empty")
-        return v
\ No newline at end of file
+        return v
+
+class JobClaim(BaseModel):
+    worker_id: str
+    capabilities: List[str]
+    lease_seconds: float = 60
+
+    @field_validator("capabilities")
+    @classmethod
+    def validate_capabilities(cls, v):
+        valid_capabilities = ["whisper", "llm", "image"]
+        if not v or any(capability not in valid_capabilities for capability in v):
+            raise ValueError(f"capabilities must be some of: {', '.join(valid_capabilities)}")
+        return v
+
+
+class JobHeartbeat(BaseModel):
+    worker_id: str
+    lease_seconds: float = 60
+
+
+class JobComplete(BaseModel):
+    worker_id: str
+    result: Dict = {}
+
+
+class JobFail(BaseModel):
+    worker_id: str
+    error: str
+    retry: bool = True
+
+
+class CompactionRequest(BaseModel):
+    image_age_days: float = 7
+    image_format: str = "webp"
+    stale_row_days: float = 2
+    cold_tree_days: float = 30
+    orphan_grace_hours: float = 1
+    tasks: Optional[List[str]] = None
+    dry_run: bool = False
+
+    @field_validator("image_format")
+    @classmethod
+    def validate_image_format(cls, v):
+        valid_formats = ["webp", "avif"]
+        if v not in valid_formats:
+            raise ValueError(f"image_format must be one of: {', '.join(valid_formats)}")
+        return v
+
+    @field_validator("tasks")
+    @classmethod
+    def validate_tasks(cls, v):
+        valid_tasks = ["reencode_images", "purge_stale_rows", "archive_cold_trees", "purge_orphans", "optimize_database"]
+        if v is not None and any(task not in valid_tasks for task in v):
+            raise ValueError(f"tasks must be some of: {', '.join(valid_tasks)}")
+        return v
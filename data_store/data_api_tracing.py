@@ -0,0 +1,44 @@
+import os
+from typing import Optional
+from opentelemetry import trace, propagate, context
+from opentelemetry.context import Context
+from opentelemetry.sdk.resources import Resource
+from opentelemetry.sdk.trace import TracerProvider
+from opentelemetry.sdk.trace.export import BatchSpanProcessor, ConsoleSpanExporter
+
+tracer = trace.get_tracer("branches.data_api")
+
+
+def configure_tracing(service_name: str):
+    """Export spans to an OTLP collector or, as a local stand-in, to a JSON lines file"""
+    provider = TracerProvider(resource=Resource.create({"service.name": service_name}))
+
+    otlp_endpoint = os.getenv("OTEL_EXPORTER_OTLP_ENDPOINT")
+    trace_file_path = os.getenv("TRACE_FILE_PATH")
+    if otlp_endpoint:
+        from opentelemetry.exporter.otlp.proto.http.trace_exporter import OTLPSpanExporter
+
+        provider.add_span_processor(BatchSpanProcessor(OTLPSpanExporter()))
+    if trace_file_path:
+        provider.add_span_processor(
+            BatchSpanProcessor(
+                ConsoleSpanExporter(
+                    out=open(trace_file_path, "a"),
+                    formatter=lambda span: span.to_json(indent=None) + "\n",
+                )
+            )
+        )
+
+    trace.set_tracer_provider(provider)
+
+
+def inject_trace_headers(headers: Optional[dict] = None) -> dict:
+    """Copy of headers with the current trace context (W3C traceparent) added"""
+    carrier = dict(headers or {})
+    propagate.inject(carrier)
+    return carrier
+
+
+def extract_trace_context(carrier: Optional[dict]) -> Context:
+    """Context of the carrier's trace, falling back to the current one when it has none"""
+    return propagate.extract(carrier or {}, context=context.get_current())
@@ -1,5 +1,6 @@
 from peewee import *
 from playhouse.sqlite_ext import *
+from playhouse.migrate import SqliteMigrator, migrate
 import datetime
 import os
 from dotenv import load_dotenv
@@ -19,6 +20,8 @@ class AudioRecording(BaseModel):
         table_name = "audio_recordings"
 
     audio_file_path = TextField()
+    # Copy of uploaded audio in a format quick to seek for playback
+    playback_file_path = TextField(null=True)
     created_date = DateTimeField(default=datetime.datetime.now)
     updated_date = DateTimeField(default=datetime.datetime.now)
     transcription = TextField(null=True)
@@ -28,6 +31,10 @@ class AudioRecording(BaseModel):
     )
     parent_time = FloatField(null=True)
     duration = FloatField(null=True)
+    # Seconds of speech found by voice activity detection, prompts are counted from it
+    speech_duration = FloatField(null=True)
+    # "speech", or "empty" when nothing was said and the recording was not processed further
+    status = TextField(null=True)
 
     def save(self, *args, **kwargs):
         self.updated_date = datetime.datetime.now()
@@ -43,6 +50,32 @@ class AudioRecording(BaseModel):
             AudioRecording.parent_audio_recording == self
         )
 
+    @classmethod
+    def subtree_ids(cls, root_id: int):
+        """Query of the ids of a recording and all its descendants, as one recursive CTE"""
+        base = cls.select(cls.id).where(cls.id == root_id).cte("subtree", recursive=True, columns=("id",))
+        children = cls.alias()
+        descendants = children.select(children.id).join(
+            base, on=(children.parent_audio_recording == base.c.id)
+        )
+        subtree = base.union_all(descendants)
+        return subtree.select_from(subtree.c.id)
+
+    @classmethod
+    def root_id(cls, recording_id: int):
+        """Id of the root of the tree a recording belongs to, walking up its parents as one recursive CTE"""
+        base = (
+            cls.select(cls.id, cls.parent_audio_recording)
+            .where(cls.id == recording_id)
+            .cte("ancestors", recursive=True, columns=("id", "parent_id"))
+        )
+        parents = cls.alias()
+        ancestors = parents.select(parents.id, parents.parent_audio_recording).join(
+            base, on=(parents.id == base.c.parent_id)
+        )
+        lineage = base.union_all(ancestors)
+        return lineage.select_from(lineage.c.id).where(lineage.c.parent_id.is_null()).bind(cls._meta.database).scalar()
+
     def get_tree_recursive(self, recording, tree_items: set["AudioRecording"]):
         if recording not in tree_items:
             tree_items.add(recording)
@@ -71,9 +104,148 @@ class RecordingImageGeneration(BaseModel):
             ("generating", "generating"),
             ("completed", "completed"),
             ("failed", "failed"),
+            ("cancelled", "cancelled"),
         ],
     )
+    # Rendered ahead of time while the GPU was idle, e.g. an extra style or seed of an existing prompt
+    speculative = BooleanField(default=False)
+    variant = TextField(null=True)
 
     def save(self, *args, **kwargs):
         self.updated_date = datetime.datetime.now()
         return super().save(*args, **kwargs)
+
+
+class ProcessingJob(BaseModel):
+    """A unit of processing work that workers claim from the data API under a lease"""
+
+    class Meta:
+        table_name = "processing_jobs"
+        indexes = ((("status", "kind", "priority"), False),)
+
+    kind = TextField(
+        choices=[
+            ("transcribe", "transcribe"),
+            ("prompts", "prompts"),
+            ("image", "image"),
+        ]
+    )
+    audio_recording = ForeignKeyField(AudioRecording, backref="processing_jobs")
+    image_generation = ForeignKeyField(
+        RecordingImageGeneration, backref="processing_jobs", null=True
+    )
+    created_date = DateTimeField(default=datetime.datetime.now)
+    updated_date = DateTimeField(default=datetime.datetime.now)
+    priority = IntegerField(default=0)
+    # Preempted jobs are claimed before all others, the jobs following them inherit it
+    urgent = BooleanField(default=False)
+    status = TextField(
+        default="queued",
+        choices=[
+            ("queued", "queued"),
+            ("leased", "leased"),
+            ("completed", "completed"),
+            ("failed", "failed"),
+            ("cancelled", "cancelled"),
+        ],
+    )
+    worker_id = TextField(null=True)
+    lease_expires = DateTimeField(null=True)
+    attempts = IntegerField(default=0)
+    error = TextField(null=True)
+    # W3C trace headers of the request that queued the job, so the worker continues its trace
+    trace_context = JSONField(null=True)
+
+    def save(self, *args, **kwargs):
+        self.updated_date = datetime.datetime.now()
+        return super().save(*args, **kwargs)
+
+
+class TreeArchive(BaseModel):
+    """A cold tree whose images and audio were moved into a pack file by compaction"""
+
+    class Meta:
+        table_name = "tree_archives"
+
+    root_audio_recording = ForeignKeyField(AudioRecording, backref="archives", unique=True)
+    created_date = DateTimeField(default=datetime.datetime.now)
+    archive_file_path = TextField()
+    file_count = IntegerField(default=0)
+    size = IntegerField(default=0)
+
+
+class RecordingSearch(FTS5Model):
+    """
+    Full-text index of recording transcriptions and prompts, one row per recording with the
+    recording id as rowid. The audio_recordings triggers in ensure_schema keep it in sync.
+    """
+
+    class Meta:
+        database = db
+        table_name = "recording_search"
+        options = {"tokenize": "porter unicode61"}
+
+    transcription = SearchField()
+    # The prompts JSON array flattened to one prompt per line, so snippets read as plain text
+    prompts = SearchField()
+
+
+# Flatten the prompts JSON of the row being written, the same way the backfill does
+SEARCH_PROMPTS_SQL = "(SELECT group_concat(value, char(10)) FROM json_each({row}.prompts))"
+SEARCH_TRIGGERS = [
+    f"""
+    CREATE TRIGGER IF NOT EXISTS audio_recordings_search_insert
+    AFTER INSERT ON audio_recordings BEGIN
+        INSERT INTO recording_search (rowid, transcription, prompts)
+        VALUES (new.id, new.transcription, {SEARCH_PROMPTS_SQL.format(row="new")});
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS audio_recordings_search_update
+    AFTER UPDATE OF transcription, prompts ON audio_recordings BEGIN
+        UPDATE recording_search
+        SET transcription = new.transcription, prompts = {SEARCH_PROMPTS_SQL.format(row="new")}
+        WHERE rowid = new.id;
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS audio_recordings_search_delete
+    AFTER DELETE ON audio_recordings BEGIN
+        DELETE FROM recording_search WHERE rowid = old.id;
+    END
+    """,
+]
+
+
+def ensure_search_index():
+    """Create the full-text index and its triggers, indexing existing recordings on creation"""
+    with db.atomic():
+        if not RecordingSearch.table_exists():
+            RecordingSearch.create_table()
+            db.execute_sql(
+                "INSERT INTO recording_search (rowid, transcription, prompts) "
+                f"SELECT id, transcription, {SEARCH_PROMPTS_SQL.format(row='audio_recordings')} "
+                "FROM audio_recordings"
+            )
+        for trigger in SEARCH_TRIGGERS:
+            db.execute_sql(trigger)
+
+
+def ensure_schema():
+    """Create missing tables and add columns introduced since the database was created"""
+    models = [AudioRecording, RecordingImageGeneration, ProcessingJob, TreeArchive]
+    db.create_tables(models)
+    migrator = SqliteMigrator(db)
+    operations = []
+    for model in models:
+        table_name = model._meta.table_name
+        existing_columns = {column.name for column in db.get_columns(table_name)}
+        for field in model._meta.sorted_fields:
+            if field.column_name in existing_columns:
+                continue
+            operations.append(migrator.add_column(table_name, field.column_name, field))
+            if field.index or field.unique:
+                operations.append(migrator.add_index(table_name, (field.column_name,), field.unique))
+    if operations:
+        migrate(*operations)
+    ensure_search_index()
@@ -1,5 +1,6 @@
-from data_model import db, AudioRecording, RecordingImageGeneration
+from data_model import db, AudioRecording, RecordingImageGeneration, ProcessingJob, TreeArchive, RecordingSearch, ensure_search_index
 
 db.connect()
-db.drop_tables([AudioRecording, RecordingImageGeneration])
-db.create_tables([AudioRecording, RecordingImageGeneration])
\ No newline at end of file
+db.drop_tables([RecordingSearch, AudioRecording, RecordingImageGeneration, ProcessingJob, TreeArchive])
+db.create_tables([AudioRecording, RecordingImageGeneration, ProcessingJob, TreeArchive])
+ensure_search_index()
\ No newline at end of file
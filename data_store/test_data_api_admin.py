@@ -0,0 +1,83 @@
+import datetime
+import os
+import zipfile
+import compaction
+import data_api
+import data_api_audio
+from compaction import CompactionOptions, archive_cold_trees
+from data_model import AudioRecording, RecordingImageGeneration, TreeArchive
+
+
+def test_admin_routes_are_disabled_without_token(client, monkeypatch):
+    monkeypatch.setattr(data_api, "ADMIN_TOKEN", None)
+
+    assert client.get("/admin/compaction").status_code == 403
+    assert client.post("/admin/compaction", json={}).status_code == 403
+
+
+def test_admin_routes_require_configured_token(client, monkeypatch):
+    monkeypatch.setattr(data_api, "ADMIN_TOKEN", "secret")
+
+    assert client.get("/admin/compaction", headers={"X-Admin-Token": "wrong"}).status_code == 403
+    assert client.get("/admin/compaction", headers={"X-Admin-Token": "secret"}).status_code == 200
+
+
+def test_audio_of_archived_tree_is_restored_on_access(client, monkeypatch, tmp_path):
+    audio_path, archive_path = tmp_path / "audio", tmp_path / "archive"
+    audio_path.mkdir()
+    archive_path.mkdir()
+    monkeypatch.setattr(data_api_audio, "AUDIO_STORAGE_PATH", str(audio_path))
+    monkeypatch.setattr(compaction, "AUDIO_STORAGE_PATH", str(audio_path))
+    monkeypatch.setattr(compaction, "ARCHIVE_PATH", str(archive_path))
+    root = AudioRecording.create(audio_file_path="root.wav")
+    child = AudioRecording.create(audio_file_path="child.wav", parent_audio_recording=root, parent_time=1)
+    with zipfile.ZipFile(archive_path / "tree.zip", "w") as pack:
+        pack.writestr("audio/root.wav", b"root")
+        pack.writestr("audio/child.wav", b"child")
+    TreeArchive.create(root_audio_recording=root, archive_file_path="tree.zip", file_count=2)
+
+    response = client.get(f"/recordings/{child.id}/audio")
+
+    assert response.status_code == 200
+    assert response.content == b"child"
+    assert (audio_path / "root.wav").read_bytes() == b"root"
+    assert not TreeArchive.select().exists()
+    assert not os.path.exists(archive_path / "tree.zip")
+
+
+def test_missing_audio_of_unarchived_tree_is_not_found(client, monkeypatch, tmp_path):
+    monkeypatch.setattr(data_api_audio, "AUDIO_STORAGE_PATH", str(tmp_path))
+    recording = AudioRecording.create(audio_file_path="missing.wav")
+
+    assert client.get(f"/recordings/{recording.id}/audio").status_code == 404
+
+
+def test_archived_tree_keeps_recorder_audio_and_restores_images_on_access(client, monkeypatch, tmp_path):
+    paths = {name: tmp_path / name for name in ("images", "audio", "archive")}
+    for path in paths.values():
+        path.mkdir()
+    monkeypatch.setattr(compaction, "IMAGE_GENERATIONS_PATH", str(paths["images"]))
+    monkeypatch.setattr(compaction, "AUDIO_STORAGE_PATH", str(paths["audio"]))
+    monkeypatch.setattr(compaction, "ARCHIVE_PATH", str(paths["archive"]))
+    root = AudioRecording.create(audio_file_path="recording-root.wav")
+    child = AudioRecording.create(audio_file_path="recorder-take.wav", parent_audio_recording=root, parent_time=1)
+    RecordingImageGeneration.create(
+        audio_recording_id=child, prompt="tree", image_file_path="child.png", status="completed"
+    )
+    for name in ("audio/recording-root.wav", "audio/recorder-take.wav", "images/child.png"):
+        (tmp_path / name).write_bytes(b"data")
+    long_ago = datetime.datetime.now() - datetime.timedelta(days=60)
+    AudioRecording.update(updated_date=long_ago).execute()
+    RecordingImageGeneration.update(updated_date=long_ago).execute()
+
+    assert archive_cold_trees(CompactionOptions(cold_tree_days=30))["files"] == 2
+
+    assert (paths["audio"] / "recorder-take.wav").exists()
+    assert not (paths["audio"] / "recording-root.wav").exists()
+    assert not (paths["images"] / "child.png").exists()
+
+    assert client.get(f"/recordings/{root.id}/tree").status_code == 200
+
+    assert (paths["images"] / "child.png").read_bytes() == b"data"
+    assert (paths["audio"] / "recording-root.wav").exists()
+    assert not TreeArchive.select().exists()
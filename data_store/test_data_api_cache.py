@@ -0,0 +1,64 @@
+from data_api_cache import TreeCache, compute_etag, etag_matches
+
+
+def test_etag_matches_weak_lists_and_wildcard():
+    etag = compute_etag(b"tree")
+
+    assert etag_matches(etag, etag)
+    assert etag_matches(f'"other", W/{etag}', etag)
+    assert etag_matches("*", etag)
+    assert not etag_matches('"other"', etag)
+    assert not etag_matches(None, etag)
+
+
+def test_invalidate_drops_every_tree_containing_recording():
+    cache = TreeCache(max_bytes=10_000)
+    cache.put(1, b"[1,2,3]", [1, 2, 3])
+    cache.put(2, b"[2,3]", [2, 3])
+    cache.put(4, b"[4]", [4])
+
+    cache.invalidate(3)
+
+    assert cache.get(1) is None and cache.get(2) is None
+    assert cache.get(4) is not None
+    assert cache.total_bytes == cache.get(4).size
+
+
+def test_evicts_least_recently_used_over_budget():
+    entry_size = TreeCache(max_bytes=10_000).put(0, b"x" * 100, [0]).size
+    cache = TreeCache(max_bytes=2 * entry_size)
+    cache.put(1, b"x" * 100, [1])
+    cache.put(2, b"x" * 100, [2])
+    cache.get(1)
+
+    cache.put(3, b"x" * 100, [3])
+
+    assert cache.get(2) is None
+    assert cache.get(1) is not None and cache.get(3) is not None
+
+
+def test_tree_too_large_is_not_cached():
+    cache = TreeCache(max_bytes=10)
+
+    entry = cache.put(1, b"x" * 100, [1])
+
+    assert entry.etag == compute_etag(b"x" * 100)
+    assert cache.get(1) is None
+
+
+def test_tree_endpoint_revalidates_and_changes_after_write(client):
+    root_id = client.post("/recordings/", json={"audio_file_path": "root.wav"}).json()["id"]
+    first = client.get(f"/recordings/{root_id}/tree")
+    etag = first.headers["ETag"]
+
+    assert client.get(f"/recordings/{root_id}/tree", headers={"If-None-Match": etag}).status_code == 304
+
+    client.post(
+        "/recordings/",
+        json={"audio_file_path": "child.wav", "parent_audio_recording_id": root_id, "parent_time": 1.0},
+    )
+    changed = client.get(f"/recordings/{root_id}/tree", headers={"If-None-Match": etag})
+
+    assert changed.status_code == 200
+    assert changed.headers["ETag"] != etag
+    assert len(changed.json()) == 2
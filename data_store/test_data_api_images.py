@@ -0,0 +1,37 @@
+from prometheus_client import REGISTRY
+
+
+def first_image_count() -> float:
+    return REGISTRY.get_sample_value("branches_recording_time_to_first_image_seconds_count") or 0
+
+
+def create_image_generation(client, recording_id: int, **fields) -> int:
+    return client.post(
+        f"/recordings/{recording_id}/image-generations/",
+        json={"audio_recording_id": recording_id, "prompt": "tree", **fields},
+    ).json()["id"]
+
+
+def complete_image_generation(client, recording_id: int, image_generation_id: int):
+    response = client.put(
+        f"/recordings/{recording_id}/image-generations/{image_generation_id}",
+        json={"status": "completed", "image_file_path": f"{image_generation_id}.png"},
+    )
+    assert response.status_code == 200
+
+
+def test_time_to_first_image_only_counts_first_pass_images(client):
+    recording_id = client.post("/recordings/", json={"audio_file_path": "recording.wav"}).json()["id"]
+    speculative_id = create_image_generation(client, recording_id, speculative=True, variant="seed:1")
+    reprocessed_id = create_image_generation(client, recording_id, variant="reprocess:test")
+    first_id = create_image_generation(client, recording_id)
+    second_id = create_image_generation(client, recording_id)
+    count = first_image_count()
+
+    complete_image_generation(client, recording_id, speculative_id)
+    complete_image_generation(client, recording_id, reprocessed_id)
+    assert first_image_count() == count
+
+    complete_image_generation(client, recording_id, first_id)
+    complete_image_generation(client, recording_id, second_id)
+    assert first_image_count() == count + 1
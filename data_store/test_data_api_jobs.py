@@ -0,0 +1,120 @@
+import datetime
+import pytest
+import data_api
+from data_model import ProcessingJob
+
+
+@pytest.fixture(autouse=True)
+def pull_mode(monkeypatch):
+    monkeypatch.setattr(data_api, "PROCESSING_MODE", "pull")
+
+
+def create_recording(client) -> int:
+    return client.post("/recordings/", json={"audio_file_path": "recording.wav"}).json()["id"]
+
+
+def claim(client, worker_id: str = "worker", capabilities: list[str] = ("whisper",), lease_seconds: float = 60):
+    return client.post(
+        "/jobs/claim",
+        json={"worker_id": worker_id, "capabilities": list(capabilities), "lease_seconds": lease_seconds},
+    )
+
+
+def complete(client, job: dict, result: dict, worker_id: str = "worker"):
+    return client.post(f"/jobs/{job['id']}/complete", json={"worker_id": worker_id, "result": result})
+
+
+def test_claim_leases_job_once(client):
+    recording_id = create_recording(client)
+
+    job = claim(client).json()
+
+    assert job["kind"] == "transcribe"
+    assert job["recording_id"] == recording_id
+    assert claim(client, "other").status_code == 204
+
+
+def test_claim_only_returns_kinds_of_capabilities(client):
+    create_recording(client)
+
+    assert claim(client, capabilities=["llm", "image"]).status_code == 204
+    assert claim(client, capabilities=["whisper"]).status_code == 200
+
+
+def test_completed_transcription_queues_prompts_then_images_in_prompt_order(client):
+    create_recording(client)
+    complete(client, claim(client).json(), {"transcription": "hello", "duration": 20, "status": "speech"})
+
+    prompts_job = claim(client, capabilities=["llm"]).json()
+    assert prompts_job["transcription"] == "hello"
+    complete(client, prompts_job, {"prompts": ["first", "second"]})
+
+    first = claim(client, capabilities=["image"]).json()
+    second = claim(client, capabilities=["image"]).json()
+    assert (first["prompt"], second["prompt"]) == ("first", "second")
+
+
+def test_empty_recording_queues_no_prompts(client):
+    create_recording(client)
+    complete(client, claim(client).json(), {"transcription": "", "duration": 20, "status": "empty"})
+
+    assert claim(client, capabilities=["llm"]).status_code == 204
+
+
+def test_heartbeat_and_complete_refuse_other_worker(client):
+    create_recording(client)
+    job = claim(client).json()
+
+    heartbeat = client.post(f"/jobs/{job['id']}/heartbeat", json={"worker_id": "other", "lease_seconds": 60})
+    assert heartbeat.status_code == 409
+    assert complete(client, job, {"transcription": ""}, worker_id="other").status_code == 409
+
+
+def test_expired_lease_is_claimed_again(client):
+    create_recording(client)
+    job = claim(client).json()
+    ProcessingJob.update(lease_expires=datetime.datetime.now() - datetime.timedelta(seconds=1)).where(
+        ProcessingJob.id == job["id"]
+    ).execute()
+
+    reclaimed = claim(client, "other").json()
+
+    assert reclaimed["id"] == job["id"]
+    assert reclaimed["attempts"] == 2
+    # The first worker lost its lease and its result is refused
+    assert complete(client, job, {"transcription": "late"}).status_code == 409
+
+
+def test_failed_job_is_retried_until_out_of_attempts(client):
+    create_recording(client)
+    for attempt in range(1, data_api.MAX_JOB_ATTEMPTS + 1):
+        job = claim(client).json()
+        assert job["attempts"] == attempt
+        failure = client.post(f"/jobs/{job['id']}/fail", json={"worker_id": "worker", "error": "boom"}).json()
+
+    assert failure["status"] == "failed"
+    assert claim(client).status_code == 204
+
+
+def test_cancel_drops_jobs_and_images_and_loses_the_lease(client):
+    recording_id = create_recording(client)
+    complete(client, claim(client).json(), {"transcription": "hello", "duration": 20, "status": "speech"})
+    complete(client, claim(client, capabilities=["llm"]).json(), {"prompts": ["first", "second"]})
+    leased = claim(client, capabilities=["image"]).json()
+
+    result = client.post(f"/recordings/{recording_id}/cancel").json()
+
+    assert (result["cancelled_jobs"], result["cancelled_images"]) == (2, 2)
+    assert claim(client, capabilities=["image"]).status_code == 204
+    heartbeat = client.post(f"/jobs/{leased['id']}/heartbeat", json={"worker_id": "worker", "lease_seconds": 60})
+    assert heartbeat.status_code == 409
+
+
+def test_preempted_recording_is_claimed_first(client):
+    first_id = create_recording(client)
+    second_id = create_recording(client)
+
+    assert client.post(f"/recordings/{second_id}/preempt").json()["urgent_jobs"] == 1
+
+    assert claim(client).json()["recording_id"] == second_id
+    assert claim(client).json()["recording_id"] == first_id
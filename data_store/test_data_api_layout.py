@@ -0,0 +1,58 @@
+import numpy as np
+from data_api_layout import TreeLayout
+
+
+def full_layout(layout: TreeLayout) -> TreeLayout:
+    """The layout recomputed from scratch out of the rows the incremental one holds"""
+    parent_ids = [int(layout.ids[row]) if row >= 0 else None for row in layout.parent_rows]
+    return TreeLayout(layout.root_id, layout.ids, parent_ids, layout.parent_times, layout.durations)
+
+
+def assert_same_layout(layout: TreeLayout):
+    expected = full_layout(layout)
+    np.testing.assert_allclose(layout.lengths, expected.lengths)
+    np.testing.assert_allclose(layout.origins, expected.origins, atol=1e-9)
+    np.testing.assert_allclose(layout.headings, expected.headings, atol=1e-9)
+    np.testing.assert_allclose(layout.points, expected.points, atol=1e-5)
+
+
+def test_added_children_match_full_layout():
+    layout = TreeLayout(1, [1], [None], [np.nan], [np.nan])
+
+    layout.add_child(2, 1, 3.0)
+    layout.add_child(3, 1, 14.0)
+    layout.add_child(4, 2, 1.0)
+    layout.add_child(5, 4, None)
+
+    assert layout.lengths[0] == 14.0
+    assert_same_layout(layout)
+
+
+def test_shorter_duration_moves_children_past_the_end():
+    layout = TreeLayout(1, [1], [None], [np.nan], [np.nan])
+    layout.add_child(2, 1, 12.0)
+    layout.add_child(3, 2, 2.0)
+    layout.add_child(4, 1, 2.0)
+    origin_before = layout.origins[1].copy()
+
+    layout.set_duration(1, 5.0)
+
+    assert not np.allclose(layout.origins[1], origin_before)
+    assert_same_layout(layout)
+
+
+def test_longer_duration_moves_children_clamped_to_the_end():
+    layout = TreeLayout(1, [1, 2, 3], [None, 1, 2], [np.nan, 8.0, 1.0], [5.0, np.nan, np.nan])
+
+    layout.set_duration(1, 9.0)
+
+    assert_same_layout(layout)
+
+
+def test_unset_duration_falls_back_to_children():
+    layout = TreeLayout(1, [1, 2], [None, 1], [np.nan, 20.0], [4.0, np.nan])
+
+    layout.set_duration(1, None)
+
+    assert layout.lengths[0] == 20.0
+    assert_same_layout(layout)
@@ -0,0 +1,6 @@
+def test_recording_list_limit_is_clamped(client):
+    for _ in range(3):
+        client.post("/recordings/", json={"audio_file_path": "recording.wav"})
+
+    assert len(client.get("/recordings/", params={"limit": -1}).json()) == 1
+    assert len(client.get("/recordings/", params={"limit": 2}).json()) == 2